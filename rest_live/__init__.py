@@ -1,12 +1,42 @@
+import zlib
+from typing import List
+
 default_app_config = "rest_live.apps.RestLiveConfig"
 
 DEFAULT_GROUP_BY_FIELD = "pk"
 
 
+GROUP_PREFIX = "RESOURCE-"
+
+
 def get_group_name(model_label) -> str:
-    return f"RESOURCE-{model_label}"
+    return f"{GROUP_PREFIX}{model_label}"
+
+
+def get_model_label(group_name) -> str:
+    return group_name[len(GROUP_PREFIX) :]
+
+
+def get_shard_names(group_name, shards) -> List[str]:
+    """
+    Names of every shard of a model group on the channel layer.
+    """
+    if shards <= 1:
+        return [group_name]
+    return [f"{group_name}-{shard}" for shard in range(shards)]
+
+
+def get_shard_name(group_name, channel_name, shards) -> str:
+    """
+    Name of the shard of a model group that the channel with the given name should join.
+    """
+    if shards <= 1:
+        return group_name
+    return f"{group_name}-{zlib.crc32(channel_name.encode('utf-8')) % shards}"
 
 
 CREATED = "CREATED"
 UPDATED = "UPDATED"
 DELETED = "DELETED"
+# Sent to windowed subscriptions when an instance changes position in the window.
+MOVED = "MOVED"
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from rest_live.settings import live_settings
+
+
+class AdmissionTimeout(Exception):
+    """
+    Raised when a subscribe request couldn't be admitted before its deadline.
+    """
+
+
+@dataclass
+class AdmissionStats:
+    # Subscribe requests currently being handled and waiting to be.
+    active: int
+    waiting: int
+    admitted: int
+    rejected: int
+    # Worst time a request spent waiting to be admitted, in seconds.
+    max_wait_time: float
+
+
+class AdmissionController:
+    """
+    Limits how many subscribe requests the connections served by one event loop handle at once, in total
+    and for each model. Subscribing evaluates the view's queryset, so when thousands of clients reconnect at
+    once, as after a deploy, this keeps them from overwhelming the database.
+
+    Requests over the limits queue in the order they arrive. A request which can't be admitted within
+    `timeout` seconds is rejected, and the client should retry it later.
+
+    Admission happens on the event loop, so there is one controller per loop. Use `get_admission_controller()`
+    rather than instantiating this directly.
+    """
+
+    def __init__(self, limit=None, model_limit=None, timeout=10):
+        self.limit = limit
+        self.model_limit = model_limit
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(limit) if limit else None
+        self.model_slots: Dict[str, asyncio.Semaphore] = dict()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def admit(self, models: Iterable[str]):
+        """
+        Wait for a slot for a request subscribing to `models`, and hold it for the duration of the
+        `async with` block. Raises `AdmissionTimeout` if the request can't be admitted in time.
+        """
+        semaphores = [] if self.slots is None else [self.slots]
+        if self.model_limit:
+            # Always acquired in the same order, so that requests for several models can't deadlock.
+            for model in sorted(set(models)):
+                semaphore = self.model_slots.get(model)
+                if semaphore is None:
+                    semaphore = self.model_slots[model] = asyncio.Semaphore(
+                        self.model_limit
+                    )
+                semaphores.append(semaphore)
+
+        queued = time.monotonic()
+        deadline = queued + self.timeout
+        acquired = []
+        self.waiting += 1
+        try:
+            for semaphore in semaphores:
+                if semaphore.locked():
+                    # Only a request that actually has to wait can run out of time.
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    await asyncio.wait_for(semaphore.acquire(), remaining)
+                else:
+                    await semaphore.acquire()
+                acquired.append(semaphore)
+        except asyncio.TimeoutError:
+            for semaphore in acquired:
+                semaphore.release()
+            self.rejected += 1
+            raise AdmissionTimeout()
+        except BaseException:
+            for semaphore in acquired:
+                semaphore.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.max_wait_time = max(self.max_wait_time, time.monotonic() - queued)
+        self.admitted += 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            for semaphore in acquired:
+                semaphore.release()
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            active=self.active,
+            waiting=self.waiting,
+            admitted=self.admitted,
+            rejected=self.rejected,
+            max_wait_time=self.max_wait_time,
+        )
+
+
+# Event loop -> admission controller.
+_controllers = weakref.WeakKeyDictionary()
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Get the admission controller for the running event loop as configured by `REST_LIVE["SUBSCRIBE_CONCURRENCY"]`
+    and `REST_LIVE["SUBSCRIBE_MODEL_CONCURRENCY"]`, or `None` if neither is set.
+    """
+    limit = live_settings.SUBSCRIBE_CONCURRENCY
+    model_limit = live_settings.SUBSCRIBE_MODEL_CONCURRENCY
+    if not limit and not model_limit:
+        return None
+    timeout = live_settings.SUBSCRIBE_QUEUE_TIMEOUT
+    loop = asyncio.get_running_loop()
+    controller = _controllers.get(loop)
+    if controller is None or (
+        controller.limit,
+        controller.model_limit,
+        controller.timeout,
+    ) != (limit, model_limit, timeout):
+        controller = _controllers[loop] = AdmissionController(
+            limit, model_limit, timeout
+        )
+    return controller
+
+
+class SnapshotCache:
+    """
+    Short-lived cache of the snapshots taken when subscribing, shared by every connection in the process,
+    so that a burst of identical subscribe requests evaluates the view's queryset once. Requests that miss
+    while another thread is taking the same snapshot wait for it rather than taking their own.
+
+    A process only hears of changes to a model while it's in the model's group, so snapshots are only
+    cached while a connection in the process is subscribed to the model, counted by `listen()` and
+    `unlisten()`. Snapshots of a model are dropped whenever the process saves or deletes an instance of it
+    or receives an event for it, and when the last subscription to it ends. Otherwise they expire after
+    `ttl` seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # Model label -> key -> (expiry, snapshot)
+        self.entries: Dict[str, Dict[Hashable, Tuple[float, Any]]] = dict()
+        # (model label, key) -> event set when the snapshot being taken is ready.
+        self.pending: Dict[Tuple[str, Hashable], threading.Event] = dict()
+        # Model label -> number of subscriptions to the model in the process.
+        self.listeners: Dict[str, int] = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_take(self, model_label, key, take: Callable[[], Any]):
+        while True:
+            with self.lock:
+                entry = self.entries.get(model_label, {}).get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return entry[1]
+                if not self.listeners.get(model_label):
+                    # Events for the model aren't reaching the process, so nothing would invalidate the snapshot.
+                    self.misses += 1
+                    return take()
+                pending = self.pending.get((model_label, key))
+                if pending is None:
+                    pending = self.pending[(model_label, key)] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is taking this snapshot. If it fails, or the snapshot is invalidated
+            # before we get to it, take it ourselves on the next iteration.
+            pending.wait(self.ttl)
+
+        try:
+            snapshot = take()
+            with self.lock:
+                if self.pending.get((model_label, key)) is pending:
+                    self.entries.setdefault(model_label, {})[key] = (
+                        time.monotonic() + self.ttl,
+                        snapshot,
+                    )
+            return snapshot
+        finally:
+            with self.lock:
+                if self.pending.get((model_label, key)) is pending:
+                    del self.pending[(model_label, key)]
+            pending.set()
+
+    def invalidate(self, model_label):
+        with self.lock:
+            self._invalidate(model_label)
+
+    def _invalidate(self, model_label):
+        self.entries.pop(model_label, None)
+        # Snapshots being taken may predate the change, so they mustn't be stored.
+        for pending_key in [k for k in self.pending if k[0] == model_label]:
+            del self.pending[pending_key]
+
+    def listen(self, model_label):
+        """
+        Count a subscription to a model, whose events the process now receives.
+        """
+        with self.lock:
+            self.listeners[model_label] = self.listeners.get(model_label, 0) + 1
+
+    def unlisten(self, model_label):
+        with self.lock:
+            count = self.listeners.get(model_label, 0) - 1
+            if count > 0:
+                self.listeners[model_label] = count
+                return
+            self.listeners.pop(model_label, None)
+            self._invalidate(model_label)
+
+
+_snapshot_cache: Optional[SnapshotCache] = None
+_snapshot_cache_lock = threading.Lock()
+
+
+def get_snapshot_cache() -> Optional[SnapshotCache]:
+    """
+    Get the process-wide snapshot cache configured by `REST_LIVE["SNAPSHOT_CACHE_TTL"]`, or `None` if it's disabled.
+    """
+    global _snapshot_cache
+    ttl = live_settings.SNAPSHOT_CACHE_TTL
+    cache = _snapshot_cache
+    if cache is not None and cache.ttl == ttl:
+        return cache
+    with _snapshot_cache_lock:
+        if _snapshot_cache is None or _snapshot_cache.ttl != ttl:
+            _snapshot_cache = SnapshotCache(ttl) if ttl else None
+        return _snapshot_cache
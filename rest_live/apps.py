@@ -1,5 +1,23 @@
 from django.apps import AppConfig
 
+from rest_live.settings import live_settings
+
 
 class RestLiveConfig(AppConfig):
     name = "rest_live"
+
+    def ready(self):
+        if live_settings.PROFILE:
+            from rest_live import profiling
+
+            profiling.install()
+
+        if live_settings.SLOW_QUERY_THRESHOLD is not None:
+            from rest_live import instrumentation
+
+            instrumentation.install_slow_query_log(
+                live_settings.SLOW_QUERY_THRESHOLD / 1000,
+                explain_interval=live_settings.SLOW_QUERY_EXPLAIN_INTERVAL,
+                explains_per_minute=live_settings.SLOW_QUERY_EXPLAINS_PER_MINUTE,
+                max_findings=live_settings.SLOW_QUERY_MAX_FINDINGS,
+            )
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+from rest_live.settings import live_settings
+
+MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    entries: int
+    hits: int
+    misses: int
+
+
+class SerializerCache:
+    """
+    Least-recently-used cache of serialized instances, shared by every subscription in the process.
+    Entries are evicted when there are more than `max_entries` of them, or once they are older than
+    `ttl` seconds.
+
+    Keys must identify everything the serialized data depends on, including the version of the row,
+    since entries are never invalidated by saves. See `SubscriptionConsumer.serialize`.
+    """
+
+    def __init__(self, max_entries=1000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Any:
+        """
+        Get the cached data for `key`, or `MISSING`.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, data):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(len(self.entries), self.hits, self.misses)
+
+
+_cache: Optional[SerializerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_serializer_cache() -> Optional[SerializerCache]:
+    """
+    Get the process-wide cache configured by `REST_LIVE["SERIALIZER_CACHE_SIZE"]`, or `None` if it's disabled.
+    """
+    global _cache
+    size, ttl = live_settings.SERIALIZER_CACHE_SIZE, live_settings.SERIALIZER_CACHE_TTL
+    cache = _cache
+    if cache is not None and (cache.max_entries, cache.ttl) == (size, ttl):
+        return cache
+    with _cache_lock:
+        if _cache is None or (_cache.max_entries, _cache.ttl) != (size, ttl):
+            _cache = SerializerCache(size, ttl) if size else None
+        return _cache
@@ -1,16 +1,54 @@
-from typing import Any, Dict, Type, List, Union, Set
-from dataclasses import dataclass
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Any, Dict, Type, List, Optional, Tuple, Union, Set
+from dataclasses import dataclass, field
 
 from asgiref.sync import async_to_sync
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
 from channels.generic.websocket import JsonWebsocketConsumer
+from django.db import router
 from django.http import Http404
 from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from rest_framework.renderers import JSONRenderer
 
-from rest_live import get_group_name, DELETED, UPDATED, CREATED
+from rest_live import (
+    get_group_name,
+    get_model_label,
+    get_shard_name,
+    instrumentation,
+    plans,
+    predicates,
+    rendering,
+    signals,
+    DELETED,
+    UPDATED,
+    CREATED,
+    MOVED,
+)
+from rest_live.admission import (
+    AdmissionTimeout,
+    get_admission_controller,
+    get_snapshot_cache,
+)
+from rest_live.cache import MISSING, get_serializer_cache
+from rest_live.hub import get_hub
+from rest_live.index import IndexKey, index_attnames, index_key
+from rest_live.pool import get_evaluation_pool, get_pool
+from rest_live.scheduler import get_scheduler
+from rest_live.settings import live_settings
+from rest_live.shared import SharedState, shared_states
+from rest_live.windows import Window, parse_ordering
 from rest_live.mixins import RealtimeMixin
 
 KwargType = Dict[str, Union[int, str]]
 
+MODEL_EVENTS = ("model.saved", "model.deleted")
+# Key of the decoded content of a websocket message, when admission control has already decoded it.
+DECODED_CONTENT = "rest_live.content"
+
 
 @dataclass
 class Subscription:
@@ -31,6 +69,99 @@ class Subscription:
     # in django-rest-live
     pks_to_lookup_in_queryset: Dict[int, object]
 
+    # For views with `live_index_fields`, a filter value that every instance in this subscription's
+    # queryset must have, as an (attname, value) pair. See `rest_live.index`.
+    index_key: Optional[IndexKey] = None
+
+    # Whether every instance of the model is in this subscription's queryset, so that broadcasts don't
+    # need to check membership. See `RealtimeMixin.live_all_visible`.
+    all_visible: bool = False
+
+    # Identifies, along with the serializer class, what the serializer sees of the request. `None` when
+    # the output only depends on the instance. Subscriptions on a connection with the same serializer
+    # class and fingerprint share serialized instances. See `SubscriptionConsumer.serialize_change`.
+    context_fingerprint: Optional[str] = None
+
+    # State shared with identical subscriptions in the process, and its key in `shared_states`.
+    # See `RealtimeMixin.live_shared_state`.
+    shared: Optional[SharedState] = field(default=None, repr=False, compare=False)
+    shared_key: Optional[Tuple] = field(default=None, repr=False, compare=False)
+
+    # For windowed subscriptions, the instances in the window and its boundary. `pks_to_lookup_in_queryset`
+    # then only holds the instances in the window. See `rest_live.windows`.
+    window: Optional[Window] = field(default=None, repr=False, compare=False)
+
+    # (model label, action) -> broadcast envelope rendered up to the instance. See `rest_live.rendering`.
+    envelopes: Dict[Tuple[str, str], Optional[str]] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+
+@dataclass
+class Broadcast:
+    """
+    A change to send to a subscription, before it's rendered.
+    """
+
+    subscription: Subscription
+    # Index of the change in `ChangeSet.instance_changes`.
+    position: int
+    action: str
+    instance_data: dict
+    renderer: Any
+    # Position of the instance in a windowed subscription's window once the broadcast is applied.
+    index: Optional[int] = None
+
+
+@dataclass
+class ChangeSet:
+    """
+    Changes to instances of one model, evaluated together against each of a consumer's subscriptions to it.
+    """
+
+    model_label: str
+    event_type: str
+    # (pk, is_deleted) for each changed instance, in the order of their latest events.
+    instance_changes: List[Tuple[Any, bool]] = field(default_factory=list)
+    # pk -> values of the index fields of saved instances, where the event carried them.
+    values: Dict[Any, Optional[dict]] = field(default_factory=dict)
+    # pk -> commit marker of saved instances, where the event carried one.
+    versions: Dict[Any, Any] = field(default_factory=dict)
+    # pk -> ID of the latest event for the instance, where the event carried one.
+    event_ids: Dict[Any, str] = field(default_factory=dict)
+    # pks of instances whose latest event was sent for a saved related instance. See `RealtimeMixin.live_depends_on`.
+    related_pks: Set[Any] = field(default_factory=set)
+    # pks of instances whose latest event was sent for their creation.
+    created_pks: Set[Any] = field(default_factory=set)
+    # Changed instances fetched for in-memory filtering, by database alias and related lookups, shared
+    # between subscriptions.
+    fetched: Dict[Tuple, Dict[Any, Any]] = field(default_factory=dict)
+    # Database that the changes are read from. See `SubscriptionConsumer.read_database`.
+    database: Optional[str] = None
+    database_chosen: bool = False
+    # (serializer class, context fingerprint, pk) -> serialized data, shared between subscriptions.
+    serialized: Dict[Tuple[Any, Optional[str], Any], Any] = field(default_factory=dict)
+    # id(serialized data) -> (data, encoded payload), for payloads shared between subscriptions.
+    payloads: Dict[int, Tuple[Any, str]] = field(default_factory=dict)
+    # Guards the shared state above when subscriptions are evaluated in parallel.
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def saved_pks(self) -> List[Any]:
+        return [pk for pk, deleted in self.instance_changes if not deleted]
+
+    def payload(self, data, renderer) -> str:
+        """
+        Encode serialized data for a broadcast, once per data object: subscriptions which share
+        serialized data, for example through the serializer cache, share its encoding too.
+        """
+        entry = self.payloads.get(id(data))
+        if entry is not None and entry[0] is data:
+            return entry[1]
+        encoded = rendering.encode(data, renderer)
+        self.payloads[id(data)] = (data, encoded)
+        return encoded
+
 
 class SubscriptionConsumer(JsonWebsocketConsumer):
     """
@@ -44,6 +175,304 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
     registry: Dict[str, Type[RealtimeMixin]] = dict()
     public = True
 
+    # When set, model groups are joined once per process by a `FanoutHub`, which receives each event
+    # once and delivers it in memory, instead of adding every connection's channel to the group.
+    fanout_hub = False
+
+    # Seconds to wait for further model events after receiving one. Events received within the window
+    # are deduplicated and evaluated together, with one query per subscription. `0` disables batching.
+    batch_window = 0
+
+    # When set, identical broadcasts of a change to several of the connection's subscriptions are sent
+    # as one frame listing every subscription's request ID under `ids`.
+    merge_broadcasts = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hub_groups: List[str] = []
+        self.group_shards: Dict[str, str] = dict()
+        # Shard name -> number of subscriptions to its model group.
+        self.shard_subscriptions: Dict[str, int] = dict()
+        self.hub_messages = deque()
+        self.hub_event = None
+        self.layer_receive = None
+        self.next_message = None
+        self.held_message = None
+
+    async def __call__(self, scope, receive, send):
+        # Trailing save events are sent from the coalescer's thread on the loop consumers run on.
+        signals.set_server_loop(asyncio.get_running_loop())
+        await super().__call__(scope, receive, send)
+
+    @property
+    def channel_receive(self):
+        if self.batch_window:
+            return self.receive_batch
+        return self.receive_unbatched
+
+    @property
+    def receive_unbatched(self):
+        if self.fanout_hub:
+            return self.receive_from_channel_or_hub
+        return self._channel_receive
+
+    @channel_receive.setter
+    def channel_receive(self, value):
+        # Set by channels to receive from this consumer's channel on the channel layer.
+        self._channel_receive = value
+
+    async def receive_from_channel_or_hub(self):
+        """
+        Receive the next message for this consumer, either delivered by the fan-out hub or
+        sent directly to this consumer's channel.
+        """
+        if self.hub_event is None:
+            self.hub_event = asyncio.Event()
+
+        while not self.hub_messages:
+            self.hub_event.clear()
+            if self.layer_receive is None:
+                self.layer_receive = asyncio.ensure_future(self._channel_receive())
+            hub_wait = asyncio.ensure_future(self.hub_event.wait())
+            try:
+                await asyncio.wait(
+                    {self.layer_receive, hub_wait}, return_when=asyncio.FIRST_COMPLETED
+                )
+            except asyncio.CancelledError:
+                self.layer_receive.cancel()
+                raise
+            finally:
+                hub_wait.cancel()
+
+            if self.layer_receive.done():
+                task, self.layer_receive = self.layer_receive, None
+                return task.result()
+
+        return self.hub_messages.popleft()
+
+    async def receive_batch(self):
+        """
+        Receive the next message for this consumer. Model events which arrive within `batch_window`
+        seconds of each other are combined into a single `model.batch` message.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            message = await self.receive_message()
+            if message.get("type") not in MODEL_EVENTS:
+                return message
+
+            events = [message]
+            deadline = loop.time() + self.batch_window
+            while loop.time() < deadline:
+                if self.next_message is None:
+                    self.next_message = asyncio.ensure_future(self.receive_unbatched())
+                # Don't cancel the pending receive on timeout, so no message is lost; the
+                # next call picks it up instead.
+                await asyncio.wait({self.next_message}, timeout=deadline - loop.time())
+                if not self.next_message.done():
+                    break
+                task, self.next_message = self.next_message, None
+                message = task.result()
+                if message.get("type") not in MODEL_EVENTS:
+                    self.held_message = message
+                    break
+                events.append(message)
+        except asyncio.CancelledError:
+            if self.next_message is not None:
+                self.next_message.cancel()
+            raise
+
+        if len(events) == 1:
+            return events[0]
+        return {"type": "model.batch", "events": events}
+
+    async def receive_message(self):
+        if self.held_message is not None:
+            message, self.held_message = self.held_message, None
+            return message
+        if self.next_message is not None:
+            task, self.next_message = self.next_message, None
+            return await task
+        return await self.receive_unbatched()
+
+    async def dispatch(self, message):
+        scheduler = get_scheduler()
+        if scheduler is not None and message["type"] in MODEL_EVENTS + ("model.batch",):
+            await self.dispatch_fairly(scheduler, message)
+            return
+
+        controller = get_admission_controller()
+        if controller is not None and message["type"] == "websocket.receive":
+            try:
+                content = self.decode_json(message.get("text") or "")
+            except ValueError:
+                content = None
+            else:
+                # Decode the message once, for both admission and the handler.
+                message = dict(message, **{DECODED_CONTENT: content})
+            requests = self.subscribe_requests(content)
+            if requests:
+                try:
+                    async with controller.admit(
+                        request["model"] for request in requests
+                    ):
+                        await self.dispatch_handler(message)
+                except AdmissionTimeout:
+                    await self.run_sync(self.reject_subscribe_requests, requests)
+                return
+
+        await self.dispatch_handler(message)
+
+    async def dispatch_handler(self, message):
+        pool = get_pool()
+        if pool is None:
+            return await super().dispatch(message)
+
+        # Run handlers on the connection pool's workers instead of channels' executor.
+        handler = getattr(self, get_handler_name(message), None)
+        if handler is None:
+            raise ValueError("No handler for message type %s" % message["type"])
+        await pool.run(handler, message)
+
+    def websocket_receive(self, message):
+        if DECODED_CONTENT in message:
+            self.receive_json(message[DECODED_CONTENT])
+            return
+        super().websocket_receive(message)
+
+    def subscribe_requests(self, content) -> List[Dict[str, Any]]:
+        """
+        The subscribe requests in a decoded websocket message, for admission control.
+        """
+        if not isinstance(content, dict):
+            return []
+        if content.get("type") == "subscribe":
+            requests = [content]
+        elif content.get("type") == "subscribe_many" and isinstance(
+            content.get("subscriptions"), list
+        ):
+            requests = content["subscriptions"]
+        else:
+            return []
+        return [
+            request
+            for request in requests
+            if isinstance(request, dict) and isinstance(request.get("model"), str)
+        ]
+
+    def reject_subscribe_requests(self, requests):
+        for request in requests:
+            if request.get("id") is not None:
+                self.send_error(
+                    request["id"],
+                    503,
+                    "Too many subscriptions are being handled. Try again later.",
+                )
+
+    async def run_sync(self, func, *args):
+        pool = get_pool()
+        if pool is None:
+            return await database_sync_to_async(func)(*args)
+        return await pool.run(func, *args)
+
+    async def dispatch_fairly(self, scheduler, message):
+        """
+        Handle model events in turns from the fair scheduler, evaluating at most a quantum of
+        subscriptions per turn.
+        """
+        events = message["events"] if message["type"] == "model.batch" else [message]
+        for channel_name, changes in self.change_sets(events):
+            subscriptions = self.concerned_subscriptions(channel_name, changes)
+            for i in range(0, len(subscriptions), scheduler.quantum):
+                async with scheduler.turn():
+                    await self.run_sync(
+                        self.evaluate_and_send,
+                        subscriptions[i : i + scheduler.quantum],
+                        changes,
+                    )
+
+    def deliver(self, message):
+        """
+        Called by the fan-out hub, on the event loop, with events for groups this consumer has joined.
+        """
+        self.hub_messages.append(message)
+        if self.hub_event is None:
+            self.hub_event = asyncio.Event()
+        self.hub_event.set()
+
+    async def hub_group_add(self, group_name, index_key=None, pks=()):
+        await get_hub(self.channel_layer).group_add(group_name, self, index_key, pks)
+
+    async def hub_group_discard(self, group_name, index_key=None):
+        await get_hub(self.channel_layer).group_discard(group_name, self, index_key)
+
+    async def hub_discard(self):
+        await get_hub(self.channel_layer).discard_consumer(self)
+
+    def join_group(self, group_name, subscription=None):
+        snapshot_cache = get_snapshot_cache()
+        if snapshot_cache is not None:
+            snapshot_cache.listen(get_model_label(group_name))
+
+        if self.fanout_hub:
+            if subscription is None:
+                async_to_sync(self.hub_group_add)(group_name)
+            else:
+                async_to_sync(self.hub_group_add)(
+                    group_name,
+                    subscription.index_key,
+                    list(subscription.pks_to_lookup_in_queryset),
+                )
+            self.hub_groups.append(group_name)
+            return
+
+        # Only join the shard of the model group that this connection's channel hashes to.
+        shard_name = self.group_shards.setdefault(
+            group_name,
+            get_shard_name(group_name, self.channel_name, live_settings.GROUP_SHARDS),
+        )
+        count = self.shard_subscriptions.get(shard_name, 0)
+        self.shard_subscriptions[shard_name] = count + 1
+        if count == 0:
+            async_to_sync(self.channel_layer.group_add)(shard_name, self.channel_name)
+            self.groups.append(shard_name)
+
+    def leave_group(self, group_name, subscription=None):
+        snapshot_cache = get_snapshot_cache()
+        if snapshot_cache is not None:
+            snapshot_cache.unlisten(get_model_label(group_name))
+
+        if self.fanout_hub:
+            self.hub_groups.remove(group_name)
+            index_key = None if subscription is None else subscription.index_key
+            async_to_sync(self.hub_group_discard)(group_name, index_key)
+            return
+
+        shard_name = self.group_shards[group_name]
+        self.shard_subscriptions[shard_name] -= 1
+        if not self.shard_subscriptions[shard_name]:
+            # If there are no more subscriptions to the group, leave it.
+            del self.shard_subscriptions[shard_name]
+            self.groups.remove(shard_name)
+            async_to_sync(self.channel_layer.group_discard)(
+                shard_name, self.channel_name
+            )
+            del self.group_shards[group_name]
+
+    def disconnect(self, code):
+        snapshot_cache = get_snapshot_cache()
+        for group_name, subscriptions in self.subscriptions.items():
+            for subscription in subscriptions.values():
+                self.leave_shared(subscription)
+                if snapshot_cache is not None:
+                    snapshot_cache.unlisten(get_model_label(group_name))
+        self.subscriptions = dict()
+        self.subscription_groups = dict()
+
+        if self.hub_groups:
+            async_to_sync(self.hub_discard)()
+            self.hub_groups = []
+
     def connect(self):
         if not self.public and not (
             self.scope.get("user") is not None
@@ -51,7 +480,9 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
         ):
             self.close(code=4003)
 
-        self.subscriptions: Dict[str, List[Subscription]] = dict()
+        # Group name -> request ID -> subscription, and request ID -> group name.
+        self.subscriptions: Dict[str, Dict[Any, Subscription]] = dict()
+        self.subscription_groups: Dict[Any, str] = dict()
         self.accept()
 
     def send_error(self, request_id, code, message):
@@ -64,18 +495,92 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
             }
         )
 
-    def send_broadcast(self, request_id, model_label, action, instance_data, renderer):
+    def render_broadcast(
+        self, request_id, model_label, action, instance_data, renderer, index=None
+    ):
         # https://www.django-rest-framework.org/api-guide/content-negotiation/
+        envelope = {
+            "type": "broadcast",
+            "id": request_id,
+            "model": model_label,
+            "action": action,
+        }
+        if index is not None:
+            envelope["index"] = index
+        envelope["instance"] = instance_data
+        return renderer.render(envelope).decode("utf-8")
+
+    def render_subscription_broadcast(
+        self, subscription, changes: ChangeSet, action, instance_data, renderer, index=None
+    ):
+        """
+        Render a broadcast to a subscription, splicing the encoded instance into the subscription's
+        pre-rendered envelope when the renderer supports it.
+        """
+        model_label = changes.model_label
+        if index is not None:
+            # Envelopes with an index vary between broadcasts, so they aren't pre-rendered.
+            return self.render_broadcast(
+                subscription.request_id,
+                model_label,
+                action,
+                instance_data,
+                renderer,
+                index,
+            )
+        if rendering.is_fast_renderer(renderer):
+            key = (model_label, action)
+            if key not in subscription.envelopes:
+                subscription.envelopes[key] = rendering.envelope_prefix(
+                    renderer,
+                    {
+                        "type": "broadcast",
+                        "id": subscription.request_id,
+                        "model": model_label,
+                        "action": action,
+                    },
+                )
+            prefix = subscription.envelopes[key]
+            if prefix is not None:
+                return prefix + changes.payload(instance_data, renderer) + "}"
+        return self.render_broadcast(
+            subscription.request_id, model_label, action, instance_data, renderer
+        )
+
+    def render_merged_broadcast(self, broadcasts: List[Broadcast], changes: ChangeSet):
+        """
+        Render one frame for identical broadcasts to several subscriptions.
+        """
+        first = broadcasts[0]
+        if len(broadcasts) == 1:
+            return self.render_subscription_broadcast(
+                first.subscription,
+                changes,
+                first.action,
+                first.instance_data,
+                first.renderer,
+                first.index,
+            )
+        envelope = {
+            "type": "broadcast",
+            "ids": [broadcast.subscription.request_id for broadcast in broadcasts],
+            "model": changes.model_label,
+            "action": first.action,
+        }
+        if rendering.is_fast_renderer(first.renderer):
+            prefix = rendering.envelope_prefix(first.renderer, envelope)
+            if prefix is not None:
+                return (
+                    prefix + changes.payload(first.instance_data, first.renderer) + "}"
+                )
+        envelope["instance"] = first.instance_data
+        return first.renderer.render(envelope).decode("utf-8")
+
+    def send_broadcast(self, request_id, model_label, action, instance_data, renderer):
         self.send(
-            text_data=renderer.render(
-                {
-                    "type": "broadcast",
-                    "id": request_id,
-                    "model": model_label,
-                    "action": action,
-                    "instance": instance_data,
-                }
-            ).decode("utf-8")
+            text_data=self.render_broadcast(
+                request_id, model_label, action, instance_data, renderer
+            )
         )
 
     def receive_json(self, content: Dict[str, Any], **kwargs):
@@ -88,10 +593,42 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
             return  # Can't send error message without request ID, so just return.
         message_type = content.get("type", None)
         if message_type == "subscribe":
+            self.subscribe([content])
+        elif message_type == "subscribe_many":
+            requests = content.get("subscriptions")
+            if not isinstance(requests, list):
+                self.send_error(
+                    request_id, 400, "`subscriptions` must be a list of subscriptions."
+                )
+                return
+            self.subscribe(requests)
+        elif message_type == "unsubscribe":
+            self.unsubscribe(request_id)
+        elif message_type == "unsubscribe_many":
+            request_ids = content.get("ids")
+            if not isinstance(request_ids, list):
+                self.send_error(request_id, 400, "`ids` must be a list of request IDs.")
+                return
+            for subscription_id in request_ids:
+                self.unsubscribe(subscription_id)
+        else:
+            self.send_error(request_id, 400, f"unknown message type `{message_type}`.")
+
+    def subscribe(self, requests: List[Dict[str, Any]]):
+        """
+        Handle subscribe requests. Requests for the same view, with the same action, view kwargs and
+        query params, share the view and its permission checks, and list requests share their snapshot
+        of the queryset.
+        """
+        views: Dict[Tuple, List[Dict[str, Any]]] = dict()
+        for content in requests:
+            request_id = content.get("id") if isinstance(content, dict) else None
+            if request_id is None:
+                continue
             model_label = content.get("model")
             if model_label is None:
                 self.send_error(request_id, 400, "No model specified.")
-                return
+                continue
 
             if model_label not in self.registry:
                 self.send_error(
@@ -99,7 +636,7 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
                     404,
                     f"Model {model_label} not registered for realtime updates.",
                 )
-                return
+                continue
 
             view_action = content.get("action", None)
             if view_action is None or view_action not in ["list", "retrieve"]:
@@ -109,24 +646,42 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
                     "`action` must be present and the value must be either `list` or `retrieve`.",
                 )
 
-            lookup_value = content.get("lookup_by", None)
             view_kwargs = content.get("view_kwargs", dict())
             query_params = content.get("query_params", dict())
+            key = (
+                model_label,
+                view_action,
+                json.dumps(view_kwargs, sort_keys=True, default=str),
+                json.dumps(query_params, sort_keys=True, default=str),
+            )
+            views.setdefault(key, []).append(content)
+
+        for (model_label, view_action, _, _), view_requests in views.items():
+            self.subscribe_to_view(model_label, view_action, view_requests)
 
-            view = self.registry[model_label].from_scope(
-                view_action, self.scope, view_kwargs, query_params
+    def subscribe_to_view(self, model_label, view_action, requests):
+        view_kwargs = requests[0].get("view_kwargs", dict())
+        query_params = requests[0].get("query_params", dict())
+        view = self.registry[model_label].from_scope(
+            view_action, self.scope, view_kwargs, query_params
+        )
+
+        # Check to make sure client has permissions to make this subscription.
+        view_permission = True
+        for permission in view.get_permissions():
+            view_permission = view_permission and permission.has_permission(
+                view.request, view
             )
 
-            # Check to make sure client has permissions to make this subscription.
-            has_permission = True
-            for permission in view.get_permissions():
-                has_permission = has_permission and permission.has_permission(
-                    view.request, view
-                )
+        list_snapshot = None
+        for content in requests:
+            request_id = content["id"]
+            has_permission = view_permission
 
             # Retrieve actions use get_object() to check object permissions as well.
             if view.action == "retrieve":
-                view.kwargs.setdefault(view.lookup_field, lookup_value)
+                view.kwargs = dict(view_kwargs)
+                view.kwargs.setdefault(view.lookup_field, content.get("lookup_by", None))
                 try:
                     view.get_object()
                 except Http404:
@@ -135,7 +690,7 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
                         404,
                         "Instance not found. Make sure 'lookup_by' is set to a valid ID",
                     )
-                    return
+                    continue
                 except (NotAuthenticated, PermissionDenied):
                     has_permission = False
 
@@ -145,77 +700,463 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
                     403,
                     f"Unauthorized to subscribe to {model_label} for action {view_action}",
                 )
-                return
+                continue
 
             # If we've reached this point, then the client can subscribe.
             group_name = get_group_name(model_label)
             print(f"[REST-LIVE] got subscription to {group_name}")
 
-            self.subscriptions.setdefault(group_name, []).append(
-                Subscription(
-                    request_id,
-                    action=view_action,
-                    view_kwargs=view_kwargs,
-                    query_params=query_params,
-                    pks_to_lookup_in_queryset=dict(
-                        {
-                            inst["pk"]: inst[view.lookup_field]
-                            for inst in view.get_queryset().all().values("pk", view.lookup_field)
-                        }
-                    ),
+            shared, shared_key, window = None, None, None
+            if content.get("limit") is not None:
+                try:
+                    window = self.make_window(view, content)
+                except ValueError as e:
+                    self.send_error(request_id, 400, str(e))
+                    continue
+                visible, properties = self.snapshot_window(view, window)
+            elif view.live_shared_state:
+                # Identical subscriptions share their state, so only the first takes a snapshot. They
+                # share broadcasts too, so they must also render them alike.
+                shared_key = (
+                    type(view),
+                    view.get_live_snapshot_key(),
+                    type(view.perform_content_negotiation(view.request)[0]),
                 )
+                shared = shared_states.acquire(
+                    shared_key, lambda: self.cached_snapshot(model_label, view)
+                )
+                visible, properties = shared.visible, shared.properties
+            else:
+                # Retrieve requests each have their own kwargs, which the queryset may depend on.
+                snapshot = list_snapshot
+                if snapshot is None:
+                    snapshot = self.cached_snapshot(model_label, view)
+                    if view.action != "retrieve":
+                        list_snapshot = snapshot
+                visible, properties = snapshot
+                visible = dict(visible)
+
+            subscription = Subscription(
+                request_id,
+                action=view_action,
+                view_kwargs=dict(view.kwargs),
+                query_params=query_params,
+                pks_to_lookup_in_queryset=visible,
+                shared=shared,
+                shared_key=shared_key,
+                window=window,
+                **properties,
             )
+            if shared is not None:
+                shared.join(subscription)
+            if request_id in self.subscription_groups:
+                # Subscribing again with the same ID replaces the earlier subscription.
+                self.unsubscribe(request_id)
+            self.subscriptions.setdefault(group_name, {})[request_id] = subscription
+            self.subscription_groups[request_id] = group_name
 
             # Add subscribe to updates from channel layer: this is the "actual" subscription action.
-            async_to_sync(self.channel_layer.group_add)(group_name, self.channel_name)
-            self.groups.append(group_name)
+            self.join_group(group_name, subscription)
 
-        elif message_type == "unsubscribe":
-            # Get the group name given the request_id
-            try:
-                # List comprehension is empty if the provided request_id doesn't show up for this consumer
-                group_name = [
-                    k
-                    for k, v in self.subscriptions.items()
-                    if request_id in [s.request_id for s in v]
-                ][0]
-            except IndexError:
-                self.send_error(
-                    request_id,
-                    404,
-                    "Attempted to unsubscribe for request ID before subscribing.",
+    def make_window(self, view, content) -> Window:
+        """
+        Build the window for a windowed subscription request. Instances are ordered by the request's
+        `ordering`, or else the view's `ordering`, the model's default ordering, or the primary key.
+        """
+        limit = content["limit"]
+        if view.action != "list":
+            raise ValueError("Only `list` subscriptions can have a `limit`.")
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise ValueError("`limit` must be a positive integer.")
+        model = view.get_model_class()
+        ordering = (
+            content.get("ordering")
+            or getattr(view, "ordering", None)
+            or model._meta.ordering
+            or ["pk"]
+        )
+        return Window(
+            limit, parse_ordering(model, ordering), live_settings.WINDOW_BOUNDARY_SIZE
+        )
+
+    def cached_snapshot(self, model_label, view):
+        snapshot_cache = get_snapshot_cache()
+        if snapshot_cache is None:
+            return self.snapshot(view)
+        return snapshot_cache.get_or_take(
+            model_label,
+            (type(view), view.get_live_snapshot_key()),
+            lambda: self.snapshot(view),
+        )
+
+    def snapshot(self, view):
+        """
+        Evaluate a view's queryset for new subscriptions to it. Returns the lookup values of the instances
+        in it by pk, and the properties of subscriptions to it.
+        """
+        queryset = view.filter_queryset(view.get_queryset())
+        visible = {
+            inst["pk"]: inst[view.lookup_field]
+            for inst in queryset.values("pk", view.lookup_field)
+        }
+        properties = dict(
+            all_visible=(
+                predicates.is_unfiltered(queryset)
+                if view.live_all_visible is None
+                else view.live_all_visible
+            ),
+        )
+        if view.live_index_fields:
+            properties["index_key"] = index_key(
+                queryset, index_attnames(queryset.model, view.live_index_fields)
+            )
+        properties["context_fingerprint"] = self.context_fingerprint(view, queryset)
+        return visible, properties
+
+    def snapshot_window(self, view, window: Window):
+        """
+        Evaluate the first instances of a view's queryset for a new windowed subscription, loading them into
+        `window`. Returns the lookup values of the instances in the window by pk, and the subscription's properties.
+        """
+        queryset = view.filter_queryset(view.get_queryset())
+        fields = list(dict.fromkeys(["pk", view.lookup_field, *window.attnames]))
+        rows = list(
+            queryset.order_by(*window.order_by()).values(*fields)[: window.capacity + 1]
+        )
+        window.load([(window.sort_key(row), row["pk"]) for row in rows])
+        lookups = {row["pk"]: row[view.lookup_field] for row in rows}
+        visible = {pk: lookups[pk] for pk in window.visible_pks()}
+        return visible, dict(
+            context_fingerprint=self.context_fingerprint(view, queryset)
+        )
+
+    def context_fingerprint(self, view, queryset) -> Optional[str]:
+        # Build the serializer's plan now rather than on the first broadcast. Planned serializers
+        # only see instances, so subscriptions to querysets without annotations serialize alike.
+        plan = plans.get_plan(view.get_serializer_class())
+        if plan is None or queryset.query.annotations:
+            return view.get_live_serializer_context_key()
+        return None
+
+    def unsubscribe(self, request_id):
+        group_name = self.subscription_groups.pop(request_id, None)
+        if group_name is None:
+            self.send_error(
+                request_id,
+                404,
+                "Attempted to unsubscribe for request ID before subscribing.",
+            )
+            return
+
+        subscription = self.subscriptions[group_name].pop(request_id)
+        self.leave_shared(subscription)
+        self.leave_group(group_name, subscription)
+
+        # Delete the key in the dictionary if no more subscriptions.
+        if not self.subscriptions[group_name]:
+            del self.subscriptions[group_name]
+
+    def leave_shared(self, subscription):
+        state = subscription.shared
+        if state is not None and state.leave(subscription):
+            shared_states.release(subscription.shared_key)
+
+    def model_saved(self, event):
+        self.process_events([event])
+
+    def model_deleted(self, event):
+        self.process_events([event])
+
+    def model_batch(self, event):
+        self.process_events(event["events"])
+
+    def process_events(self, events):
+        """
+        Broadcast a set of `model.saved` and `model.deleted` events to the subscriptions they concern.
+        """
+        for channel_name, changes in self.change_sets(events):
+            self.evaluate_and_send(
+                self.concerned_subscriptions(channel_name, changes), changes
+            )
+
+    def change_sets(self, events) -> List[Tuple[str, ChangeSet]]:
+        """
+        Group events by model group. Events for the same instance are deduplicated, keeping the kind
+        of the latest one.
+        """
+        snapshot_cache = get_snapshot_cache()
+        latest: Dict[Tuple[str, Any], dict] = dict()
+        for event in events:
+            if snapshot_cache is not None:
+                snapshot_cache.invalidate(event["model"])
+            key = (event["model"], event["instance_pk"])
+            # Re-insert so that instances are ordered by their latest event.
+            latest.pop(key, None)
+            latest[key] = event
+
+        event_type = events[0]["type"] if len(events) == 1 else "model.batch"
+        change_sets: Dict[Tuple[str, str], ChangeSet] = dict()
+        for (model_label, instance_pk), event in latest.items():
+            group = (event["channel_name"], model_label)
+            if group not in change_sets:
+                change_sets[group] = ChangeSet(model_label, event_type)
+            changes = change_sets[group]
+            changes.instance_changes.append(
+                (instance_pk, event["type"] == "model.deleted")
+            )
+            changes.values[instance_pk] = event.get("values")
+            if event.get("version") is not None:
+                changes.versions[instance_pk] = event["version"]
+            if event.get("event_id") is not None:
+                changes.event_ids[instance_pk] = event["event_id"]
+            if event.get("related"):
+                changes.related_pks.add(instance_pk)
+            else:
+                changes.related_pks.discard(instance_pk)
+            if event.get("created"):
+                changes.created_pks.add(instance_pk)
+            else:
+                changes.created_pks.discard(instance_pk)
+
+        return [
+            (channel_name, changes)
+            for (channel_name, _), changes in change_sets.items()
+        ]
+
+    def concerned_subscriptions(
+        self, channel_name, changes: ChangeSet
+    ) -> List[Subscription]:
+        """
+        The subscriptions to a model group which a set of changes might concern.
+        """
+        any_saved = bool(changes.saved_pks)
+
+        subscriptions = []
+        for subscription in self.subscriptions.get(channel_name, {}).values():
+            # Deletes concern windowed subscriptions tracking the instance in their window or its boundary.
+            if subscription.window is not None:
+                if any_saved or any(
+                    subscription.window.tracks(pk) for pk, _ in changes.instance_changes
+                ):
+                    subscriptions.append(subscription)
+                continue
+            # Subscriptions sharing state must evaluate the same sets of changes to keep sharing it.
+            if subscription.shared is not None:
+                subscriptions.append(subscription)
+                continue
+            # Deletes only concern subscriptions which could see the instance.
+            if not any_saved and not any(
+                pk in subscription.pks_to_lookup_in_queryset
+                for pk, _ in changes.instance_changes
+            ):
+                continue
+            if subscription.index_key is not None and not any(
+                self.may_concern(subscription, pk, deleted, changes.values.get(pk))
+                for pk, deleted in changes.instance_changes
+            ):
+                continue
+            subscriptions.append(subscription)
+        return subscriptions
+
+    def evaluate_and_send(self, subscriptions, changes: ChangeSet):
+        viewset_class = self.registry[changes.model_label]
+        pool = get_evaluation_pool() if len(subscriptions) > 1 else None
+        if self.merge_broadcasts:
+            if pool is None:
+                results = [
+                    self.evaluate_subscription(viewset_class, subscription, changes)
+                    for subscription in subscriptions
+                ]
+            else:
+                futures = [
+                    pool.submit(
+                        self.evaluate_subscription, viewset_class, subscription, changes
+                    )
+                    for subscription in subscriptions
+                ]
+                results = [future.result() for future in futures]
+            for broadcast in self.merge(
+                [broadcast for result in results for broadcast in result], changes
+            ):
+                self.send(text_data=broadcast)
+            return
+
+        if pool is None:
+            for subscription in subscriptions:
+                for broadcast in self.evaluate_subscription(
+                    viewset_class, subscription, changes
+                ):
+                    self.send(text_data=broadcast)
+            return
+
+        # Evaluate concurrently, but send broadcasts in subscription order as soon as they're ready.
+        futures = [
+            pool.submit(self.evaluate_subscription, viewset_class, subscription, changes)
+            for subscription in subscriptions
+        ]
+        for future in futures:
+            for broadcast in future.result():
+                self.send(text_data=broadcast)
+
+    def evaluate_subscription(self, viewset_class, subscription, changes: ChangeSet):
+        """
+        Evaluate changes against a subscription, and return the rendered broadcasts, or the unrendered
+        `Broadcast`s if they're to be merged with other subscriptions'.
+        """
+        with instrumentation.trace_subscription(
+            viewset_class,
+            subscription.action,
+            subscription.request_id,
+            changes.model_label,
+            changes.event_type,
+        ) as trace:
+            if subscription.shared is None:
+                broadcasts = self.evaluate_changes(
+                    viewset_class, subscription, changes, trace
                 )
-                return
+            else:
+                broadcasts = self.evaluate_shared(
+                    viewset_class, subscription, changes, trace
+                )
+            if self.merge_broadcasts:
+                return broadcasts
+            with instrumentation.stage(trace, instrumentation.RENDER):
+                return [
+                    self.render_subscription_broadcast(
+                        subscription,
+                        changes,
+                        broadcast.action,
+                        broadcast.instance_data,
+                        broadcast.renderer,
+                        broadcast.index,
+                    )
+                    for broadcast in broadcasts
+                ]
 
-            self.subscriptions[group_name] = [
-                sub
-                for sub in self.subscriptions[group_name]
-                if sub.request_id != request_id
-            ]
-            self.groups.remove(
-                group_name
-            )  # Removes the first occurrence of this group name.
-            if (
-                group_name not in self.groups
-            ):  # If there are no more occurrences, unsubscribe to the channel layer.
-                async_to_sync(self.channel_layer.group_discard)(
-                    group_name, self.channel_name
+    def evaluate_shared(
+        self, viewset_class, subscription, changes: ChangeSet, trace
+    ) -> List[Broadcast]:
+        """
+        Evaluate changes against a subscription with shared state, reusing the results of another
+        subscription sharing the state if it has evaluated the same changes already.
+        """
+        state = subscription.shared
+        key = tuple(
+            (pk, deleted, changes.event_ids.get(pk))
+            for pk, deleted in changes.instance_changes
+        )
+        if any(event_id is None for _, _, event_id in key):
+            key = None
+
+        with state.lock:
+            results = None
+            if subscription.shared is state:
+                results = state.replay(subscription, key)
+            if results is None and subscription.shared is state:
+                undo = state.undo_for(pk for pk, _ in changes.instance_changes)
+                broadcasts = self.evaluate_changes(
+                    viewset_class, subscription, changes, trace
                 )
+                state.record(
+                    subscription,
+                    key,
+                    [
+                        (b.position, b.action, b.instance_data, b.renderer, b.index)
+                        for b in broadcasts
+                    ],
+                    undo,
+                )
+                return broadcasts
 
-            # Delete the key in the dictionary if no more subscriptions.
-            if len(self.subscriptions[group_name]) == 0:
-                del self.subscriptions[group_name]
-        else:
-            self.send_error(request_id, 400, f"unknown message type `{message_type}`.")
+        if results is None:
+            # The subscription was detached, and now has its own state.
+            return self.evaluate_changes(viewset_class, subscription, changes, trace)
+        return [Broadcast(subscription, *result) for result in results]
 
-    def model_saved(self, event):
-        channel_name: str = event["channel_name"]
-        instance_pk: int = event["instance_pk"]
-        model_label: str = event["model"]
+    def merge(self, broadcasts: List[Broadcast], changes: ChangeSet) -> List[str]:
+        """
+        Render broadcasts of the same change with the same action and payload as one frame.
+        Frames are in the order of the changes, so each subscription receives its broadcasts in order.
+        """
+        groups: Dict[Tuple, List[Broadcast]] = dict()
+        for broadcast in broadcasts:
+            renderer = broadcast.renderer
+            if isinstance(renderer, JSONRenderer):
+                payload = changes.payload(broadcast.instance_data, renderer)
+            else:
+                payload = id(broadcast.instance_data)
+            key = (broadcast.position, broadcast.action, type(renderer), payload)
+            if broadcast.index is not None:
+                # Broadcasts to windowed subscriptions must arrive in order, so they're never merged.
+                key += (id(broadcast.subscription), len(groups))
+            groups.setdefault(key, []).append(broadcast)
+        return [
+            self.render_merged_broadcast(groups[key], changes)
+            for key in sorted(groups, key=lambda key: key[0])
+        ]
+
+    def may_concern(self, subscription, instance_pk, deleted, values):
+        """
+        Whether a change to an instance might concern an indexed subscription: either the subscription
+        can already see the instance, or the instance now has the subscription's filter value.
+        """
+        if instance_pk in subscription.pks_to_lookup_in_queryset:
+            return True
+        if deleted:
+            return False
+        attname, value = subscription.index_key
+        if values is None or attname not in values:
+            return True
+        return values[attname] == value
+
+    def read_database(self, model, changes: ChangeSet) -> Optional[str]:
+        """
+        Choose the database to evaluate a set of changes against, once per set. Reads go to the
+        `READ_DATABASE` replica if it has caught up with every saved instance, and otherwise to the primary.
+        Returns `None` to read from the database the view's queryset would use anyway.
+        """
+        with changes.lock:
+            if not changes.database_chosen:
+                changes.database = self.choose_read_database(model, changes)
+                changes.database_chosen = True
+            return changes.database
+
+    def choose_read_database(self, model, changes: ChangeSet) -> Optional[str]:
+        replica = live_settings.READ_DATABASE
+        if replica is None:
+            return None
+        if changes.related_pks:
+            # There's no telling whether the replica has the related instance's change.
+            return router.db_for_write(model)
 
-        viewset_class = self.registry[model_label]
+        # A replica which has a created instance has its creation, but it can only be known to have an
+        # update of an existing instance by comparing commit markers.
+        version_field = signals.version_fields.get(changes.model_label)
+        for pk in changes.saved_pks:
+            if pk not in changes.created_pks and changes.versions.get(pk) is None:
+                return router.db_for_write(model)
 
-        for subscription in self.subscriptions[channel_name]:
+        markers = dict(
+            model._base_manager.using(replica)
+            .filter(pk__in=changes.saved_pks)
+            .values_list("pk", version_field or "pk")
+        )
+        for pk in changes.saved_pks:
+            version = changes.versions.get(pk)
+            lagging = pk not in markers or (
+                version is not None and signals.commit_marker(markers[pk]) < version
+            )
+            if lagging:
+                return router.db_for_write(model)
+        return replica
+
+    def evaluate_changes(
+        self, viewset_class, subscription, changes: ChangeSet, trace
+    ) -> List[Broadcast]:
+        """
+        Determine which changed instances should be broadcast to a given subscription.
+        """
+        with instrumentation.stage(trace, instrumentation.VIEW):
             view = viewset_class.from_scope(
                 subscription.action,
                 self.scope,
@@ -226,32 +1167,74 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
             model = view.get_model_class()
             renderer = view.perform_content_negotiation(view.request)[0]
 
-            is_existing_instance = instance_pk in subscription.pks_to_lookup_in_queryset
-            try:
-                instance = view.filter_queryset(view.get_queryset()).get(pk=instance_pk)
-                action = UPDATED if is_existing_instance else CREATED
-            except model.DoesNotExist:
-                if not is_existing_instance:
-                    # If the model doesn't exist in the queryset now, and also is not in the set of PKs that we've seen,
-                    # then we truly don't have permission to see it.
-                    return
-
-                # If the instance has been seen, then we should get it from the database to serialize and
-                # send the delete message.
-                instance = model.objects.get(pk=instance_pk)
-                action = DELETED
+        if subscription.window is not None:
+            return self.evaluate_window(view, renderer, subscription, changes, trace)
 
-            serializer_class = view.get_serializer_class()
-            instance_data = serializer_class(
-                instance,
-                context={
-                    "request": view.request,
-                    "format": "json",  # TODO: change this to be general based on content negotiation
-                    "view": view,
-                },
-            ).data
+        model_label = changes.model_label
+        visible = subscription.pks_to_lookup_in_queryset
+        saved_pks = changes.saved_pks
+        instances, removed = dict(), dict()
+        if saved_pks:
+            with instrumentation.stage(trace, instrumentation.QUERYSET):
+                queryset = view.filter_queryset(view.get_queryset())
+                database = self.read_database(model, changes)
+                if database is not None:
+                    queryset = queryset.using(database)
+
+                predicate = None
+                if subscription.all_visible:
+                    predicate = predicates.always
+                elif view.live_in_memory_filters:
+                    predicate = predicates.compile_queryset(queryset)
 
-            if action == DELETED:
+                matched = None
+                if predicate is not None:
+                    matched = self.filter_in_memory(
+                        queryset, saved_pks, changes, predicate
+                    )
+
+                if matched is not None:
+                    instances, removed = matched
+                else:
+                    instances = {
+                        instance.pk: instance
+                        for instance in queryset.filter(pk__in=saved_pks)
+                    }
+                    # Instances that we've seen but are no longer in the queryset should be fetched
+                    # from the database to serialize and send the delete message.
+                    removed_pks = [
+                        pk for pk in saved_pks if pk not in instances and pk in visible
+                    ]
+                    if removed_pks:
+                        removed = {
+                            instance.pk: instance
+                            for instance in model.objects.using(queryset.db).filter(
+                                pk__in=removed_pks
+                            )
+                        }
+            removed = {pk: i for pk, i in removed.items() if pk in visible}
+
+        broadcasts = []
+        for position, (instance_pk, deleted) in enumerate(changes.instance_changes):
+            if instance_pk in instances:
+                instance = instances[instance_pk]
+                action = UPDATED if instance_pk in visible else CREATED
+                with instrumentation.stage(trace, instrumentation.SERIALIZE):
+                    instance_data = self.serialize_change(
+                        view, subscription, changes, instance
+                    )
+                visible[instance_pk] = getattr(instance, view.lookup_field)
+            elif instance_pk not in visible:
+                # If the model doesn't exist in the queryset now, and also is not in the set of PKs that we've seen,
+                # then we truly don't have permission to see it.
+                continue
+            elif instance_pk in removed:
+                action = DELETED
+                instance = removed[instance_pk]
+                with instrumentation.stage(trace, instrumentation.SERIALIZE):
+                    instance_data = self.serialize_change(
+                        view, subscription, changes, instance
+                    )
                 # If an object's deleted from a user's queryset, there's no guarantee that the user still
                 # has permission to see the contents of the instance, so the instance just returns the lookup_field.
                 # TODO: clients might expect `id` as well as `pk`, since django defaults to `id`.
@@ -264,47 +1247,197 @@ class SubscriptionConsumer(JsonWebsocketConsumer):
                     instance_data = {
                         view.lookup_field: getattr(instance, view.lookup_field)
                     }
-
-            # We don't need to check for membership since it's implicit given broadcast_data isn't None.
-            if action == DELETED:
-                del subscription.pks_to_lookup_in_queryset[instance_pk]
+                del visible[instance_pk]
             else:
-                subscription.pks_to_lookup_in_queryset[instance_pk] = getattr(
-                    instance, view.lookup_field
-                )
-            self.send_broadcast(
-                subscription.request_id, model_label, action, instance_data, renderer
+                # The instance is gone from the database, so all we can send is what we remember of it.
+                action = DELETED
+                instance_data = {
+                    view.lookup_field: visible[instance_pk],
+                    "id": instance_pk,
+                }
+                del visible[instance_pk]
+
+            broadcasts.append(
+                Broadcast(subscription, position, action, instance_data, renderer)
             )
+            if trace is not None:
+                trace.broadcast_action = action
+        return broadcasts
 
-    def model_deleted(self, event):
-        channel_name: str = event["channel_name"]
-        instance_pk: int = event["instance_pk"]
-        model_label: str = event["model"]
+    def evaluate_window(
+        self, view, renderer, subscription, changes: ChangeSet, trace
+    ) -> List[Broadcast]:
+        """
+        Determine how changed instances move a windowed subscription's window. Each change is applied in turn,
+        and broadcasts instances leaving the window, then those entering it or moving in it, at their new index.
+        """
+        window = subscription.window
+        visible = subscription.pks_to_lookup_in_queryset
+        saved_pks = changes.saved_pks
+        instances = dict()
+        with instrumentation.stage(trace, instrumentation.QUERYSET):
+            queryset = view.filter_queryset(view.get_queryset())
+            if saved_pks:
+                database = self.read_database(queryset.model, changes)
+                if database is not None:
+                    queryset = queryset.using(database)
+                instances = {
+                    instance.pk: instance
+                    for instance in queryset.filter(pk__in=saved_pks)
+                }
 
-        viewset_class = self.registry[model_label]
+        broadcasts = []
+        for position, (instance_pk, deleted) in enumerate(changes.instance_changes):
+            before = window.visible_pks()
+            window.discard(instance_pk)
+            if instance_pk in instances:
+                window.insert(instance_pk, window.instance_key(instances[instance_pk]))
+            with instrumentation.stage(trace, instrumentation.QUERYSET):
+                self.fill_window(queryset, window, before, instances)
+            after = window.visible_pks()
 
-        for subscription in self.subscriptions[channel_name]:
-            view = viewset_class.from_scope(
-                subscription.action,
-                self.scope,
-                subscription.view_kwargs,
-                subscription.query_params,
+            before_pks, after_pks = set(before), set(after)
+            for pk in before:
+                if pk not in after_pks:
+                    instance_data = {view.lookup_field: visible.pop(pk), "id": pk}
+                    broadcasts.append(
+                        Broadcast(subscription, position, DELETED, instance_data, renderer)
+                    )
+            for index, pk in enumerate(after):
+                if pk not in before_pks:
+                    action = CREATED
+                elif pk == instance_pk:
+                    action = UPDATED if before.index(pk) == index else MOVED
+                else:
+                    continue
+                instance = instances[pk]
+                with instrumentation.stage(trace, instrumentation.SERIALIZE):
+                    instance_data = self.serialize_change(
+                        view, subscription, changes, instance
+                    )
+                visible[pk] = getattr(instance, view.lookup_field)
+                broadcasts.append(
+                    Broadcast(
+                        subscription, position, action, instance_data, renderer, index
+                    )
+                )
+            if trace is not None and broadcasts:
+                trace.broadcast_action = broadcasts[-1].action
+        return broadcasts
+
+    def fill_window(self, queryset, window: Window, before, instances):
+        """
+        Make sure that every instance entering a window is in `instances`, fetching the ones which entered
+        from the boundary. The window is queried again if its boundary has run out, or holds instances which
+        are no longer in the queryset.
+        """
+        while not window.needs_refill():
+            entering = [
+                pk
+                for pk in window.visible_pks()
+                if pk not in before and pk not in instances
+            ]
+            if not entering:
+                return
+            instances.update(
+                (instance.pk, instance)
+                for instance in queryset.filter(pk__in=entering)
             )
-            renderer = view.perform_content_negotiation(view.request)[0]
-            is_existing_instance = instance_pk in subscription.pks_to_lookup_in_queryset
+            stale = [pk for pk in entering if pk not in instances]
+            if not stale:
+                return
+            for pk in stale:
+                window.discard(pk)
 
-            if is_existing_instance:
-                instance_data = {
-                    view.lookup_field: subscription.pks_to_lookup_in_queryset[
-                        instance_pk
-                    ],
-                    "id": instance_pk,
+        rows = list(queryset.order_by(*window.order_by())[: window.capacity + 1])
+        window.load([(window.instance_key(instance), instance.pk) for instance in rows])
+        instances.update((instance.pk, instance) for instance in rows)
+
+    def filter_in_memory(self, queryset, saved_pks, changes: ChangeSet, predicate):
+        """
+        Split changed instances into those in `queryset` and those not, deciding membership with `predicate`.
+        The instances are fetched from the database once, and shared through `changes` with other
+        subscriptions evaluating the same changes. Returns `None` if the predicate can't be evaluated.
+        """
+        # Instances are fetched without the queryset's filters, but with its related lookups, so that
+        # serializing them doesn't query the database for each one.
+        related = queryset.query.select_related
+        prefetch = tuple(queryset._prefetch_related_lookups)
+        key = (queryset.db, repr(related), prefetch)
+        fetched = changes.fetched
+        with changes.lock:
+            if key not in fetched:
+                base = queryset.model._base_manager.using(queryset.db)
+                base.query.select_related = related
+                fetched[key] = {
+                    instance.pk: instance
+                    for instance in base.prefetch_related(*prefetch).filter(
+                        pk__in=saved_pks
+                    )
                 }
-                del subscription.pks_to_lookup_in_queryset[instance_pk]
-                self.send_broadcast(
-                    subscription.request_id,
-                    model_label,
-                    DELETED,
-                    instance_data,
-                    renderer,
-                )
+        instances, removed = dict(), dict()
+        try:
+            for pk, instance in fetched[key].items():
+                if predicate(instance):
+                    instances[pk] = instance
+                else:
+                    removed[pk] = instance
+        except predicates.Unsupported:
+            return None
+        return instances, removed
+
+    def serialize_change(self, view, subscription, changes: ChangeSet, instance):
+        """
+        Serialize a changed instance for a subscription, once for all of the subscriptions evaluating
+        `changes` with the same serializer class and context fingerprint.
+        """
+        key = (view.get_serializer_class(), subscription.context_fingerprint, instance.pk)
+        data = changes.serialized.get(key, MISSING)
+        if data is MISSING:
+            data = changes.serialized.setdefault(
+                key,
+                self.serialize(view, instance, refresh=instance.pk in changes.related_pks),
+            )
+        return data
+
+    def serialize(self, view, instance, refresh=False):
+        """
+        Serialize an instance for a view. With `refresh`, the instance is serialized again even if the
+        serializer cache has data for its version, and the cache is updated.
+        """
+        serializer_class = view.get_serializer_class()
+
+        # Serialized data is shared between subscriptions through the cache when the row has a version,
+        # so that a new save of the row is never served stale data. Saves of related instances don't
+        # change the row's version, so their events refresh the cached data instead.
+        cache, key = get_serializer_cache(), None
+        version_field = signals.version_fields.get(instance._meta.label)
+        if cache is not None and version_field is not None:
+            key = (
+                serializer_class,
+                view.get_live_serializer_context_key(),
+                instance._meta.label,
+                instance.pk,
+                signals.commit_marker(getattr(instance, version_field)),
+            )
+            data = MISSING if refresh else cache.get(key)
+            if data is not MISSING:
+                return data
+
+        plan = plans.get_plan(serializer_class)
+        if plan is not None:
+            data = plan.serialize(instance)
+        else:
+            data = serializer_class(
+                instance, context=self.serializer_context(view)
+            ).data
+        if key is not None:
+            cache.set(key, data)
+        return data
+
+    def serializer_context(self, view):
+        return {
+            "request": view.request,
+            "format": "json",  # TODO: change this to be general based on content negotiation
+            "view": view,
+        }
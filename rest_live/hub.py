@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from rest_live import get_shard_name
+from rest_live.admission import get_snapshot_cache
+from rest_live.index import IndexKey, SubscriptionIndex
+from rest_live.settings import live_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class FanoutHub:
+    """
+    Joins each model group on the channel layer once per process, on behalf of every
+    local consumer subscribed to it. Each event is received from the channel layer once
+    and then delivered in memory to the local consumers in the group.
+
+    Channel layers bind connections to the event loop they were created on, so there is one
+    hub per (channel layer, event loop) pair. Use `get_hub()` rather than instantiating this directly.
+    """
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.channel_name = None
+        # Model group -> the local consumers subscribed to it, indexed by their subscriptions' filter values.
+        self.indexes: Dict[str, SubscriptionIndex] = dict()
+        # Model group -> the shard of it that the hub has joined on the channel layer.
+        self.shards: Dict[str, str] = dict()
+        # Consumer -> (group, index key) for each of its subscriptions.
+        self.subscriptions: Dict[Any, List[Tuple[str, Optional[IndexKey]]]] = dict()
+        # Model group -> pk -> consumers with indexed subscriptions which may be able to see the instance,
+        # and so must receive its events whatever its new values are. Kept as a superset: entries are
+        # only removed when the instance is deleted or the consumer leaves the group.
+        self.watchers: Dict[str, Dict[Any, Set]] = dict()
+        self.watched: Dict[Any, Set[Tuple[str, Any]]] = dict()
+        self.receive_task = None
+        self.lock = asyncio.Lock()
+
+    async def group_add(self, group, consumer, key=None, pks=()):
+        """
+        Add a subscription of `consumer` to `group`. `key` is the subscription's index key, if it has one,
+        and `pks` the primary keys of the instances it can currently see.
+        """
+        async with self.lock:
+            if self.channel_name is None:
+                self.channel_name = await self.channel_layer.new_channel()
+                self.receive_task = asyncio.ensure_future(self.receive_loop())
+
+            if group not in self.indexes:
+                self.shards[group] = get_shard_name(
+                    group, self.channel_name, live_settings.GROUP_SHARDS
+                )
+                await self.channel_layer.group_add(self.shards[group], self.channel_name)
+                self.indexes[group] = SubscriptionIndex()
+                self.watchers[group] = dict()
+            self.indexes[group].add(consumer, key)
+            self.subscriptions.setdefault(consumer, []).append((group, key))
+            if key is not None:
+                for pk in pks:
+                    self.watch(group, pk, consumer)
+
+    async def group_discard(self, group, consumer, key=None):
+        async with self.lock:
+            await self._discard(group, consumer, key)
+            await self._stop_if_empty()
+
+    async def discard_consumer(self, consumer):
+        """
+        Remove every subscription of a consumer. Called on disconnect.
+        """
+        async with self.lock:
+            for group, key in list(self.subscriptions.get(consumer, ())):
+                await self._discard(group, consumer, key)
+            await self._stop_if_empty()
+
+    async def _discard(self, group, consumer, key):
+        subscriptions = self.subscriptions.get(consumer, [])
+        if (group, key) not in subscriptions:
+            return
+        subscriptions.remove((group, key))
+        if not subscriptions:
+            del self.subscriptions[consumer]
+
+        index = self.indexes[group]
+        index.discard(consumer, key)
+        if not any(g == group for g, _ in subscriptions):
+            self.unwatch(group, consumer)
+        if not index:
+            del self.indexes[group]
+            del self.watchers[group]
+            await self.channel_layer.group_discard(
+                self.shards.pop(group), self.channel_name
+            )
+
+    async def _stop_if_empty(self):
+        if self.indexes or self.receive_task is None:
+            return
+        self.receive_task.cancel()
+        self.receive_task = None
+        self.channel_name = None
+
+    def watch(self, group, pk, consumer):
+        self.watchers[group].setdefault(pk, set()).add(consumer)
+        self.watched.setdefault(consumer, set()).add((group, pk))
+
+    def unwatch(self, group, consumer):
+        """
+        Stop watching instances in `group` on behalf of `consumer`.
+        """
+        watched = self.watched.get(consumer, set())
+        for watched_group, pk in [w for w in watched if w[0] == group]:
+            watched.discard((watched_group, pk))
+            watchers = self.watchers[group].get(pk)
+            if watchers is not None:
+                watchers.discard(consumer)
+                if not watchers:
+                    del self.watchers[group][pk]
+        if not watched:
+            self.watched.pop(consumer, None)
+
+    async def receive_loop(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Fan-out hub failed to receive from channel layer")
+                await asyncio.sleep(1)
+                continue
+            self.dispatch(message)
+
+    def dispatch(self, message):
+        # Events may not reach any consumer in this process, but snapshots of the model are stale all the same.
+        snapshot_cache = get_snapshot_cache()
+        if snapshot_cache is not None and "model" in message:
+            snapshot_cache.invalidate(message["model"])
+        for consumer in self.recipients(message):
+            try:
+                consumer.deliver(message)
+            except Exception:
+                logger.exception("Failed to deliver %s to %r", message["type"], consumer)
+
+    def recipients(self, message) -> Set:
+        """
+        Determine which local consumers an event should be delivered to, using the group's index.
+        """
+        if message["type"] == "model.batch":
+            # Batches, like those sent for the dependents of a saved related instance, reach every
+            # consumer that any of their events would.
+            return set().union(*(self.recipients(event) for event in message["events"]))
+
+        # Events from `rest_live.signals` carry the group they were sent to as `channel_name`.
+        group = message.get("channel_name")
+        index = self.indexes.get(group)
+        if index is None:
+            return set()
+
+        watchers = self.watchers[group]
+        pk = message.get("instance_pk")
+        if message["type"] == "model.deleted":
+            recipients = set(index.unindexed) | watchers.pop(pk, set())
+            for consumer in recipients:
+                self.watched.get(consumer, set()).discard((group, pk))
+            return recipients
+
+        if message["type"] != "model.saved":
+            return index.members()
+
+        values = message.get("values")
+        if values is None:
+            # Without the instance's values, any indexed subscription might see it now.
+            indexed = index.members() - set(index.unindexed)
+        else:
+            indexed = index.match(values, unindexed=False)
+        for consumer in indexed:
+            self.watch(group, pk, consumer)
+        return set(index.unindexed) | indexed | watchers.get(pk, set())
+
+
+# Event loop -> id of channel layer -> hub.
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub(channel_layer) -> FanoutHub:
+    """
+    Get the hub for `channel_layer` on the running event loop, creating it if needed.
+    """
+    hubs = _hubs.setdefault(asyncio.get_running_loop(), dict())
+    if id(channel_layer) not in hubs:
+        hubs[id(channel_layer)] = FanoutHub(channel_layer)
+    return hubs[id(channel_layer)]
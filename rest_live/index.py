@@ -0,0 +1,91 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from django.core.exceptions import ValidationError
+
+from rest_live import predicates
+
+IndexKey = Tuple[str, Any]  # (field attname, value)
+
+
+class SubscriptionIndex:
+    """
+    Inverted index from filter values to the members (subscriptions or consumers) which require them.
+
+    A member added with a key `(attname, value)` only cares about instances where `attname` is `value`.
+    Members added without a key can't be indexed and match every instance. Each member is counted, so a
+    member added several times stays in the index until it's discarded as many times.
+    """
+
+    def __init__(self):
+        self.by_value: Dict[IndexKey, Dict[Hashable, int]] = dict()
+        self.unindexed: Dict[Hashable, int] = dict()
+
+    def add(self, member, key: Optional[IndexKey] = None):
+        members = self.unindexed if key is None else self.by_value.setdefault(key, {})
+        members[member] = members.get(member, 0) + 1
+
+    def discard(self, member, key: Optional[IndexKey] = None):
+        members = self.unindexed if key is None else self.by_value.get(key)
+        if members is None or member not in members:
+            return
+        members[member] -= 1
+        if members[member] == 0:
+            del members[member]
+            if key is not None and not members:
+                del self.by_value[key]
+
+    def match(self, values: Dict[str, Any], unindexed=True) -> Set:
+        """
+        Members which may care about an instance with the given field values: those indexed on one of
+        the values, and unless `unindexed` is false, those which can't be indexed.
+        """
+        matched = set(self.unindexed) if unindexed else set()
+        for attname, value in values.items():
+            try:
+                matched.update(self.by_value.get((attname, value), ()))
+            except TypeError:
+                # Unhashable values can't have been indexed.
+                continue
+        return matched
+
+    def members(self) -> Set:
+        members = set(self.unindexed)
+        for indexed in self.by_value.values():
+            members.update(indexed)
+        return members
+
+    def __bool__(self):
+        return bool(self.by_value or self.unindexed)
+
+
+def index_key(queryset, fields) -> Optional[IndexKey]:
+    """
+    Find an `exact` filter on one of `fields` that every instance in `queryset` must satisfy,
+    as an `(attname, value)` pair. Returns `None` if there isn't one.
+    """
+    for attname, value in predicates.required_values(queryset):
+        if attname in fields:
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            return attname, value
+    return None
+
+
+def index_attnames(model, fields: Iterable[str]) -> List[str]:
+    return [model._meta.get_field(name).attname for name in fields]
+
+
+def index_values(model, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convert an instance's values of indexed fields into their `get_prep_value()`, the form that
+    filter values, and so index keys, are held in. Returns `None` if one of them can't be converted.
+    """
+    try:
+        return {
+            attname: model._meta.get_field(attname).get_prep_value(value)
+            for attname, value in values.items()
+        }
+    except (TypeError, ValueError, ValidationError):
+        return None
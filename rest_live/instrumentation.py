@@ -0,0 +1,314 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import DatabaseError, NotSupportedError, connections
+
+
+# Stages that a subscription goes through when evaluating an event.
+VIEW = "view"  # Constructing the view from the connection scope and content negotiation.
+QUERYSET = "queryset"  # Checking queryset membership and fetching the instance.
+SERIALIZE = "serialize"  # Running the serializer.
+RENDER = "render"  # Rendering the broadcast envelope.
+
+STAGES = (VIEW, QUERYSET, SERIALIZE, RENDER)
+
+
+@dataclass
+class QueryRecord:
+    sql: str
+    params: Any
+    duration: float
+    alias: str
+    stage: Optional[str]
+
+
+@dataclass
+class BroadcastTrace:
+    """
+    Cost of evaluating a single subscription for a single `model.saved` or `model.deleted` event.
+    Traces are only collected while at least one listener is registered.
+    """
+
+    view_class: type
+    action: str
+    request_id: Any
+    model_label: str
+    event_type: str
+
+    # The broadcast action that was sent (CREATED, UPDATED, DELETED), or None if no broadcast was sent.
+    broadcast_action: Optional[str] = None
+    queries: List[QueryRecord] = field(default_factory=list)
+    stage_times: Dict[str, float] = field(default_factory=dict)
+    stage_query_times: Dict[str, float] = field(default_factory=dict)
+    duration: float = 0.0
+
+    _current_stage: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def query_count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def query_time(self) -> float:
+        return sum(query.duration for query in self.queries)
+
+    @property
+    def serialization_time(self) -> float:
+        return self.stage_times.get(SERIALIZE, 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        previous, self._current_stage = self._current_stage, name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_times[name] = self.stage_times.get(name, 0.0) + elapsed
+            self._current_stage = previous
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper (see Django's `connection.execute_wrapper`) which records
+        every query run while the trace is active.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self._current_stage
+            self.queries.append(
+                QueryRecord(sql, params, elapsed, context["connection"].alias, stage)
+            )
+            if stage is not None:
+                self.stage_query_times[stage] = (
+                    self.stage_query_times.get(stage, 0.0) + elapsed
+                )
+
+
+class Listener:
+    """
+    Base class for objects that want to observe broadcast traces. Register listeners with `add_listener`.
+    """
+
+    def should_trace(self, view_class, action) -> bool:
+        """
+        Return False to skip tracing an evaluation, for instance when sampling.
+        """
+        return True
+
+    def trace_started(self, trace: BroadcastTrace):
+        pass
+
+    def trace_finished(self, trace: BroadcastTrace):
+        pass
+
+
+# Copied on write so that consumers can iterate over it without holding the lock.
+_listeners: List[Listener] = []
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener: Listener):
+    global _listeners
+    with _listeners_lock:
+        _listeners = [*_listeners, listener]
+
+
+def remove_listener(listener: Listener):
+    global _listeners
+    with _listeners_lock:
+        _listeners = [other for other in _listeners if other is not listener]
+
+
+def is_active() -> bool:
+    return bool(_listeners)
+
+
+@contextmanager
+def trace_subscription(view_class, action, request_id, model_label, event_type):
+    """
+    Context manager wrapping the evaluation of one subscription for one event. Yields a `BroadcastTrace`
+    when instrumentation is active and `None` otherwise, so that the common case costs a single list check.
+    """
+    listeners = [
+        listener
+        for listener in _listeners
+        if listener.should_trace(view_class, action)
+    ]
+    if not listeners:
+        yield None
+        return
+
+    trace = BroadcastTrace(view_class, action, request_id, model_label, event_type)
+    for listener in listeners:
+        listener.trace_started(trace)
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(trace.record_query))
+        yield trace
+    trace.duration = time.perf_counter() - start
+
+    for listener in listeners:
+        listener.trace_finished(trace)
+
+
+def stage(trace: Optional[BroadcastTrace], name: str):
+    """
+    Time a stage of subscription evaluation on `trace`, if there is one.
+    """
+    if trace is None:
+        return nullcontext()
+    return trace.stage(name)
+
+
+@dataclass
+class SlowQuery:
+    """
+    A slow membership or re-fetch query run while evaluating subscriptions to a view,
+    deduplicated by the shape of its SQL.
+    """
+
+    view_class: type
+    action: str
+    alias: str
+    sql: str
+    params: Any
+    count: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    explain: Optional[str] = None
+    explained_at: Optional[float] = None
+
+
+def query_shape(sql: str) -> str:
+    """
+    Normalize SQL so that queries which only differ in whitespace or in the number
+    of placeholders in an `IN (...)` list are considered the same.
+    """
+    sql = re.sub(r"\s+", " ", sql.strip())
+    return re.sub(r"IN \((?:%s, )*%s\)", "IN (...)", sql)
+
+
+class SlowQueryLog(Listener):
+    """
+    Records queries run in the `queryset` stage of a broadcast that take longer than `threshold`
+    seconds, and runs `EXPLAIN` for them against the same database alias. Each (view class, query shape)
+    pair is explained at most once every `explain_interval` seconds, and at most `explains_per_minute`
+    EXPLAIN queries are run in total. Only the `max_findings` most recent shapes are kept.
+    """
+
+    def __init__(
+        self, threshold, explain_interval=300, explains_per_minute=10, max_findings=100
+    ):
+        self.threshold = threshold
+        self.explain_interval = explain_interval
+        self.explains_per_minute = explains_per_minute
+        self.max_findings = max_findings
+
+        self.findings: Dict[Tuple[type, str], SlowQuery] = dict()
+        self.recent_explains = deque()
+        self.lock = threading.Lock()
+
+    def trace_finished(self, trace):
+        to_explain = []
+        with self.lock:
+            for query in trace.queries:
+                if query.stage != QUERYSET or query.duration < self.threshold:
+                    continue
+
+                key = (trace.view_class, query_shape(query.sql))
+                finding = self.findings.pop(key, None)
+                if finding is None:
+                    finding = SlowQuery(
+                        trace.view_class, trace.action, query.alias, query.sql, query.params
+                    )
+                    if len(self.findings) >= self.max_findings:
+                        # Dicts are ordered, so the first key is the least recently seen shape.
+                        del self.findings[next(iter(self.findings))]
+                self.findings[key] = finding
+
+                finding.count += 1
+                finding.total_duration += query.duration
+                if query.duration >= finding.max_duration:
+                    finding.max_duration = query.duration
+                    finding.sql, finding.params = query.sql, query.params
+
+                if self.should_explain(finding):
+                    to_explain.append(finding)
+
+        for finding in to_explain:
+            self.explain(finding)
+
+    def should_explain(self, finding):
+        now = time.monotonic()
+        if (
+            finding.explained_at is not None
+            and now - finding.explained_at < self.explain_interval
+        ):
+            return False
+        while self.recent_explains and now - self.recent_explains[0] > 60:
+            self.recent_explains.popleft()
+        if len(self.recent_explains) >= self.explains_per_minute:
+            return False
+        self.recent_explains.append(now)
+        finding.explained_at = now
+        return True
+
+    def explain(self, finding):
+        connection = connections[finding.alias]
+        try:
+            prefix = connection.ops.explain_query_prefix()
+            with connection.cursor() as cursor:
+                cursor.execute(f"{prefix} {finding.sql}", finding.params)
+                rows = cursor.fetchall()
+        except (DatabaseError, NotSupportedError) as e:
+            finding.explain = f"EXPLAIN failed: {e}"
+            return
+        finding.explain = "\n".join(
+            " ".join(str(column) for column in row) for row in rows
+        )
+
+    def get_findings(self) -> List[SlowQuery]:
+        with self.lock:
+            return sorted(
+                self.findings.values(), key=lambda f: f.max_duration, reverse=True
+            )
+
+
+_slow_query_log: Optional[SlowQueryLog] = None
+
+
+def install_slow_query_log(threshold, **kwargs) -> SlowQueryLog:
+    """
+    Start recording membership and re-fetch queries slower than `threshold` seconds.
+    """
+    global _slow_query_log
+    uninstall_slow_query_log()
+    _slow_query_log = SlowQueryLog(threshold, **kwargs)
+    add_listener(_slow_query_log)
+    return _slow_query_log
+
+
+def uninstall_slow_query_log():
+    global _slow_query_log
+    if _slow_query_log is not None:
+        remove_listener(_slow_query_log)
+        _slow_query_log = None
+
+
+def get_slow_queries() -> List[SlowQuery]:
+    """
+    Slow broadcast queries recorded in this process, slowest first.
+    """
+    if _slow_query_log is None:
+        return []
+    return _slow_query_log.get_findings()
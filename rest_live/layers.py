@@ -0,0 +1,672 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import string
+import tempfile
+import threading
+import time
+from collections import deque
+from copy import deepcopy
+from typing import Deque, Dict, List, Set, Tuple
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class _Channel:
+    __slots__ = ("messages", "waiters", "capacity")
+
+    def __init__(self, capacity):
+        # (expiry, message) pairs. Every message has the same lifetime, so this is ordered by expiry.
+        self.messages: Deque[Tuple[float, dict]] = deque()
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.capacity = capacity
+
+
+def _wake(waiter: asyncio.Future):
+    loop = waiter.get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        if not waiter.done():
+            waiter.set_result(None)
+    else:
+        loop.call_soon_threadsafe(
+            lambda: waiter.done() or waiter.set_result(None)
+        )
+
+
+class InMemoryChannelLayer(BaseChannelLayer):
+    """
+    In-process channel layer for single-node deployments and tests, usable in place of
+    `channels.layers.InMemoryChannelLayer`:
+
+        CHANNEL_LAYERS = {"default": {"BACKEND": "rest_live.layers.InMemoryChannelLayer"}}
+
+    Compared to the layer that ships with channels, group membership is indexed in both directions,
+    so `group_add` and `group_discard` are O(1), and expired messages and group memberships are
+    kept in queues ordered by expiry so that cleanup only looks at what has actually expired instead
+    of scanning every channel and group on every send. `group_send` cleans up once for the whole group,
+    and only deep-copies the message for each member if it holds nested containers.
+
+    The layer can be used from several threads and event loops at once, for example to send from a
+    thread other than the server's. Its state is guarded by a lock, and receivers waiting on another
+    event loop are woken with `call_soon_threadsafe`.
+
+    Message counts are tracked per channel and for the whole layer in `stats()`. Sends to a channel
+    at capacity raise `ChannelFull`; group sends skip full channels and count the message as dropped.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        # Guards all of the state below. Reentrant, since sends clean up expired messages while holding it.
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.channels: Dict[str, _Channel] = dict()
+        # group -> channel -> join time, and the reverse index channel -> groups.
+        self.groups: Dict[str, Dict[str, float]] = dict()
+        self.channel_groups: Dict[str, Set[str]] = dict()
+        # Queues of (expiry, channel) for every message sent, and (expiry, group, channel) for every join.
+        self.message_expiries: Deque[Tuple[float, str]] = deque()
+        self.group_expiries: Deque[Tuple[float, str, str]] = deque()
+        self.message_count = 0
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.expired_count = 0
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """
+        Send a message onto a (general or specific) channel.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        message = deepcopy(message)
+        with self._lock:
+            self._clean_expired()
+            sent = self._put(channel, message, time.monotonic() + self.expiry)
+        if not sent:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel.
+        If more than one coroutine waits on the same channel, the one that started waiting first gets the result.
+        """
+        assert self.valid_channel_name(channel)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            # Checking for messages and starting to wait happen under the lock, so that a message
+            # put from another thread in between can't be missed.
+            with self._lock:
+                self._clean_expired()
+                state = self._channel(channel)
+                if state.messages:
+                    _, message = state.messages.popleft()
+                    self.message_count -= 1
+                    self._discard_if_idle(channel, state)
+                    return message
+                waiter = loop.create_future()
+                state.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter in state.waiters:
+                        state.waiters.remove(waiter)
+                    elif state.messages:
+                        # We were woken up for a message but cancelled before taking it.
+                        self._wake_next(state)
+                    self._discard_if_idle(channel, state)
+                raise
+
+    async def new_channel(self, prefix="specific."):
+        """
+        Returns a new channel name that can be used by something in our
+        process as a specific channel.
+        """
+        return "%s.inmemory!%s" % (
+            prefix,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            waiting = {
+                name: state for name, state in self.channels.items() if state.waiters
+            }
+            self._reset()
+            # Keep the channels that coroutines are waiting on, so that they still receive new messages.
+            for name, state in waiting.items():
+                state.messages.clear()
+                self.channels[name] = state
+
+    async def close(self):
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        """
+        Adds the channel name to a group.
+        """
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        now = time.monotonic()
+        with self._lock:
+            self.groups.setdefault(group, dict())[channel] = now
+            self.channel_groups.setdefault(channel, set()).add(group)
+            self.group_expiries.append((now + self.group_expiry, group, channel))
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        with self._lock:
+            self._remove_from_group(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+
+        with self._lock:
+            self._clean_expired()
+            members = list(self.groups.get(group, ()))
+        if not members:
+            return
+
+        # Each member gets its own copy, but a shallow copy is enough for flat messages.
+        copy = _copy_for(message)
+        copies = [copy(message) for _ in members]
+        expiry = time.monotonic() + self.expiry
+        with self._lock:
+            for channel, member_message in zip(members, copies):
+                if not self._put(channel, member_message, expiry):
+                    self.dropped_count += 1
+
+    # Capacity accounting
+
+    def stats(self) -> dict:
+        """
+        Current message counts for the layer. `channels` maps each channel with pending
+        messages to a (pending, capacity) pair.
+        """
+        with self._lock:
+            return self._stats()
+
+    def _stats(self) -> dict:
+        return {
+            "messages": self.message_count,
+            "sent": self.sent_count,
+            "dropped": self.dropped_count,
+            "expired": self.expired_count,
+            "groups": len(self.groups),
+            "channels": {
+                name: (len(state.messages), state.capacity)
+                for name, state in self.channels.items()
+                if state.messages
+            },
+        }
+
+    # Internals
+
+    def _channel(self, channel) -> _Channel:
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = _Channel(self.get_capacity(channel))
+        return state
+
+    def _discard_if_idle(self, channel, state):
+        if not state.messages and not state.waiters:
+            self.channels.pop(channel, None)
+
+    def _put(self, channel, message, expiry) -> bool:
+        state = self._channel(channel)
+        if len(state.messages) >= state.capacity:
+            return False
+        state.messages.append((expiry, message))
+        self.message_expiries.append((expiry, channel))
+        self.message_count += 1
+        self.sent_count += 1
+        self._wake_next(state)
+        return True
+
+    def _wake_next(self, state):
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                _wake(waiter)
+                return
+
+    def _remove_from_group(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None and members.pop(channel, None) is not None:
+            if not members:
+                del self.groups[group]
+        groups = self.channel_groups.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.channel_groups[channel]
+
+    def _clean_expired(self):
+        """
+        Remove expired messages and group memberships. Any channel with an expired message
+        is removed from all of its groups.
+        """
+        now = time.monotonic()
+
+        while self.message_expiries and self.message_expiries[0][0] < now:
+            _, channel = self.message_expiries.popleft()
+            state = self.channels.get(channel)
+            if state is None:
+                continue
+            expired = False
+            while state.messages and state.messages[0][0] < now:
+                state.messages.popleft()
+                self.message_count -= 1
+                self.expired_count += 1
+                expired = True
+            if expired:
+                for group in list(self.channel_groups.get(channel, ())):
+                    self._remove_from_group(group, channel)
+                self._discard_if_idle(channel, state)
+
+        while self.group_expiries and self.group_expiries[0][0] < now:
+            _, group, channel = self.group_expiries.popleft()
+            joined = self.groups.get(group, {}).get(channel)
+            # Only expire the membership if it wasn't refreshed by a later group_add.
+            if joined is not None and joined + self.group_expiry < now:
+                self._remove_from_group(group, channel)
+
+
+_SCALARS = (str, bytes, int, float, bool, type(None))
+
+
+def _copy_for(message):
+    """
+    The cheapest way to give a receiver its own copy of `message`.
+    """
+    if all(isinstance(value, _SCALARS) for value in message.values()):
+        return dict
+    return deepcopy
+
+
+def _encode(payload) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload).encode("utf-8")
+
+
+def _decode(data: bytes):
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data.decode("utf-8"))
+
+
+class UnixSocketChannelLayer(InMemoryChannelLayer):
+    """
+    Channel layer for several worker processes on the same host, without a network hop to Redis:
+
+        CHANNEL_LAYERS = {
+            "default": {
+                "BACKEND": "rest_live.layers.UnixSocketChannelLayer",
+                "CONFIG": {"path": "/run/rest-live"},
+            }
+        }
+
+    Every process listens on a Unix domain socket in `path`, named after its process ID. Group membership is
+    only stored in the process that owns the channel, so `group_send` delivers to local members directly and
+    sends one frame to each other process with members in the group, which then delivers to its own members.
+    Messages sent to a process-specific channel (like the ones returned by `new_channel()`) are forwarded to
+    the owning process. Messages sent to other channel names are only delivered within the sending process.
+
+    Processes tell each other which groups they have members in: all of them when another process first
+    connects, and then whenever a group gains its first member or loses its last. Adding the first member
+    waits until every other process has acknowledged it (for up to `ack_timeout` seconds), so messages sent
+    to the group afterwards reach it. Until a process has heard from another, it sends every group message to it.
+
+    All socket I/O happens on an event loop in a thread of its own, so connections are shared by every
+    event loop using the layer, including the short-lived ones of `async_to_sync`, and received messages
+    are delivered to receivers on other loops through the lock of `InMemoryChannelLayer`.
+
+    Sockets of processes that have exited are removed by the first process that fails to connect to them.
+    Messages are encoded with msgpack if it is installed, and as JSON otherwise; all processes sharing a
+    `path` must use the same encoding.
+    """
+
+    ack_timeout = 1.0
+
+    def __init__(self, path=None, peer_refresh=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or os.path.join(tempfile.gettempdir(), "rest-live")
+        self.peer_refresh = peer_refresh
+        self.process_id = "%d-%s" % (
+            os.getpid(),
+            "".join(random.choice(string.ascii_letters) for i in range(6)),
+        )
+        self.socket_path = os.path.join(self.path, f"{self.process_id}.sock")
+
+        self._io_loop = None
+        self._io_thread = None
+        self._io_lock = threading.Lock()
+        # The rest is only used on the I/O loop.
+        self._server = None
+        # Peer process ID -> stream writer.
+        self._writers: Dict[str, asyncio.StreamWriter] = dict()
+        self._peers: List[str] = []
+        self._peers_listed_at = None
+        # Peer process ID -> groups it has members in. Peers missing from `_peers_heard_from` may have
+        # members in any group.
+        self._peer_groups: Dict[str, Set[str]] = dict()
+        self._peers_heard_from: Set[str] = set()
+        # Acknowledgement ID -> future resolved when a peer acknowledges a group gaining its first member.
+        self._acks: Dict[int, asyncio.Future] = dict()
+        self._ack_ids = itertools.count()
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific."):
+        await self._ensure_server()
+        return "%s.%s!%s" % (
+            prefix,
+            self.process_id,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    async def send(self, channel, message):
+        owner = self._owner(channel)
+        if owner is None or owner == self.process_id:
+            await super().send(channel, message)
+            return
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        await self._on_io_loop(
+            self._send_to_peer(owner, _encode(["send", channel, message]))
+        )
+
+    async def receive(self, channel):
+        await self._ensure_server()
+        return await super().receive(channel)
+
+    async def close(self):
+        with self._io_lock:
+            loop, thread = self._io_loop, self._io_thread
+            self._io_loop = self._io_thread = None
+        if loop is None:
+            return
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._close_io(), loop))
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        owner = self._owner(channel)
+        if owner is not None and owner != self.process_id:
+            await self._on_io_loop(self._forward_group_add(owner, group, channel))
+            return
+        await self._ensure_server()
+        await self._on_io_loop(self._group_add_local(group, channel))
+
+    async def group_discard(self, group, channel):
+        owner = self._owner(channel)
+        if owner is not None and owner != self.process_id:
+            await self._on_io_loop(
+                self._send_to_peer(owner, _encode(["group_discard", group, channel]))
+            )
+            return
+        await self._on_io_loop(self._group_discard_local(group, channel))
+
+    async def group_send(self, group, message):
+        await super().group_send(group, message)
+        frame = _encode(["group_send", group, message])
+        await self._on_io_loop(self._send_to_members(group, frame))
+
+    # Internals
+
+    def _owner(self, channel):
+        """
+        The ID of the process that owns a process-specific channel, or None for other channels.
+        """
+        if "!" not in channel:
+            return None
+        owner = channel[: channel.find("!")].rsplit(".", 1)[-1]
+        return owner or None
+
+    async def _on_io_loop(self, coroutine):
+        """
+        Run a coroutine on the layer's I/O loop, starting it if needed, and wait for its result.
+        """
+        with self._io_lock:
+            if self._io_loop is None:
+                self._io_loop = asyncio.new_event_loop()
+                self._io_thread = threading.Thread(
+                    target=self._io_loop.run_forever,
+                    name="rest-live-unix-layer",
+                    daemon=True,
+                )
+                self._io_thread.start()
+            loop = self._io_loop
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coroutine, loop)
+        )
+
+    async def _ensure_server(self):
+        if self._server is None:
+            await self._on_io_loop(self._start_server())
+
+    async def _start_server(self):
+        if self._server is not None:
+            return
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_peer, path=self.socket_path
+        )
+
+    async def _close_io(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = dict()
+        # Stop reading from peers' connections, and any replies still being sent.
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle_peer(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                frame = _decode(await reader.readexactly(int.from_bytes(header, "big")))
+                await self._handle_frame(*frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_frame(self, op, target, payload):
+        if op == "send":
+            with self._lock:
+                if not self._put(target, payload, time.monotonic() + self.expiry):
+                    self.dropped_count += 1
+        elif op == "group_send":
+            await InMemoryChannelLayer.group_send(self, target, payload)
+        elif op == "group_add":
+            await self._group_add_local(target, payload)
+        elif op == "group_discard":
+            await self._group_discard_local(target, payload)
+        elif op == "hello":
+            # A process connected to us, and needs to know which groups we have members in.
+            if target not in self._peers:
+                self._peers.append(target)
+            with self._lock:
+                groups = list(self.groups)
+            asyncio.ensure_future(
+                self._send_to_peer(target, _encode(["groups", self.process_id, groups]))
+            )
+        elif op == "groups":
+            # Merged rather than replaced, since groups we've added members to on the peer's behalf
+            # may not have reached it yet.
+            self._peer_groups.setdefault(target, set()).update(payload)
+            self._peers_heard_from.add(target)
+        elif op == "group_members":
+            group, has_members, ack_id = payload
+            if has_members:
+                self._peer_groups.setdefault(target, set()).add(group)
+            else:
+                self._peer_groups.get(target, set()).discard(group)
+            if ack_id is not None:
+                asyncio.ensure_future(
+                    self._send_to_peer(target, _encode(["ack", self.process_id, ack_id]))
+                )
+        elif op == "ack":
+            ack = self._acks.pop(payload, None)
+            if ack is not None and not ack.done():
+                ack.set_result(None)
+
+    async def _group_add_local(self, group, channel):
+        had_members = group in self.groups
+        await InMemoryChannelLayer.group_add(self, group, channel)
+        if not had_members:
+            await self._announce(group)
+
+    async def _group_discard_local(self, group, channel):
+        had_members = group in self.groups
+        await InMemoryChannelLayer.group_discard(self, group, channel)
+        if had_members and group not in self.groups:
+            await self._announce(group)
+
+    async def _announce(self, group):
+        """
+        Tell every other process whether we now have members in a group. If we do, wait for them to
+        acknowledge it, so that they send us messages for the group from then on.
+        """
+        has_members = group in self.groups
+        acks = dict()
+        sends = []
+        for peer in self._list_peers():
+            ack_id = None
+            if has_members:
+                ack_id = next(self._ack_ids)
+                acks[ack_id] = self._acks[ack_id] = asyncio.get_running_loop().create_future()
+            frame = _encode(["group_members", self.process_id, [group, has_members, ack_id]])
+            sends.append(self._send_to_peer(peer, frame))
+        sent = await asyncio.gather(*sends)
+        waiting = [
+            ack for ack, delivered in zip(acks.values(), sent) if delivered
+        ]
+        try:
+            if waiting:
+                await asyncio.wait(waiting, timeout=self.ack_timeout)
+        finally:
+            for ack_id in acks:
+                self._acks.pop(ack_id, None)
+
+    async def _forward_group_add(self, owner, group, channel):
+        # Send to the owner's members from now on, without waiting for it to tell us it has some.
+        self._peer_groups.setdefault(owner, set()).add(group)
+        await self._send_to_peer(owner, _encode(["group_add", group, channel]))
+
+    async def _send_to_members(self, group, frame: bytes):
+        await asyncio.gather(
+            *(
+                self._send_to_peer(peer, frame)
+                for peer in self._list_peers()
+                if peer not in self._peers_heard_from
+                or group in self._peer_groups.get(peer, ())
+            )
+        )
+
+    def _list_peers(self) -> List[str]:
+        now = time.monotonic()
+        if self._peers_listed_at is None or now - self._peers_listed_at > self.peer_refresh:
+            try:
+                names = os.listdir(self.path)
+            except FileNotFoundError:
+                names = []
+            self._peers = [
+                name[: -len(".sock")]
+                for name in names
+                if name.endswith(".sock") and name != f"{self.process_id}.sock"
+            ]
+            self._peers_listed_at = now
+        return self._peers
+
+    async def _send_to_peer(self, peer, frame: bytes) -> bool:
+        """
+        Send a frame to a peer, returning whether it could be written.
+        """
+        socket_path = os.path.join(self.path, f"{peer}.sock")
+        # If a cached connection turns out to be broken, reconnect and try once more.
+        for _ in range(2):
+            writer = self._writers.get(peer)
+            if writer is None or writer.is_closing():
+                try:
+                    _, writer = await asyncio.open_unix_connection(socket_path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Nothing is listening, so the process has exited.
+                    self._forget_peer(peer, socket_path)
+                    return False
+                self._writers[peer] = writer
+                # Introduce ourselves, so that the peer tells us which groups it has members in.
+                hello = _encode(["hello", self.process_id, None])
+                writer.write(len(hello).to_bytes(4, "big") + hello)
+
+            try:
+                writer.write(len(frame).to_bytes(4, "big") + frame)
+                await writer.drain()
+                return True
+            except ConnectionError:
+                self._writers.pop(peer, None)
+                writer.close()
+        return False
+
+    def _forget_peer(self, peer, socket_path):
+        if peer in self._peers:
+            self._peers.remove(peer)
+        self._peer_groups.pop(peer, None)
+        self._peers_heard_from.discard(peer)
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_live.profiling import load_entries
+from rest_live.settings import live_settings
+
+
+SORT_KEYS = {
+    "wall": lambda entry: entry.wall_time,
+    "query": lambda entry: entry.query_time,
+    "count": lambda entry: entry.count,
+    "mean": lambda entry: entry.wall_time / entry.count if entry.count else 0,
+    "max": lambda entry: entry.max_wall_time,
+}
+
+
+class Command(BaseCommand):
+    help = "Dump the most expensive (view, action, stage) entries recorded by the rest_live profiler."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n", "--top", type=int, default=20, help="Number of entries to show."
+        )
+        parser.add_argument(
+            "--sort",
+            choices=sorted(SORT_KEYS),
+            default="wall",
+            help="Column to sort entries by, descending.",
+        )
+        parser.add_argument(
+            "--dir",
+            default=None,
+            help="Directory profiler dumps are written to. Defaults to REST_LIVE['PROFILE_DIR'].",
+        )
+
+    def handle(self, *args, **options):
+        dump_dir = options["dir"] or live_settings.PROFILE_DIR
+        entries = load_entries(dump_dir)
+        if not entries:
+            raise CommandError(
+                "No profiler data found. Set REST_LIVE['PROFILE'] = True and "
+                "REST_LIVE['PROFILE_DIR'] to collect data from running workers."
+            )
+
+        entries.sort(key=SORT_KEYS[options["sort"]], reverse=True)
+        header = f"{'view':<50} {'action':<10} {'stage':<10} {'count':>8} {'wall ms':>10} {'query ms':>10} {'mean ms':>9} {'max ms':>9}"
+        self.stdout.write(header)
+        for entry in entries[: options["top"]]:
+            self.stdout.write(
+                f"{entry.view:<50} {entry.action:<10} {entry.stage:<10} {entry.count:>8} "
+                f"{entry.wall_time * 1000:>10.2f} {entry.query_time * 1000:>10.2f} "
+                f"{entry.wall_time * 1000 / max(entry.count, 1):>9.2f} {entry.max_wall_time * 1000:>9.2f}"
+            )
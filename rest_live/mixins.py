@@ -1,13 +1,17 @@
+import json
 from io import BytesIO
-from typing import Type, Set, Tuple, Dict, Any, Optional
+from typing import Type, Set, Tuple, Dict, Any, Optional, Sequence
 
 from channels.http import AsgiRequest
+from django.apps import apps
 from django.db.models import Model
 from django.db.models.signals import post_save, post_delete
 from django.utils.decorators import classonlymethod
 from django.utils.http import urlencode
 from rest_framework.generics import GenericAPIView
-from rest_live.signals import delete_handler, save_handler
+from rest_live import signals
+from rest_live.index import index_attnames
+from rest_live.signals import delete_handler, dependency_handler, save_handler
 
 
 class RealtimeMixin(object):
@@ -17,6 +21,40 @@ class RealtimeMixin(object):
     metadata rather than an HTTP request.
     """
 
+    # Minimum number of seconds between save events for any one instance of the view's model.
+    # Saves within the interval are collapsed into a single trailing event. Deletes are never delayed.
+    live_min_interval: Optional[float] = None
+
+    # If set, broadcasts decide whether a changed instance is in a subscription's queryset in Python when
+    # the queryset only uses simple lookups on the model's own fields. See `rest_live.predicates`.
+    live_in_memory_filters = False
+
+    # Fields that subscriptions to this view are indexed by, when their queryset requires an exact value
+    # for one of them (like `list` for `?list=17`). Events are then only evaluated for the subscriptions
+    # whose value matches the changed instance, or which could already see it.
+    live_index_fields: Sequence[str] = ()
+
+    # Whether every instance of the model is visible to subscriptions to this view, so that broadcasts
+    # can skip checking the instance against the queryset. By default (`None`), this is detected for each
+    # subscription when it's created, from whether its filtered queryset has no filters at all.
+    live_all_visible: Optional[bool] = None
+
+    # A field which increases with every save of an instance, like a version counter or modification time.
+    # Save events carry its value, so that broadcasts reading from the `READ_DATABASE` replica can tell
+    # when the replica hasn't caught up yet and read from the primary instead. Without it, only creations
+    # are read from the replica.
+    live_version_field: Optional[str] = None
+
+    # If set, identical subscriptions in the process, like those of one user's open tabs, share the set of
+    # instances they can see and evaluate each event once between them. Subscriptions are identical when
+    # they have the same `get_live_snapshot_key()`.
+    live_shared_state = False
+
+    # Related models that this view's serialized data or queryset depends on, as a mapping from model label
+    # to the lookup from the view's model to it, like `{"test_app.List": "list"}`. Saving a related instance
+    # re-evaluates the instances which refer to it, in batches, as if they had been saved.
+    live_depends_on: Dict[str, str] = dict()
+
     def get_model_class(self) -> Type[Model]:
         """
         Get the model class from the `queryset` property on the view class. This method can be called
@@ -48,7 +86,69 @@ class RealtimeMixin(object):
 
         post_save.connect(save_handler, sender=model_class, dispatch_uid=f"rest-live")
         post_delete.connect(delete_handler, sender=model_class, dispatch_uid=f"rest-live")
-        return viewset.get_model_class()._meta.label
+
+        label = model_class._meta.label
+        if cls.live_min_interval:
+            signals.min_intervals[label] = cls.live_min_interval
+        if cls.live_index_fields:
+            # Views of the same model may index different fields, and events must carry all of them.
+            attnames = list(signals.index_fields.get(label, []))
+            for attname in index_attnames(model_class, cls.live_index_fields):
+                if attname not in attnames:
+                    attnames.append(attname)
+            signals.index_fields[label] = attnames
+        if cls.live_version_field:
+            signals.version_fields[label] = model_class._meta.get_field(
+                cls.live_version_field
+            ).attname
+        for related_label, lookup in cls.live_depends_on.items():
+            related_model = apps.get_model(related_label)
+            # Fail on registration rather than on the first save if the lookup is invalid.
+            model_class._base_manager.filter(**{f"{lookup}__pk": None})
+            post_save.connect(
+                dependency_handler,
+                sender=related_model,
+                dispatch_uid="rest-live-dependencies",
+            )
+            dependents = signals.dependencies.setdefault(
+                related_model._meta.label, []
+            )
+            if (label, lookup) not in dependents:
+                dependents.append((label, lookup))
+        return label
+
+    def get_live_serializer_context_key(self):
+        """
+        Identify everything besides the instance that this view's serialized data depends on, so that
+        it can be shared between subscriptions, and through the serializer cache. By default, that's the
+        user, the action and the subscription's view kwargs. Query parameters are taken to be filters,
+        which decide what's visible but not how it's serialized; override this to include them if your
+        serializer reads them, or to share more widely if it doesn't depend on the user.
+        """
+        user = getattr(self.request, "user", None)
+        return json.dumps(
+            [getattr(user, "pk", None), self.action, self.kwargs],
+            sort_keys=True,
+            default=str,
+        )
+
+    def get_live_snapshot_key(self):
+        """
+        Identify everything that this view's filtered queryset depends on, so that snapshots taken when
+        subscribing can be shared between connections through the snapshot cache. By default, that's the
+        user, the action and the subscription's view kwargs and query parameters.
+        """
+        user = getattr(self.request, "user", None)
+        return json.dumps(
+            [
+                getattr(user, "pk", None),
+                self.action,
+                self.kwargs,
+                sorted(self.request.query_params.lists()),
+            ],
+            sort_keys=True,
+            default=str,
+        )
 
     @classonlymethod
     def from_scope(cls, viewset_action, scope, view_kwargs, query_params):
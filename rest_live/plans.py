@@ -0,0 +1,152 @@
+"""
+Serialize instances for broadcasts without constructing a serializer each time.
+
+Constructing a DRF serializer deep-copies its declared fields, and the first access to `.fields` builds
+and binds every field again, which for a simple `ModelSerializer` costs more than serializing one
+instance. A `SerializerPlan` does that work once per serializer class, and then serializes instances
+with the same bound fields.
+
+Fields are shared between every subscription using the plan, and are bound without a context, so that
+plans don't keep any request alive. So only serializers whose output can't depend on the context or on
+per-instance serializer state are planned: serializers which define nothing but a `Meta` and
+declared fields, all of the simple types in `PLANNABLE_FIELDS`. `get_plan` returns `None` for anything else, and the caller should construct
+the serializer as usual.
+"""
+import functools
+import threading
+import types
+from typing import Dict, List, Optional
+
+from django.core.signals import setting_changed
+from rest_framework import fields, relations, serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+# Fields whose representation of a value depends on nothing but the value and the field's own arguments.
+# Matched by exact type, since subclasses may override `to_representation`.
+PLANNABLE_FIELDS = {
+    fields.BooleanField,
+    fields.CharField,
+    fields.EmailField,
+    fields.RegexField,
+    fields.SlugField,
+    fields.URLField,
+    fields.UUIDField,
+    fields.IPAddressField,
+    fields.IntegerField,
+    fields.FloatField,
+    fields.DecimalField,
+    fields.DateTimeField,
+    fields.DateField,
+    fields.TimeField,
+    fields.DurationField,
+    fields.ChoiceField,
+    fields.JSONField,
+    fields.ModelField,
+    fields.ReadOnlyField,
+    relations.PrimaryKeyRelatedField,
+}
+
+# Class attributes which are behaviour rather than configuration. Any of them on a serializer may make its
+# fields or output depend on the context or instance, for example by overriding one of DRF's many
+# field-building hooks.
+METHOD_TYPES = (types.FunctionType, classmethod, staticmethod, property, functools.cached_property)
+
+
+class SerializerPlan:
+    """
+    The bound, readable fields of a serializer, which serialize instances the way
+    `Serializer.to_representation` does.
+    """
+
+    def __init__(self, readable_fields: List[fields.Field]):
+        self.fields = readable_fields
+
+    def serialize(self, instance) -> dict:
+        data = {}
+        for field in self.fields:
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+
+            check_for_none = (
+                attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            )
+            if check_for_none is None:
+                data[field.field_name] = None
+            else:
+                data[field.field_name] = field.to_representation(attribute)
+        return data
+
+
+def _is_plannable_field(field) -> bool:
+    if type(field) not in PLANNABLE_FIELDS or field.source == "*":
+        return False
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        return field.pk_field is None or _is_plannable_field(field.pk_field)
+    return True
+
+
+def _is_plannable_serializer(serializer_class) -> bool:
+    if not issubclass(serializer_class, serializers.Serializer):
+        return False
+    for klass in serializer_class.__mro__:
+        if klass is object or klass.__module__.split(".")[0] == "rest_framework":
+            continue
+        if any(isinstance(value, METHOD_TYPES) for value in vars(klass).values()):
+            return False
+    return True
+
+
+def build_plan(serializer_class) -> Optional[SerializerPlan]:
+    """
+    Build the plan for a serializer class, or return `None` if it can't be planned.
+    """
+    if not _is_plannable_serializer(serializer_class):
+        return None
+    try:
+        readable_fields = list(serializer_class()._readable_fields)
+    except Exception:
+        # Serializers which can't be built without an instance are serialized the usual way,
+        # which raises any error where users expect it.
+        return None
+    if not all(_is_plannable_field(field) for field in readable_fields):
+        return None
+    return SerializerPlan(readable_fields)
+
+
+# Serializer class -> plan, or `None` if the serializer can't be planned.
+_plans: Dict[type, Optional[SerializerPlan]] = dict()
+_plans_lock = threading.Lock()
+
+
+def get_plan(serializer_class) -> Optional[SerializerPlan]:
+    """
+    Get the cached plan for a serializer class, building it on first use. Returns `None` if the
+    serializer can't be planned.
+    """
+    try:
+        return _plans[serializer_class]
+    except KeyError:
+        pass
+    with _plans_lock:
+        if serializer_class not in _plans:
+            _plans[serializer_class] = build_plan(serializer_class)
+        return _plans[serializer_class]
+
+
+def clear_plans():
+    """
+    Forget every plan, for example after changing settings which fields read when they're built.
+    """
+    with _plans_lock:
+        _plans.clear()
+
+
+def reload_plans(*args, setting, **kwargs):
+    if setting in ("REST_FRAMEWORK", "USE_TZ", "TIME_ZONE"):
+        clear_plans()
+
+
+setting_changed.connect(reload_plans)
@@ -0,0 +1,172 @@
+import inspect
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from asgiref.sync import SyncToAsync
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connections
+
+from rest_live.settings import live_settings
+
+
+@dataclass
+class PoolStats:
+    size: int
+    # Workers currently running a handler.
+    busy: int
+    # Handlers waiting for a free worker.
+    waiting: int
+    completed: int
+    # Total and worst time handlers spent waiting for a free worker, in seconds.
+    wait_time: float
+    max_wait_time: float
+    # Number of handlers which had to wait because every worker was busy.
+    saturated: int
+
+
+class ConnectionPool:
+    """
+    A bounded set of worker threads that consumer handlers run on. Django opens one database connection
+    per thread, so a process serving websockets holds at most `size` connections to each database,
+    however many connections and handlers are active.
+
+    Old connections are cleaned up before and after every handler, as `close_old_connections()` does
+    for HTTP requests, and each worker checks that its connections are still usable every
+    `health_check_interval` seconds, closing them if not so they are reopened on next use.
+    """
+
+    def __init__(self, size, health_check_interval=30, name="rest-live-db"):
+        if "executor" not in inspect.signature(SyncToAsync.__init__).parameters:
+            raise ImproperlyConfigured(
+                "REST_LIVE['DB_POOL_SIZE'] requires asgiref 3.5 or newer."
+            )
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix=name
+        )
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.busy = 0
+        self.completed = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.saturated = 0
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a synchronous function on one of the pool's workers, from async code.
+        """
+        work = self.wrap(func, *args, **kwargs)
+        return await SyncToAsync(work, thread_sensitive=False, executor=self.executor)()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """
+        Run a synchronous function on one of the pool's workers, from synchronous code.
+        """
+        return self.executor.submit(self.wrap(func, *args, **kwargs))
+
+    def wrap(self, func, *args, **kwargs):
+        queued = time.monotonic()
+        with self.lock:
+            if self.pending >= self.size:
+                self.saturated += 1
+            self.pending += 1
+
+        def work():
+            self.started(time.monotonic() - queued)
+            try:
+                self.prepare_connections()
+                return func(*args, **kwargs)
+            finally:
+                close_old_connections()
+                self.finished()
+
+        return work
+
+    def started(self, wait_time):
+        with self.lock:
+            self.busy += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def finished(self):
+        with self.lock:
+            self.pending -= 1
+            self.busy -= 1
+            self.completed += 1
+
+    def prepare_connections(self):
+        close_old_connections()
+        now = time.monotonic()
+        if now - getattr(self.local, "last_health_check", 0) >= self.health_check_interval:
+            self.local.last_health_check = now
+            self.check_connections()
+
+    def check_connections(self):
+        """
+        Close this thread's connections which are no longer usable, so they are reopened on next use.
+        """
+        for connection in connections.all():
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+
+    def stats(self) -> PoolStats:
+        with self.lock:
+            return PoolStats(
+                size=self.size,
+                busy=self.busy,
+                waiting=self.pending - self.busy,
+                completed=self.completed,
+                wait_time=self.wait_time,
+                max_wait_time=self.max_wait_time,
+                saturated=self.saturated,
+            )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+# Setting for the size of the pool -> the pool.
+_pools: Dict[str, ConnectionPool] = dict()
+_pools_lock = threading.Lock()
+
+
+def _configured_pool(size_setting, name) -> Optional[ConnectionPool]:
+    size = getattr(live_settings, size_setting)
+    pool = _pools.get(size_setting)
+    if pool is not None and pool.size == size:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(size_setting)
+        if pool is not None and pool.size != size:
+            del _pools[size_setting]
+            pool.shutdown()
+            pool = None
+        if pool is None and size:
+            pool = _pools[size_setting] = ConnectionPool(
+                size,
+                health_check_interval=live_settings.DB_POOL_HEALTH_CHECK_INTERVAL,
+                name=name,
+            )
+        return pool
+
+
+def get_pool() -> Optional[ConnectionPool]:
+    """
+    Get the process-wide pool for consumer handlers configured by `REST_LIVE["DB_POOL_SIZE"]`,
+    or `None` if it's disabled.
+    """
+    return _configured_pool("DB_POOL_SIZE", "rest-live-db")
+
+
+def get_evaluation_pool() -> Optional[ConnectionPool]:
+    """
+    Get the process-wide pool for evaluating subscriptions in parallel configured by
+    `REST_LIVE["EVALUATION_WORKERS"]`, or `None` if it's disabled.
+    """
+    return _configured_pool("EVALUATION_WORKERS", "rest-live-eval")
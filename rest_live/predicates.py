@@ -0,0 +1,279 @@
+"""
+Compile simple querysets into Python predicates, so that whether a changed instance belongs
+to a subscription's queryset can be decided without a database round trip.
+
+Only querysets over a single table whose filters are plain lookups against literal values
+are supported. Anything else (joins, annotations, expressions, subqueries, slicing, ...)
+makes `compile_queryset` return `None`, and the caller should fall back to the database.
+
+Lookups against strings depend on the database's collation, so they are only compiled for databases whose
+default comparisons are known (see `STRING_SEMANTICS`), and for columns without a `db_collation`.
+Case-insensitive comparisons are only made in Python for ASCII strings.
+
+Filter values are held in queries as the field's `get_prep_value()`, so instance values are converted the
+same way before being compared with them.
+"""
+import operator
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models.expressions import Col
+from django.db.models.lookups import Lookup
+from django.db.models.query import ModelIterable
+from django.db.models.sql.where import AND, OR, NothingNode, WhereNode
+
+Predicate = Callable[[object], bool]
+
+# Lookups are only trusted if they are Django's own, since subclasses may change their SQL.
+BUILTIN_LOOKUP_MODULES = (
+    "django.db.models.lookups",
+    "django.db.models.fields.related_lookups",
+)
+
+
+class Unsupported(Exception):
+    """
+    Raised when a predicate can't be evaluated against a particular instance, for example because
+    a field holds a value of an unexpected type. The caller should fall back to the database.
+    """
+
+
+# SQLite's LIKE, which Django uses for `contains`, `iexact` and `icontains`, only folds the case of ASCII letters.
+_ASCII_LOWER = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"
+)
+
+
+def _fold_ascii(value: str) -> str:
+    return value.translate(_ASCII_LOWER)
+
+
+def _fold_if_ascii(value: str) -> str:
+    # Other databases fold case with Unicode rules and the locale, which Python can't reproduce.
+    if not value.isascii():
+        raise Unsupported(f"Can't fold the case of {value!r} like the database")
+    return value.lower()
+
+
+def _string_lookup(compare, fold=None):
+    def lookup(value, rhs):
+        if not isinstance(value, str) or not isinstance(rhs, str):
+            raise Unsupported(f"Can't compare {value!r} with {rhs!r} in Python")
+        if fold is not None:
+            value, rhs = fold(value), fold(rhs)
+        return compare(value, rhs)
+
+    return lookup
+
+
+def _contains(value, rhs):
+    return rhs in value
+
+
+ORDERING_LOOKUPS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+LOOKUPS = {
+    "exact": operator.eq,
+    "in": lambda value, rhs: value in rhs,
+    **ORDERING_LOOKUPS,
+}
+
+# Database vendor -> how its lookups compare strings under the default collation. Lookups missing here,
+# or against strings on other databases (like MySQL, whose default collations are case-insensitive),
+# fall back to the database.
+STRING_SEMANTICS = {
+    "sqlite": {
+        "exact": operator.eq,
+        "in": LOOKUPS["in"],
+        "iexact": _string_lookup(operator.eq, _fold_ascii),
+        "contains": _string_lookup(_contains, _fold_ascii),
+        "icontains": _string_lookup(_contains, _fold_ascii),
+        # The BINARY collation compares code points, like Python.
+        **ORDERING_LOOKUPS,
+    },
+    "postgresql": {
+        "exact": operator.eq,
+        "in": LOOKUPS["in"],
+        "iexact": _string_lookup(operator.eq, _fold_if_ascii),
+        "contains": _string_lookup(_contains),
+        "icontains": _string_lookup(_contains, _fold_if_ascii),
+    },
+}
+
+
+def always(instance) -> bool:
+    return True
+
+
+def _is_simple(queryset) -> bool:
+    """
+    Whether a queryset returns plain instances of its model, whose membership only depends on its where tree.
+    """
+    query = queryset.query
+    return queryset._iterable_class is ModelIterable and not (
+        query.annotations
+        or query.extra
+        or query.combinator
+        or query.distinct_fields
+        or query.group_by is not None
+        or query.low_mark
+        or query.high_mark is not None
+    )
+
+
+def is_unfiltered(queryset) -> bool:
+    """
+    Whether every instance of the model is in `queryset`, like `Model.objects.all()`.
+    """
+    return _is_simple(queryset) and not queryset.query.where
+
+
+def compile_queryset(queryset) -> Optional[Predicate]:
+    """
+    Return a function which takes an instance of the queryset's model, freshly fetched from the database,
+    and returns whether it would be in the queryset. Returns `None` if the queryset can't be compiled.
+    """
+    if not _is_simple(queryset):
+        return None
+    query = queryset.query
+
+    node = _compile(query.where, query.base_table, connections[queryset.db].vendor)
+    if node is None:
+        return None
+    return lambda instance: node(instance) is True
+
+
+def _compile(node, base_alias, vendor):
+    """
+    Compile a node of a where tree into a function which evaluates it against an instance with
+    SQL's three-valued logic, where `None` stands for unknown.
+    """
+    if isinstance(node, NothingNode):
+        return lambda instance: False
+    if isinstance(node, WhereNode):
+        return _compile_where(node, base_alias, vendor)
+    if isinstance(node, Lookup):
+        return _compile_lookup(node, base_alias, vendor)
+    return None
+
+
+def _compile_where(node, base_alias, vendor):
+    if node.connector not in (AND, OR):
+        return None
+    children = [_compile(child, base_alias, vendor) for child in node.children]
+    if any(child is None for child in children):
+        return None
+
+    if node.connector == AND:
+        # An empty AND is true: an unfiltered queryset.
+        def evaluate(instance):
+            result = True
+            for child in children:
+                value = child(instance)
+                if value is False:
+                    return False
+                if value is None:
+                    result = None
+            return result
+
+    else:
+
+        def evaluate(instance):
+            result = False
+            for child in children:
+                value = child(instance)
+                if value is True:
+                    return True
+                if value is None:
+                    result = None
+            return result
+
+    if not node.negated:
+        return evaluate
+
+    def negated(instance):
+        value = evaluate(instance)
+        return None if value is None else not value
+
+    return negated
+
+
+def _compile_lookup(lookup, base_alias, vendor):
+    if type(lookup).__module__ not in BUILTIN_LOOKUP_MODULES:
+        return None
+    lhs, rhs = lookup.lhs, lookup.rhs
+    if not isinstance(lhs, Col) or lhs.alias != base_alias:
+        return None
+    if hasattr(rhs, "resolve_expression"):
+        return None
+    attname = lhs.target.attname
+    prep_value = lhs.target.get_prep_value
+
+    if lookup.lookup_name == "isnull":
+        return lambda instance: (getattr(instance, attname) is None) == bool(rhs)
+
+    values = [rhs]
+    if lookup.lookup_name == "in":
+        if isinstance(rhs, str) or any(hasattr(v, "resolve_expression") for v in rhs):
+            return None
+        values = rhs
+        try:
+            rhs = set(v for v in rhs if v is not None)
+        except TypeError:
+            return None
+
+    compare = LOOKUPS.get(lookup.lookup_name)
+    if any(isinstance(value, str) for value in values):
+        if getattr(lhs.target, "db_collation", None):
+            return None
+        compare = STRING_SEMANTICS.get(vendor, {}).get(lookup.lookup_name)
+    if compare is None:
+        return None
+
+    def evaluate(instance):
+        value = getattr(instance, attname)
+        if value is None:
+            return None
+        try:
+            value = prep_value(value)
+        except (TypeError, ValueError, ValidationError):
+            raise Unsupported(f"Can't convert {value!r} for the database in Python")
+        if value is None:
+            return None
+        try:
+            return compare(value, rhs)
+        except TypeError:
+            # Like a list from a JSONField looked up in a set, or values of different types compared.
+            raise Unsupported(f"Can't compare {value!r} with {rhs!r} in Python")
+
+    return evaluate
+
+
+def required_values(queryset) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the `(attname, value)` pairs of the `exact` lookups that every instance in `queryset`
+    must satisfy, from the lookups combined with AND at the top of its where tree.
+    """
+    query = queryset.query
+    if query.combinator:
+        return
+    vendor = connections[queryset.db].vendor
+    nodes = [query.where]
+    while nodes:
+        node = nodes.pop()
+        if node.negated or node.connector != AND:
+            continue
+        for child in node.children:
+            if isinstance(child, WhereNode):
+                nodes.append(child)
+                continue
+            if not isinstance(child, Lookup) or child.lookup_name != "exact":
+                continue
+            if _compile_lookup(child, query.base_table, vendor) is not None:
+                yield child.lhs.target.attname, child.rhs
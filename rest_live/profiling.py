@@ -0,0 +1,224 @@
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from rest_live import instrumentation
+from rest_live.settings import live_settings
+
+
+ProfileKey = Tuple[str, str, str]  # (view class, action, stage)
+
+DUMP_PREFIX = "rest-live-profile-"
+
+
+def view_label(view_class) -> str:
+    return f"{view_class.__module__}.{view_class.__qualname__}"
+
+
+@dataclass
+class ProfileEntry:
+    view: str
+    action: str
+    stage: str
+    count: int = 0
+    wall_time: float = 0.0
+    query_time: float = 0.0
+    max_wall_time: float = 0.0
+
+    @property
+    def key(self) -> ProfileKey:
+        return self.view, self.action, self.stage
+
+    def merge(self, other: "ProfileEntry"):
+        self.count += other.count
+        self.wall_time += other.wall_time
+        self.query_time += other.query_time
+        self.max_wall_time = max(self.max_wall_time, other.max_wall_time)
+
+
+class Profiler(instrumentation.Listener):
+    """
+    Attributes the wall time and query time spent evaluating subscriptions to (view class, action, stage)
+    in a bounded in-memory table. When the table is full, the entry with the least total wall time is
+    evicted to make room for new keys.
+
+    If `dump_dir` is set, the table is periodically written to `dump_dir` as JSON, one file per process, for
+    the `rest_live_profile` management command to read. If `budget` is set as well, the next evaluation
+    of a (view class, action) pair after one that took longer than `budget` seconds is run under cProfile,
+    and its stats are written to `dump_dir`.
+    """
+
+    def __init__(
+        self,
+        max_entries=500,
+        sample_rate=1.0,
+        dump_dir=None,
+        flush_interval=10,
+        budget=None,
+        cprofile_limit=5,
+    ):
+        self.max_entries = max_entries
+        self.sample_rate = sample_rate
+        self.dump_dir = dump_dir
+        self.flush_interval = flush_interval
+        self.budget = budget
+        self.cprofile_limit = cprofile_limit
+
+        self.entries: Dict[ProfileKey, ProfileEntry] = dict()
+        self.over_budget = set()
+        self.captures: Dict[Tuple[str, str], int] = dict()
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def should_trace(self, view_class, action) -> bool:
+        if (view_label(view_class), action) in self.over_budget:
+            return True
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def trace_started(self, trace):
+        key = (view_label(trace.view_class), trace.action)
+        if key not in self.over_budget or self.dump_dir is None:
+            return
+        os.makedirs(self.dump_dir, exist_ok=True)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread.
+            return
+        self.local.profile = profile
+
+    def trace_finished(self, trace):
+        view, action = view_label(trace.view_class), trace.action
+
+        profile = getattr(self.local, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self.local.profile = None
+            self.save_capture(profile, view, action, trace)
+
+        with self.lock:
+            for stage, wall_time in trace.stage_times.items():
+                self.record(
+                    view, action, stage, wall_time, trace.stage_query_times.get(stage, 0.0)
+                )
+
+            if self.budget is not None and trace.duration > self.budget:
+                if self.captures.get((view, action), 0) < self.cprofile_limit:
+                    self.over_budget.add((view, action))
+
+            should_flush = (
+                self.dump_dir is not None
+                and time.monotonic() - self.last_flush >= self.flush_interval
+            )
+            if should_flush:
+                self.last_flush = time.monotonic()
+                entries = [asdict(entry) for entry in self.entries.values()]
+
+        if should_flush:
+            self.flush(entries)
+
+    def record(self, view, action, stage, wall_time, query_time):
+        key = (view, action, stage)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_entries:
+                cheapest = min(self.entries.values(), key=lambda e: e.wall_time)
+                del self.entries[cheapest.key]
+            entry = self.entries[key] = ProfileEntry(view, action, stage)
+
+        entry.count += 1
+        entry.wall_time += wall_time
+        entry.query_time += query_time
+        entry.max_wall_time = max(entry.max_wall_time, wall_time)
+
+    def save_capture(self, profile, view, action, trace):
+        with self.lock:
+            self.over_budget.discard((view, action))
+            # Only keep captures of evaluations which were actually over budget.
+            if trace.duration <= self.budget:
+                return
+            count = self.captures[(view, action)] = (
+                self.captures.get((view, action), 0) + 1
+            )
+        filename = f"rest-live-{view}-{action}-{os.getpid()}-{count}.prof"
+        profile.dump_stats(os.path.join(self.dump_dir, filename))
+
+    def flush(self, entries=None):
+        if entries is None:
+            with self.lock:
+                entries = [asdict(entry) for entry in self.entries.values()]
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, f"{DUMP_PREFIX}{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(f"{path}.tmp", path)
+
+    def snapshot(self) -> List[ProfileEntry]:
+        with self.lock:
+            return [ProfileEntry(**asdict(entry)) for entry in self.entries.values()]
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def install():
+    """
+    Install a process-wide `Profiler` configured from the `REST_LIVE` settings.
+    """
+    global _profiler
+    uninstall()
+    _profiler = Profiler(
+        max_entries=live_settings.PROFILE_MAX_ENTRIES,
+        sample_rate=live_settings.PROFILE_SAMPLE_RATE,
+        dump_dir=live_settings.PROFILE_DIR,
+        flush_interval=live_settings.PROFILE_FLUSH_INTERVAL,
+        budget=live_settings.PROFILE_BUDGET,
+        cprofile_limit=live_settings.PROFILE_CPROFILE_LIMIT,
+    )
+    instrumentation.add_listener(_profiler)
+    return _profiler
+
+
+def uninstall():
+    global _profiler
+    if _profiler is not None:
+        instrumentation.remove_listener(_profiler)
+        _profiler = None
+
+
+def load_entries(dump_dir=None) -> List[ProfileEntry]:
+    """
+    Merge the entries of the profiler in this process with any dumped to `dump_dir` by other processes.
+    """
+    merged: Dict[ProfileKey, ProfileEntry] = dict()
+    sources = []
+    if dump_dir is not None and os.path.isdir(dump_dir):
+        for filename in sorted(os.listdir(dump_dir)):
+            if not filename.startswith(DUMP_PREFIX) or not filename.endswith(".json"):
+                continue
+            if filename == f"{DUMP_PREFIX}{os.getpid()}.json" and _profiler is not None:
+                continue  # The live table is more up to date than our own dump.
+            with open(os.path.join(dump_dir, filename)) as f:
+                sources.append([ProfileEntry(**entry) for entry in json.load(f)])
+    if _profiler is not None:
+        sources.append(_profiler.snapshot())
+
+    for entries in sources:
+        for entry in entries:
+            if entry.key in merged:
+                merged[entry.key].merge(entry)
+            else:
+                merged[entry.key] = entry
+    return list(merged.values())
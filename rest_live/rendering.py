@@ -0,0 +1,120 @@
+"""
+Render broadcasts for DRF's `JSONRenderer` without rendering a whole envelope per subscription.
+
+A broadcast is the envelope `{"type": "broadcast", "id": ..., "model": ..., "action": ..., "instance": ...}`.
+Everything before the instance only depends on the subscription and the action, so it's rendered once
+per subscription as a prefix, and the instance is encoded separately, once per serialized payload.
+Broadcasts are then built by concatenating the two.
+
+Payloads are encoded with [orjson](https://pypi.org/project/orjson/) when it is installed and the
+renderer uses DRF's default compact, unicode output, and with the renderer's own `json.dumps`
+options otherwise. orjson writes floats in exponent form differently (`1e16` rather than `1e+16`),
+and non-finite floats as `null`, so payloads holding such floats are encoded with `json.dumps` too,
+keeping the output byte-identical to DRF's. Other renderers, and `JSONRenderer` subclasses which
+override `render()`, are rendered the usual way.
+"""
+import json
+from typing import Optional
+
+from rest_framework.utils import encoders
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Types that orjson would encode differently from DRF's encoder are passed to the encoder's `default()`.
+_ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS
+    | orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None
+    else 0
+)
+_ENVELOPE_SUFFIX = "null}"
+
+
+def is_fast_renderer(renderer) -> bool:
+    return isinstance(renderer, JSONRenderer) and type(renderer).render is JSONRenderer.render
+
+
+def envelope_prefix(renderer, envelope) -> Optional[str]:
+    """
+    Render a broadcast envelope, without its instance, up to where the instance goes. Returns `None`
+    if the renderer doesn't put the instance at the end.
+    """
+    rendered = renderer.render(dict(envelope, instance=None)).decode("utf-8")
+    if not rendered.endswith(_ENVELOPE_SUFFIX):
+        return None
+    return rendered[: -len(_ENVELOPE_SUFFIX)]
+
+
+def encode(data, renderer) -> str:
+    """
+    Encode a payload the way `renderer.render()` would, without an indent.
+    """
+    encoded = None
+    if (
+        orjson is not None
+        and renderer.compact
+        and not renderer.ensure_ascii
+        and renderer.encoder_class is encoders.JSONEncoder
+    ):
+        try:
+            if not _has_unsafe_float(data):
+                encoded = orjson.dumps(
+                    data, default=_orjson_default, option=_ORJSON_OPTIONS
+                ).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # For example integers too large for orjson, which the json module handles.
+            pass
+    if encoded is None:
+        encoded = json.dumps(
+            data,
+            cls=renderer.encoder_class,
+            ensure_ascii=renderer.ensure_ascii,
+            allow_nan=not renderer.strict,
+            separators=SHORT_SEPARATORS if renderer.compact else LONG_SEPARATORS,
+        )
+    # Same escaping as `JSONRenderer.render()`, for embedding in javascript.
+    return encoded.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+_default = encoders.JSONEncoder().default
+
+
+class _UnsafeFloat(Exception):
+    pass
+
+
+def _orjson_default(obj):
+    value = _default(obj)
+    # Like decimals, which DRF may encode as floats.
+    if _has_unsafe_float(value):
+        raise _UnsafeFloat()
+    return value
+
+
+def _is_unsafe_float(value: float) -> bool:
+    # Python only uses exponent form outside this range, and orjson agrees with it inside. NaN and
+    # infinities are outside it too.
+    return not (value == 0 or 1e-4 <= abs(value) < 1e16)
+
+
+def _has_unsafe_float(data) -> bool:
+    """
+    Whether `data` holds a float that orjson would encode differently from the json module.
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if _is_unsafe_float(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
@@ -10,10 +10,20 @@ class RealtimeRouter:
     a Django Channels Consumer to handle subscriptions for those models.
     """
 
-    def __init__(self, public=True, uid="default"):
+    def __init__(
+        self,
+        public=True,
+        uid="default",
+        fanout_hub=False,
+        batch_window=0,
+        merge_broadcasts=False,
+    ):
         self.registry: Dict[str, Type[RealtimeMixin]] = dict()
         self.uid = uid
         self.public = public
+        self.fanout_hub = fanout_hub
+        self.batch_window = batch_window
+        self.merge_broadcasts = merge_broadcasts
 
     def register_all(self, views):
         for viewset in views:
@@ -39,5 +49,11 @@ class RealtimeRouter:
         return type(
             "BoundSubscriptionConsumer",
             (SubscriptionConsumer,),
-            dict(registry=self.registry, public=self.public),
+            dict(
+                registry=self.registry,
+                public=self.public,
+                fanout_hub=self.fanout_hub,
+                batch_window=self.batch_window,
+                merge_broadcasts=self.merge_broadcasts,
+            ),
         )
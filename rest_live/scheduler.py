@@ -0,0 +1,116 @@
+import asyncio
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from rest_live.settings import live_settings
+
+
+@dataclass
+class SchedulerStats:
+    slots: int
+    quantum: int
+    # Turns currently running and waiting for a slot.
+    active: int
+    waiting: int
+    turns: int
+    # Total and worst time turns spent waiting for a slot, in seconds.
+    wait_time: float
+    max_wait_time: float
+
+
+class FairScheduler:
+    """
+    Shares the work of evaluating broadcasts fairly between the connections served by one event loop.
+
+    Connections evaluate their subscriptions to an event in turns of at most `quantum` subscriptions,
+    and at most `slots` turns run at once. A connection with more subscriptions than that queues for
+    another turn behind every other connection waiting for one. Since each connection handles one message
+    at a time, it never has more than one turn waiting, so connections are served round-robin: a connection
+    with a single subscription waits for at most one turn of each other busy connection, however many
+    subscriptions those have.
+
+    Scheduling happens on the event loop, so there is one scheduler per loop. Use `get_scheduler()`
+    rather than instantiating this directly.
+    """
+
+    def __init__(self, slots=1, quantum=10):
+        self.slots = slots
+        self.quantum = quantum
+        self.active = 0
+        self.waiting = deque()
+        self.turns = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def turn(self):
+        """
+        Wait for a slot, and hold it for the duration of the `async with` block.
+        """
+        queued = time.monotonic()
+        if self.active < self.slots and not self.waiting:
+            self.active += 1
+        else:
+            granted = asyncio.get_running_loop().create_future()
+            self.waiting.append(granted)
+            try:
+                await granted
+            except asyncio.CancelledError:
+                if granted.done() and not granted.cancelled():
+                    self.release()  # The slot was handed over just as we were cancelled.
+                else:
+                    self.waiting.remove(granted)
+                raise
+
+        wait_time = time.monotonic() - queued
+        self.turns += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        # Hand the slot straight to the next waiting turn, if any.
+        while self.waiting:
+            granted = self.waiting.popleft()
+            if not granted.done():
+                granted.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> SchedulerStats:
+        return SchedulerStats(
+            slots=self.slots,
+            quantum=self.quantum,
+            active=self.active,
+            waiting=len(self.waiting),
+            turns=self.turns,
+            wait_time=self.wait_time,
+            max_wait_time=self.max_wait_time,
+        )
+
+
+# Event loop -> scheduler.
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_scheduler() -> Optional[FairScheduler]:
+    """
+    Get the scheduler for the running event loop as configured by `REST_LIVE["FAIR_SCHEDULING_QUANTUM"]`,
+    or `None` if fair scheduling is disabled.
+    """
+    quantum = live_settings.FAIR_SCHEDULING_QUANTUM
+    if not quantum:
+        return None
+    slots = live_settings.FAIR_SCHEDULING_SLOTS
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None or (scheduler.slots, scheduler.quantum) != (slots, quantum):
+        scheduler = _schedulers[loop] = FairScheduler(slots, quantum)
+    return scheduler
@@ -0,0 +1,57 @@
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Number of sub-groups each model group is split into on the channel layer.
+    "GROUP_SHARDS": 1,
+    # Per-view cost profiler. See `rest_live.profiling`.
+    "PROFILE": False,
+    "PROFILE_SAMPLE_RATE": 1.0,
+    "PROFILE_MAX_ENTRIES": 500,
+    "PROFILE_DIR": None,
+    "PROFILE_FLUSH_INTERVAL": 10,
+    "PROFILE_BUDGET": None,
+    "PROFILE_CPROFILE_LIMIT": 5,
+    # Slow broadcast query capture. See `rest_live.instrumentation.SlowQueryLog`.
+    "SLOW_QUERY_THRESHOLD": None,
+    "SLOW_QUERY_EXPLAIN_INTERVAL": 300,
+    "SLOW_QUERY_EXPLAINS_PER_MINUTE": 10,
+    "SLOW_QUERY_MAX_FINDINGS": 100,
+    # Database alias that broadcasts read from, falling back to the primary when it lags behind.
+    "READ_DATABASE": None,
+    # Bounded pool of worker threads, and so database connections, for consumer handlers. See `rest_live.pool`.
+    "DB_POOL_SIZE": None,
+    "DB_POOL_HEALTH_CHECK_INTERVAL": 30,
+    # Worker threads for evaluating a connection's subscriptions to an event in parallel.
+    "EVALUATION_WORKERS": None,
+    # Round-robin scheduling of broadcast evaluation between connections. See `rest_live.scheduler`.
+    "FAIR_SCHEDULING_QUANTUM": None,
+    "FAIR_SCHEDULING_SLOTS": 1,
+    # Process-wide cache of serialized instances. See `rest_live.cache`.
+    "SERIALIZER_CACHE_SIZE": None,
+    "SERIALIZER_CACHE_TTL": 60,
+    # Admission control and snapshot sharing for subscribe requests. See `rest_live.admission`.
+    "SUBSCRIBE_CONCURRENCY": None,
+    "SUBSCRIBE_MODEL_CONCURRENCY": None,
+    "SUBSCRIBE_QUEUE_TIMEOUT": 10,
+    "SNAPSHOT_CACHE_TTL": None,
+    # Maximum number of dependent instances re-evaluated per message when a related instance is saved.
+    "DEPENDENCY_BATCH_SIZE": 500,
+    # Instances tracked after the end of each windowed subscription's window. See `rest_live.windows`.
+    "WINDOW_BOUNDARY_SIZE": 10,
+}
+
+
+class LiveSettings:
+    """
+    Settings for `rest_live`, read from the `REST_LIVE` dictionary in the Django settings module.
+    Settings are looked up on access so that they can be overridden in tests.
+    """
+
+    def __getattr__(self, name):
+        if name not in DEFAULTS:
+            raise AttributeError(f"Invalid REST_LIVE setting: '{name}'")
+        return getattr(settings, "REST_LIVE", {}).get(name, DEFAULTS[name])
+
+
+live_settings = LiveSettings()
@@ -0,0 +1,172 @@
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+_MISSING = object()
+
+
+@dataclass
+class Step:
+    """
+    A set of changes evaluated against a shared state.
+    """
+
+    # (pk, is deleted, event ID) for each change, identifying the set of changes.
+    key: Tuple
+    # The broadcasts, as (position, action, instance data, renderer, index).
+    results: List[Tuple]
+    # pk -> lookup value the instance had in `visible` before the changes, or `_MISSING`.
+    undo: Dict[Any, Any]
+
+
+class SharedState:
+    """
+    Visibility state shared by identical subscriptions in the process, like those of one user's
+    browser tabs. The subscriptions share one `visible` dictionary (see `Subscription.pks_to_lookup_in_queryset`),
+    and the first of them to evaluate a set of changes records the result for the others, so that each set
+    is evaluated once however many subscriptions share the state.
+
+    Connections don't necessarily receive the same sets of changes: they may batch events differently, or
+    fall behind. So the state keeps the sets of changes it has evaluated in order, and each subscription's
+    position in them. A subscription whose next set of changes differs from the one recorded at its position,
+    or which falls more than `max_steps` behind, is detached: it gets its own copy of `visible` as of its
+    position, and evaluates changes by itself from then on.
+    """
+
+    max_steps = 1000
+
+    def __init__(self, visible: Dict[Any, Any], properties: Dict[str, Any]):
+        self.visible = visible
+        # Properties of subscriptions to the state. See `SubscriptionConsumer.snapshot`.
+        self.properties = properties
+        self.references = 0
+        # Held while evaluating, so that a subscription waits for another evaluating the same changes.
+        self.lock = threading.Lock()
+        self.steps: Deque[Step] = deque()
+        # Number of steps dropped from the front of `steps`.
+        self.offset = 0
+        # id(subscription) -> [subscription, number of steps it has applied].
+        self.cursors: Dict[int, list] = dict()
+
+    @property
+    def head(self) -> int:
+        return self.offset + len(self.steps)
+
+    def join(self, subscription):
+        with self.lock:
+            self.cursors[id(subscription)] = [subscription, self.head]
+
+    def leave(self, subscription) -> bool:
+        """
+        Remove a subscription from the state. Returns whether it was still sharing it.
+        """
+        with self.lock:
+            return self.cursors.pop(id(subscription), None) is not None
+
+    def replay(self, subscription, key: Optional[Tuple]) -> Optional[List[Tuple]]:
+        """
+        Get the results of the next set of changes for a subscription, if they have been evaluated already.
+        Returns `None` if the subscription must evaluate them itself: against `visible`, followed by `record()`,
+        if it's still attached, or by itself if it has been detached. Must be called with the lock held.
+        """
+        cursor = self.cursors[id(subscription)]
+        if cursor[1] < self.head:
+            step = self.steps[cursor[1] - self.offset]
+            if key is not None and step.key == key:
+                cursor[1] += 1
+                return step.results
+            self.detach(subscription)
+            return None
+
+        if key is None:
+            self.detach(subscription)
+            return None
+        # Subscriptions which joined after other subscriptions evaluated the changes share their results,
+        # since `visible` already reflects them.
+        for step in self.steps:
+            if step.key == key:
+                return step.results
+        return None
+
+    def record(self, subscription, key: Tuple, results: List[Tuple], undo: Dict[Any, Any]):
+        """
+        Record the results of a subscription evaluating the next set of changes. Must be called with the lock held.
+        """
+        self.steps.append(Step(key, results, undo))
+        self.cursors[id(subscription)][1] = self.head
+        while len(self.steps) > self.max_steps:
+            for lagging, position in list(self.cursors.values()):
+                if position == self.offset:
+                    self.detach(lagging)
+            self.steps.popleft()
+            self.offset += 1
+
+    def detach(self, subscription):
+        """
+        Stop sharing the state with a subscription, giving it its own copy of `visible` as of its position.
+        Must be called with the lock held.
+        """
+        subscription_cursor = self.cursors.pop(id(subscription), None)
+        if subscription_cursor is None:
+            return
+        visible = dict(self.visible)
+        for step in reversed(list(self.steps)[subscription_cursor[1] - self.offset :]):
+            for pk, value in step.undo.items():
+                if value is _MISSING:
+                    visible.pop(pk, None)
+                else:
+                    visible[pk] = value
+        subscription.pks_to_lookup_in_queryset = visible
+        subscription.shared = None
+        shared_states.release(subscription.shared_key)
+        subscription.shared_key = None
+
+    def undo_for(self, pks) -> Dict[Any, Any]:
+        return {pk: self.visible.get(pk, _MISSING) for pk in pks}
+
+
+class SharedStateStore:
+    """
+    Reference-counted shared states, by key. States are created by the first subscription to acquire
+    them and dropped when the last one releases them.
+    """
+
+    def __init__(self):
+        self.states: Dict[Hashable, SharedState] = dict()
+        self.lock = threading.Lock()
+
+    def acquire(
+        self, key, snapshot: Callable[[], Tuple[Dict[Any, Any], Dict[str, Any]]]
+    ) -> SharedState:
+        """
+        Get the state for `key`, taking a snapshot to create it if there isn't one.
+        """
+        with self.lock:
+            state = self.states.get(key)
+            if state is not None:
+                state.references += 1
+                return state
+        # Snapshot outside the lock, since it queries the database.
+        visible, properties = snapshot()
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = SharedState(dict(visible), properties)
+            state.references += 1
+            return state
+
+    def release(self, key):
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                return
+            state.references -= 1
+            if state.references <= 0:
+                del self.states[key]
+
+    def __len__(self):
+        return len(self.states)
+
+
+shared_states = SharedStateStore()
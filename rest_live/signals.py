@@ -1,34 +1,351 @@
+import asyncio
+import atexit
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.apps import apps
 
-from rest_live import get_group_name
+from rest_live import get_group_name, get_shard_names
+from rest_live.admission import get_snapshot_cache
+from rest_live.index import index_values
+from rest_live.settings import live_settings
 
 
-def save_handler(sender, instance, *args, **kwargs):
-    model_label = sender._meta.label  # noqa
-    channel_layer = get_channel_layer()
+logger = logging.getLogger(__name__)
+
+# Model label -> minimum number of seconds between save events for one instance.
+# Populated from `live_min_interval` when views are registered.
+min_intervals: Dict[str, float] = dict()
+# Model label -> attnames of the fields whose values are sent with save events, for subscription indexes.
+# Populated from `live_index_fields` when views are registered.
+index_fields: Dict[str, List[str]] = dict()
+# Model label -> attname of the field sent with save events as a commit marker, so that consumers reading
+# from a replica can tell whether it has caught up. Populated from `live_version_field`.
+version_fields: Dict[str, str] = dict()
+# Related model label -> (model label, lookup from the model to the related model) for each registered view
+# whose data depends on the related model. Populated from `live_depends_on` when views are registered.
+dependencies: Dict[str, List[Tuple[str, str]]] = dict()
+
+
+def commit_marker(value):
+    """
+    Convert the value of a version field into a marker which can be sent through the channel
+    layer and compared with others.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return value
+
+
+async def send_to_group(channel_layer, group_name, message):
+    """
+    Send a message to every shard of a model group concurrently.
+    """
+    await asyncio.gather(
+        *(
+            channel_layer.group_send(shard_name, message)
+            for shard_name in get_shard_names(group_name, live_settings.GROUP_SHARDS)
+        )
+    )
+
+
+class SaveCoalescer:
+    """
+    Rate-limits save events per instance. The first save of an instance is sent immediately. Saves
+    within `interval` seconds of the last event sent for that instance are collapsed into a single
+    trailing event, sent once the interval has passed.
+
+    Trailing events are scheduled on a single thread, however many instances are held back. Events still
+    pending when the process exits are sent by `flush()`, which runs at exit and can also be called
+    explicitly, for example at the end of a management command or task.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # (model label, pk) -> monotonic time before which further saves are held back.
+        self.blocked_until: Dict[Tuple[str, Any], float] = dict()
+        # (model label, pk) -> sequence number of the trailing event, interval, and the latest event to send.
+        self.pending: Dict[Tuple[str, Any], list] = dict()
+        # Heap of (deadline, sequence number, key) for trailing events. Entries for events which have
+        # since been sent or cancelled are skipped.
+        self.deadlines: List[Tuple[float, int, Tuple[str, Any]]] = []
+        self.sequence = itertools.count()
+        self.thread = None
+        self.prune_at = 1024
+
+    def save(self, key, interval, send: Callable[[], None]):
+        now = time.monotonic()
+        with self.lock:
+            if key in self.pending:
+                # A trailing event is already scheduled. Send this one instead when it's due.
+                self.pending[key][2] = send
+                return
+            blocked_until = self.blocked_until.get(key, now)
+            if blocked_until <= now:
+                self.blocked_until[key] = now + interval
+                self.prune(now)
+            else:
+                sequence = next(self.sequence)
+                self.pending[key] = [sequence, interval, send]
+                heapq.heappush(self.deadlines, (blocked_until, sequence, key))
+                self.start()
+                self.wakeup.notify()
+                return
+        send()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name="rest-live-coalescer", daemon=True
+            )
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            with self.lock:
+                due = self.pop_due(time.monotonic())
+                while not due:
+                    timeout = None
+                    if self.deadlines:
+                        timeout = max(self.deadlines[0][0] - time.monotonic(), 0)
+                    self.wakeup.wait(timeout)
+                    due = self.pop_due(time.monotonic())
+            for send in due:
+                self.send(send)
+
+    def pop_due(self, now) -> List[Callable[[], None]]:
+        """
+        Remove the trailing events which are due from the schedule. Must be called with the lock held.
+        """
+        due = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, sequence, key = heapq.heappop(self.deadlines)
+            pending = self.pending.get(key)
+            if pending is None or pending[0] != sequence:
+                continue  # Cancelled by a delete.
+            del self.pending[key]
+            self.blocked_until[key] = now + pending[1]
+            due.append(pending[2])
+        return due
+
+    def send(self, send: Callable[[], None]):
+        try:
+            send()
+        except Exception:
+            logger.exception("Failed to send trailing save event")
+
+    def flush(self):
+        """
+        Send every pending trailing event now.
+        """
+        with self.lock:
+            due = [pending[2] for pending in self.pending.values()]
+            self.pending = dict()
+            self.deadlines = []
+        for send in due:
+            self.send(send)
+
+    def discard(self, key):
+        """
+        Forget an instance, cancelling any trailing event for it.
+        """
+        with self.lock:
+            self.blocked_until.pop(key, None)
+            self.pending.pop(key, None)
+
+    def prune(self, now):
+        if len(self.blocked_until) < self.prune_at:
+            return
+        self.blocked_until = {
+            key: until for key, until in self.blocked_until.items() if until > now
+        }
+        self.prune_at = max(1024, 2 * len(self.blocked_until))
+
+
+coalescer = SaveCoalescer()
+
+
+def make_event(
+    event_type, model_label, instance_pk, values=None, version=None, created=False
+):
+    event = {
+        "type": event_type,
+        "model": model_label,
+        "instance_pk": instance_pk,
+        "channel_name": get_group_name(model_label),
+        # Identifies the event for connections sharing state. See `rest_live.shared`.
+        "event_id": uuid.uuid4().hex,
+    }
+    if values is not None:
+        event["values"] = values
+    if version is not None:
+        event["version"] = version
+    if created:
+        # A replica which has the instance at all has this save. See `SubscriptionConsumer.choose_read_database`.
+        event["created"] = True
+    return event
+
+
+# The event loop of the ASGI server, registered by `set_server_loop()`.
+_server_loop: Optional[weakref.ReferenceType] = None
+
+
+def set_server_loop(loop: Optional[asyncio.AbstractEventLoop] = None):
+    """
+    Register the event loop of the ASGI server, which trailing save events are sent on. Consumers register
+    it when they connect; processes that only serve HTTP can call this when they start, with no arguments
+    from within the running loop.
+    """
+    global _server_loop
+    _server_loop = weakref.ref(loop or asyncio.get_running_loop())
+
+
+def server_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """
+    The event loop registered by `set_server_loop()`, if it's still running. `None` otherwise, for
+    example in management commands and WSGI workers.
+    """
+    loop = _server_loop() if _server_loop is not None else None
+    if loop is not None and loop.is_running():
+        return loop
+    return None
+
+
+def send_event(
+    event_type,
+    model_label,
+    instance_pk,
+    values=None,
+    version=None,
+    loop=None,
+    created=False,
+):
+    """
+    Send an event to a model group. Events are sent on `loop` if it's given and still running, so that
+    ones sent from other threads reach channel layers bound to the server's event loop.
+    """
+    event = make_event(event_type, model_label, instance_pk, values, version, created)
+    if loop is not None and loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(
+            send_to_group(get_channel_layer(), event["channel_name"], event), loop
+        )
+        future.add_done_callback(log_send_failure)
+        return
+    async_to_sync(send_to_group)(get_channel_layer(), event["channel_name"], event)
+
+
+def log_send_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Failed to send event", exc_info=future.exception())
+
+
+def send_batch(model_label, events):
+    """
+    Send events for several instances of a model as one `model.batch` message, evaluated together by consumers.
+    """
     group_name = get_group_name(model_label)
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            "type": "model.saved",
-            "model": model_label,
-            "instance_pk": instance.pk,
-            "channel_name": group_name,
-        },
+    message = {
+        "type": "model.batch",
+        "model": model_label,
+        "channel_name": group_name,
+        "events": events,
+    }
+    async_to_sync(send_to_group)(get_channel_layer(), group_name, message)
+
+
+def invalidate_snapshots(model_label):
+    """
+    Drop the process's cached snapshots of a model as soon as it changes, rather than once its event
+    comes back from the channel layer.
+    """
+    snapshot_cache = get_snapshot_cache()
+    if snapshot_cache is not None:
+        snapshot_cache.invalidate(model_label)
+
+
+def save_handler(sender, instance, created=False, *args, **kwargs):
+    model_label = sender._meta.label  # noqa
+    invalidate_snapshots(model_label)
+    instance_pk = instance.pk
+    values = None
+    if model_label in index_fields:
+        values = index_values(
+            sender,
+            {attname: getattr(instance, attname) for attname in index_fields[model_label]},
+        )
+    version = None
+    if model_label in version_fields:
+        version = commit_marker(getattr(instance, version_fields[model_label]))
+
+    interval = min_intervals.get(model_label)
+    if not interval:
+        send_event(
+            "model.saved", model_label, instance_pk, values, version, created=created
+        )
+        return
+
+    # Trailing events are sent from the coalescer's thread, so send them on the server's event loop.
+    loop = server_loop()
+    coalescer.save(
+        (model_label, instance_pk),
+        interval,
+        lambda: send_event(
+            "model.saved", model_label, instance_pk, values, version, loop, created
+        ),
     )
 
 
 def delete_handler(sender, instance, *args, **kwargs):
     model_label = sender._meta.label  # noqa
-    channel_layer = get_channel_layer()
-    group_name = get_group_name(model_label)
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            "type": "model.deleted",
-            "model": model_label,
-            "instance_pk": instance.pk,
-            "channel_name": group_name,
-        },
-    )
+    invalidate_snapshots(model_label)
+    # Deletes are never rate-limited, and supersede any pending save of the instance.
+    if min_intervals.get(model_label):
+        coalescer.discard((model_label, instance.pk))
+    send_event("model.deleted", model_label, instance.pk)
+
+
+def dependency_handler(sender, instance, created=False, *args, **kwargs):
+    """
+    Send save events for the instances of registered models which depend on a saved related instance,
+    in batches of `DEPENDENCY_BATCH_SIZE`. This queries for the dependent instances on every save of an
+    existing related instance, whether or not any connection is subscribed to them.
+    """
+    if created:
+        # Nothing can refer to an instance that has only just been created.
+        return
+    for model_label, lookup in dependencies.get(sender._meta.label, ()):  # noqa
+        attnames = index_fields.get(model_label, [])
+        model = apps.get_model(model_label)
+        rows = (
+            model._base_manager.filter(**{f"{lookup}__pk": instance.pk})
+            .order_by("pk")
+            .values_list("pk", *attnames)
+        )
+        events = []
+        for pk, *values in rows:
+            event = make_event(
+                "model.saved",
+                model_label,
+                pk,
+                index_values(model, dict(zip(attnames, values))) if attnames else None,
+            )
+            # The instance itself hasn't changed, so its version can't tell whether a replica has caught up.
+            event["related"] = True
+            events.append(event)
+
+        if events:
+            invalidate_snapshots(model_label)
+        batch_size = live_settings.DEPENDENCY_BATCH_SIZE
+        for i in range(0, len(events), batch_size):
+            send_batch(model_label, events[i : i + batch_size])
@@ -8,6 +8,8 @@ from django.http import HttpRequest, SimpleCookie
 from importlib import import_module
 from channels.db import database_sync_to_async
 
+from rest_live import instrumentation
+
 
 class APICommunicator(ApplicationCommunicator):
     def __init__(self, application, path, headers=None, subprotocols=None, **extra):
@@ -166,3 +168,26 @@ def force_login(user, backend=None):
 async def get_headers_for_user(user):
     cookies = await force_login(user)
     return [(b"cookie", cookies.output(header="", sep="; ").encode())]
+
+
+class BroadcastRecorder(instrumentation.Listener):
+    """
+    Context manager which records a `BroadcastTrace` for every subscription evaluated
+    by any consumer in this process while it is active. Pass `view` to only record traces
+    for subscriptions to a specific view class.
+    """
+
+    def __init__(self, view=None):
+        self.view = view
+        self.traces = []
+
+    def trace_finished(self, trace):
+        if self.view is None or trace.view_class is self.view:
+            self.traces.append(trace)
+
+    def __enter__(self):
+        instrumentation.add_listener(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        instrumentation.remove_listener(self)
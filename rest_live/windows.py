@@ -0,0 +1,158 @@
+"""
+Windowed list subscriptions, which only follow the first `limit` instances of a queryset in some ordering.
+
+A window keeps the sort keys of the instances in it, and of a few instances after it: the boundary. Changes
+are placed by comparing their sort keys in Python, so the window only needs to be queried again when so many
+instances have left it that the boundary runs out.
+
+Instances are ordered by the values of their own fields, with the primary key breaking ties. Nulls sort
+before other values in ascending order and after them in descending order, on every database. Python
+comparisons have to agree with the database's for positions to be right, so avoid ordering by text fields
+under collations which don't sort like Python does.
+"""
+import bisect
+import functools
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F
+
+
+@functools.total_ordering
+class Descending:
+    """
+    Wraps a value so that it sorts in reverse.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def parse_ordering(model, ordering: Union[str, Sequence[str]]) -> List[Tuple[str, bool]]:
+    """
+    Parse an ordering like `"-done,text"` or `["-done", "text"]` into (attname, descending) pairs, ending
+    with the primary key. Raises `ValueError` if it isn't made of concrete fields of the model.
+    """
+    if isinstance(ordering, str):
+        ordering = [name.strip() for name in ordering.split(",") if name.strip()]
+    if not isinstance(ordering, (list, tuple)):
+        raise ValueError("`ordering` must be a list of field names.")
+
+    pk_attname = model._meta.pk.attname
+    parsed = []
+    for name in ordering:
+        if not isinstance(name, str):
+            raise ValueError("`ordering` must be a list of field names.")
+        descending = name.startswith("-")
+        field_name = name[1:] if descending else name
+        try:
+            field = (
+                model._meta.pk
+                if field_name == "pk"
+                else model._meta.get_field(field_name)
+            )
+        except FieldDoesNotExist:
+            raise ValueError(f"Can't order by `{field_name}`.")
+        if not field.concrete or field.many_to_many or field.one_to_many:
+            raise ValueError(f"Can't order by `{field_name}`.")
+        parsed.append((field.attname, descending))
+        if field.attname == pk_attname:
+            # The primary key is unique, so nothing after it matters.
+            return parsed
+    parsed.append((pk_attname, False))
+    return parsed
+
+
+class Window:
+    """
+    The instances currently in a windowed subscription, in order, followed by up to `boundary_size`
+    instances after them.
+    """
+
+    def __init__(self, limit, ordering: List[Tuple[str, bool]], boundary_size):
+        self.limit = limit
+        self.ordering = ordering
+        self.capacity = limit + boundary_size
+        self.keys: List[tuple] = []
+        self.pks: List[Any] = []
+        # Whether there are no instances in the queryset after the ones in `pks`.
+        self.exhausted = False
+
+    @property
+    def attnames(self) -> List[str]:
+        return [attname for attname, _ in self.ordering]
+
+    def order_by(self):
+        return [
+            F(attname).desc(nulls_last=True)
+            if descending
+            else F(attname).asc(nulls_first=True)
+            for attname, descending in self.ordering
+        ]
+
+    def sort_key(self, values: Dict[str, Any]) -> tuple:
+        key = []
+        for attname, descending in self.ordering:
+            value = values[attname]
+            value = (value is not None, value)
+            key.append(Descending(value) if descending else value)
+        return tuple(key)
+
+    def instance_key(self, instance) -> tuple:
+        return self.sort_key(
+            {attname: getattr(instance, attname) for attname in self.attnames}
+        )
+
+    def load(self, rows: List[Tuple[tuple, Any]]):
+        """
+        Replace the contents of the window with `(sort key, pk)` rows queried in order, up to one more than
+        `capacity` of them so that it can tell whether there are any further instances.
+        """
+        self.exhausted = len(rows) <= self.capacity
+        rows = rows[: self.capacity]
+        self.keys = [key for key, _ in rows]
+        self.pks = [pk for _, pk in rows]
+
+    def visible_pks(self) -> List[Any]:
+        """
+        The primary keys of the instances in the window itself, in order.
+        """
+        return self.pks[: self.limit]
+
+    def tracks(self, pk) -> bool:
+        return pk in self.pks
+
+    def discard(self, pk):
+        if pk in self.pks:
+            index = self.pks.index(pk)
+            del self.keys[index]
+            del self.pks[index]
+
+    def insert(self, pk, key):
+        """
+        Place an instance in the window or its boundary. Instances after the last one tracked are
+        ignored unless there are no instances after it.
+        """
+        if not self.exhausted and (not self.keys or key > self.keys[-1]):
+            return
+        index = bisect.bisect(self.keys, key)
+        self.keys.insert(index, key)
+        self.pks.insert(index, pk)
+        if len(self.pks) > self.capacity:
+            self.keys.pop()
+            self.pks.pop()
+            self.exhausted = False
+
+    def needs_refill(self) -> bool:
+        """
+        Whether the boundary has run out, so that the window can no longer tell which instances are in it.
+        """
+        return not self.exhausted and len(self.pks) < self.limit
@@ -49,7 +49,17 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": "db.sqlite3",
-    }
+    },
+    # Replicas for testing broadcast read routing: one always up to date, one never replicated to.
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "db.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    },
+    "stale_replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "stale_replica.sqlite3",
+    },
 }
 
 # Internationalization
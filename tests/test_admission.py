@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED
+from rest_live.admission import AdmissionController, AdmissionTimeout, SnapshotCache
+from rest_live.consumers import SubscriptionConsumer
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """
+    Tests for limiting concurrent subscribe requests.
+    """
+
+    @async_test
+    async def test_limit(self):
+        controller = AdmissionController(limit=1, timeout=0.05)
+        async with controller.admit(["test_app.Todo"]):
+            with self.assertRaises(AdmissionTimeout):
+                async with controller.admit(["test_app.List"]):
+                    pass
+        async with controller.admit(["test_app.List"]):
+            pass
+        stats = controller.stats()
+        self.assertEqual((2, 1, 0, 0), (stats.admitted, stats.rejected, stats.active, stats.waiting))
+
+    @async_test
+    async def test_queued(self):
+        controller = AdmissionController(limit=1, timeout=1)
+        order = []
+
+        async def request(name):
+            async with controller.admit(["test_app.Todo"]):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(request(i) for i in range(3)))
+        self.assertEqual([0, 1, 2], order)
+        self.assertEqual(0, controller.stats().rejected)
+
+    @async_test
+    async def test_model_limit(self):
+        controller = AdmissionController(model_limit=1, timeout=0.05)
+        async with controller.admit(["test_app.Todo"]):
+            async with controller.admit(["test_app.List"]):
+                pass
+            with self.assertRaises(AdmissionTimeout):
+                async with controller.admit(["test_app.List", "test_app.Todo"]):
+                    pass
+            # The slot for the other model was given back.
+            async with controller.admit(["test_app.List"]):
+                pass
+
+    @async_test
+    async def test_free_slots_after_deadline(self):
+        # Requests only time out if they have to wait, even once their deadline has passed.
+        controller = AdmissionController(limit=1, model_limit=1, timeout=0)
+        async with controller.admit(["test_app.Todo", "test_app.List"]):
+            with self.assertRaises(AdmissionTimeout):
+                async with controller.admit(["test_app.Todo"]):
+                    pass
+        self.assertEqual((1, 1), (controller.stats().admitted, controller.stats().rejected))
+
+
+class SnapshotCacheTests(SimpleTestCase):
+    """
+    Tests for sharing subscription snapshots.
+    """
+
+    def test_cached_until_invalidated(self):
+        cache = SnapshotCache(ttl=60)
+        cache.listen("test_app.Todo")
+        take = mock.Mock(side_effect=lambda: object())
+        first = cache.get_or_take("test_app.Todo", "key", take)
+        self.assertIs(first, cache.get_or_take("test_app.Todo", "key", take))
+        cache.invalidate("test_app.List")
+        self.assertIs(first, cache.get_or_take("test_app.Todo", "key", take))
+        cache.invalidate("test_app.Todo")
+        self.assertIsNot(first, cache.get_or_take("test_app.Todo", "key", take))
+        self.assertEqual(2, take.call_count)
+
+    def test_only_cached_while_listening(self):
+        cache = SnapshotCache(ttl=60)
+        take = mock.Mock(side_effect=lambda: object())
+        cache.get_or_take("test_app.Todo", "key", take)
+        cache.get_or_take("test_app.Todo", "key", take)
+        self.assertEqual(2, take.call_count)
+
+        cache.listen("test_app.Todo")
+        cache.listen("test_app.Todo")
+        first = cache.get_or_take("test_app.Todo", "key", take)
+        cache.unlisten("test_app.Todo")
+        self.assertIs(first, cache.get_or_take("test_app.Todo", "key", take))
+        # Once nothing is subscribed, events for the model no longer reach the process.
+        cache.unlisten("test_app.Todo")
+        self.assertEqual({}, cache.entries)
+        self.assertIsNot(first, cache.get_or_take("test_app.Todo", "key", take))
+
+    def test_expiry(self):
+        cache = SnapshotCache(ttl=0.05)
+        cache.listen("test_app.Todo")
+        take = mock.Mock(side_effect=lambda: object())
+        first = cache.get_or_take("test_app.Todo", "key", take)
+        time.sleep(0.06)
+        self.assertIsNot(first, cache.get_or_take("test_app.Todo", "key", take))
+
+    def test_single_flight(self):
+        cache = SnapshotCache(ttl=60)
+        cache.listen("test_app.Todo")
+        calls = []
+
+        def take():
+            calls.append(None)
+            time.sleep(0.05)
+            return "snapshot"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_take("test_app.Todo", "key", take)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["snapshot"] * 4, results)
+        self.assertEqual(1, len(calls))
+
+
+class AdmissionBroadcastTests(RestLiveTestCase):
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.clients = [make_client(router.as_consumer(), "/ws/subscribe/") for _ in range(3)]
+        for client in self.clients:
+            self.assertTrue((await client.connect())[0])
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.disconnect()
+
+    @async_test
+    @override_settings(REST_LIVE={"SNAPSHOT_CACHE_TTL": 60})
+    async def test_shared_snapshot(self):
+        with mock.patch.object(
+            SubscriptionConsumer, "snapshot", autospec=True, side_effect=SubscriptionConsumer.snapshot
+        ) as snapshot:
+            # Snapshots are only cached once the process is subscribed to the model.
+            requests = [await self.subscribe_to_list(client) for client in self.clients]
+            self.assertEqual(2, snapshot.call_count)
+
+            todo = await self.make_todo()
+            for request_id, client in zip(requests, self.clients):
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, request_id, client)
+
+            # The save made the cached snapshot stale.
+            await self.subscribe_to_list(self.clients[0])
+            self.assertEqual(3, snapshot.call_count)
+
+    @async_test
+    @override_settings(REST_LIVE={"SUBSCRIBE_CONCURRENCY": 1})
+    async def test_decoded_once(self):
+        with mock.patch.object(
+            SubscriptionConsumer, "decode_json", side_effect=SubscriptionConsumer.decode_json
+        ) as decode_json:
+            request_id = await self.subscribe_to_list(self.clients[0])
+        self.assertEqual(1, decode_json.call_count)
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, request_id, self.clients[0])
+
+    @async_test
+    @override_settings(REST_LIVE={"SUBSCRIBE_CONCURRENCY": 1, "SUBSCRIBE_QUEUE_TIMEOUT": 0.05})
+    async def test_rejected_when_busy(self):
+        snapshot = SubscriptionConsumer.snapshot
+
+        def slow_snapshot(consumer, view):
+            time.sleep(0.3)
+            return snapshot(consumer, view)
+
+        with mock.patch.object(SubscriptionConsumer, "snapshot", autospec=True, side_effect=slow_snapshot):
+            first = await self.subscribe("test_app.Todo", "list", client=self.clients[0])
+            await asyncio.sleep(0.05)
+            second = await self.subscribe("test_app.Todo", "list", client=self.clients[1])
+            error = await self.clients[1].receive_json_from()
+            self.assertEqual((second, 503), (error["id"], error["code"]))
+            # Wait for the first subscription to finish.
+            self.assertTrue(await self.clients[0].receive_nothing(timeout=0.5))
+
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, first, self.clients[0])
+        self.assertTrue(await self.clients[1].receive_nothing())
@@ -0,0 +1,83 @@
+import time
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED, UPDATED, signals
+from rest_live.cache import MISSING, SerializerCache, get_serializer_cache
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class SerializerCacheTests(SimpleTestCase):
+    """
+    Tests for eviction from the serializer cache.
+    """
+
+    def test_lru(self):
+        cache = SerializerCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.set("c", 3)
+        self.assertIs(MISSING, cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual((2, 3, 1), tuple(vars(cache.stats()).values()))
+
+    def test_ttl(self):
+        cache = SerializerCache(ttl=0.05)
+        cache.set("a", 1)
+        self.assertEqual(1, cache.get("a"))
+        time.sleep(0.06)
+        self.assertIs(MISSING, cache.get("a"))
+        self.assertEqual(0, cache.stats().entries)
+
+
+@override_settings(REST_LIVE={"SERIALIZER_CACHE_SIZE": 100})
+class SerializerCacheBroadcastTests(RestLiveTestCase):
+    """
+    Tests for sharing serialized instances between subscriptions.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.clients = [make_client(router.as_consumer(), "/ws/subscribe/") for _ in range(3)]
+        for client in self.clients:
+            self.assertTrue((await client.connect())[0])
+        # The text changes on every save in these tests, so it can stand in for a version field.
+        self.version_fields = mock.patch.dict(signals.version_fields, {"test_app.Todo": "text"})
+        self.version_fields.start()
+
+    async def asyncTearDown(self):
+        self.version_fields.stop()
+        for client in self.clients:
+            await client.disconnect()
+
+    @async_test
+    async def test_shared_between_subscriptions(self):
+        requests = [await self.subscribe_to_list(client) for client in self.clients[:2]]
+        search = await self.subscribe_to_list(self.clients[2], params={"search": "test"})
+        cache = get_serializer_cache()
+        cache.clear()
+        before = cache.stats()
+
+        todo = await self.make_todo("test one")
+        for req, client in zip(requests + [search], self.clients):
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req, client)
+        # Filters don't change how an instance is serialized, so the search subscription shares it too.
+        stats = cache.stats()
+        self.assertEqual(2, stats.hits - before.hits)
+        self.assertEqual(1, stats.misses - before.misses)
+
+        todo.text = "test two"
+        await db(todo.save)()
+        for req, client in zip(requests + [search], self.clients):
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, req, client)
+        self.assertEqual(2, cache.stats().entries)
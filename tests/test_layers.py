@@ -0,0 +1,354 @@
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async as db
+from channels.exceptions import ChannelFull
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED, UPDATED
+from rest_live.layers import InMemoryChannelLayer, UnixSocketChannelLayer
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class InMemoryChannelLayerTests(SimpleTestCase):
+    """
+    Tests for the indexed in-process channel layer.
+    """
+
+    def setUp(self):
+        self.layer = InMemoryChannelLayer(capacity=3)
+
+    @async_test
+    async def test_send_receive(self):
+        await self.layer.send("test-channel", {"type": "test.message", "n": 1})
+        self.assertEqual(
+            {"type": "test.message", "n": 1}, await self.layer.receive("test-channel")
+        )
+        self.assertEqual({}, self.layer.channels)
+
+    @async_test
+    async def test_receive_waits_for_send(self):
+        receive = asyncio.ensure_future(self.layer.receive("test-channel"))
+        await asyncio.sleep(0)
+        self.assertFalse(receive.done())
+        await self.layer.send("test-channel", {"type": "test.message"})
+        self.assertEqual({"type": "test.message"}, await receive)
+
+    @async_test
+    async def test_send_from_other_threads(self):
+        self.layer = InMemoryChannelLayer()
+
+        def send(n):
+            async_to_sync(self.layer.send)("test-channel", {"type": "test.message", "n": n})
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in range(20)]
+        received = []
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            message = await asyncio.wait_for(self.layer.receive("test-channel"), 1)
+            received.append(message["n"])
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(range(20)), sorted(received))
+
+    @async_test
+    async def test_cancelled_receive(self):
+        receive = asyncio.ensure_future(self.layer.receive("test-channel"))
+        await asyncio.sleep(0)
+        receive.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await receive
+        self.assertEqual({}, self.layer.channels)
+
+        await self.layer.send("test-channel", {"type": "test.message"})
+        self.assertEqual({"type": "test.message"}, await self.layer.receive("test-channel"))
+
+    @async_test
+    async def test_capacity(self):
+        for i in range(3):
+            await self.layer.send("test-channel", {"type": "test.message"})
+        with self.assertRaises(ChannelFull):
+            await self.layer.send("test-channel", {"type": "test.message"})
+        self.assertEqual(
+            {"test-channel": (3, 3)}, self.layer.stats()["channels"]
+        )
+
+    @async_test
+    async def test_channel_capacity(self):
+        layer = InMemoryChannelLayer(capacity=3, channel_capacity={"small*": 1})
+        await layer.send("small-channel", {"type": "test.message"})
+        with self.assertRaises(ChannelFull):
+            await layer.send("small-channel", {"type": "test.message"})
+
+    @async_test
+    async def test_groups(self):
+        await self.layer.group_add("test-group", "channel-1")
+        await self.layer.group_add("test-group", "channel-2")
+        await self.layer.group_add("other-group", "channel-2")
+        await self.layer.group_send("test-group", {"type": "test.message"})
+        self.assertEqual({"type": "test.message"}, await self.layer.receive("channel-1"))
+        self.assertEqual({"type": "test.message"}, await self.layer.receive("channel-2"))
+
+        await self.layer.group_discard("test-group", "channel-2")
+        self.assertEqual({"channel-1"}, set(self.layer.groups["test-group"]))
+        self.assertEqual({"other-group"}, self.layer.channel_groups["channel-2"])
+
+        await self.layer.group_discard("test-group", "channel-1")
+        self.assertNotIn("test-group", self.layer.groups)
+
+    @async_test
+    async def test_group_send_skips_full_channels(self):
+        await self.layer.group_add("test-group", "channel-1")
+        await self.layer.group_add("test-group", "channel-2")
+        for i in range(3):
+            await self.layer.send("channel-1", {"type": "test.message"})
+        await self.layer.group_send("test-group", {"type": "group.message"})
+        self.assertEqual(1, self.layer.stats()["dropped"])
+        self.assertEqual({"type": "group.message"}, await self.layer.receive("channel-2"))
+
+    @async_test
+    async def test_group_send_isolates_messages(self):
+        await self.layer.group_add("test-group", "channel-1")
+        await self.layer.group_add("test-group", "channel-2")
+        message = {"type": "test.message", "values": [1]}
+        await self.layer.group_send("test-group", message)
+        message["values"].append(2)
+        first = await self.layer.receive("channel-1")
+        first["type"] = "changed"
+        first["values"].append(3)
+        self.assertEqual(
+            {"type": "test.message", "values": [1]},
+            await self.layer.receive("channel-2"),
+        )
+
+    @async_test
+    async def test_message_expiry_leaves_groups(self):
+        layer = InMemoryChannelLayer(expiry=10)
+        await layer.group_add("test-group", "channel-1")
+        await layer.send("channel-1", {"type": "test.message"})
+
+        now = time.monotonic()
+        with mock.patch("rest_live.layers.time.monotonic", return_value=now + 11):
+            await layer.group_send("test-group", {"type": "test.message"})
+        self.assertEqual(1, layer.stats()["expired"])
+        self.assertEqual(0, layer.stats()["messages"])
+        self.assertEqual({}, layer.groups)
+
+    @async_test
+    async def test_group_expiry(self):
+        layer = InMemoryChannelLayer(group_expiry=10)
+        now = time.monotonic()
+        await layer.group_add("test-group", "channel-1")
+        with mock.patch("rest_live.layers.time.monotonic", return_value=now + 5):
+            await layer.group_add("test-group", "channel-2")
+        with mock.patch("rest_live.layers.time.monotonic", return_value=now + 11):
+            await layer.group_send("test-group", {"type": "test.message"})
+        self.assertEqual({"channel-2"}, set(layer.groups["test-group"]))
+
+    @async_test
+    async def test_flush(self):
+        await self.layer.group_add("test-group", "channel-1")
+        await self.layer.send("channel-1", {"type": "test.message"})
+        await self.layer.flush()
+        self.assertEqual({}, self.layer.groups)
+        self.assertEqual(0, self.layer.stats()["messages"])
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "rest_live.layers.InMemoryChannelLayer"}}
+)
+class InMemoryChannelLayerBroadcastTests(RestLiveTestCase):
+    """
+    Broadcasts end-to-end with `rest_live.layers.InMemoryChannelLayer` as the channel layer.
+    """
+
+    async def asyncSetUp(self):
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        connected, _ = await self.client.connect()
+        self.assertTrue(connected)
+        self.list = await db(List.objects.create)(name="test list")
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    @async_test
+    async def test_list(self):
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        await self.unsubscribe(req)
+        await db(todo.save)()
+        self.assertTrue(await self.client.receive_nothing())
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    """
+    Tests for the same-host multi-process channel layer. Separate layer instances sharing a socket
+    directory behave like separate processes.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.layer1 = UnixSocketChannelLayer(path=self.path)
+        self.layer2 = UnixSocketChannelLayer(path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    async def asyncTearDown(self):
+        await self.layer1.close()
+        await self.layer2.close()
+
+    @async_test
+    async def test_group_send_across_processes(self):
+        channel1 = await self.layer1.new_channel()
+        channel2 = await self.layer2.new_channel()
+        await self.layer1.group_add("test-group", channel1)
+        await self.layer2.group_add("test-group", channel2)
+        # Membership is only stored by the process that owns the channel.
+        self.assertEqual({channel2}, set(self.layer2.groups["test-group"]))
+
+        await self.layer1.group_send("test-group", {"type": "test.message", "b": b"x"})
+        self.assertEqual(
+            {"type": "test.message", "b": b"x"}, await self.layer1.receive(channel1)
+        )
+        self.assertEqual(
+            {"type": "test.message", "b": b"x"},
+            await asyncio.wait_for(self.layer2.receive(channel2), 1),
+        )
+
+    @async_test
+    async def test_send_to_specific_channel(self):
+        channel2 = await self.layer2.new_channel()
+        await self.layer1.send(channel2, {"type": "test.message"})
+        self.assertEqual(
+            {"type": "test.message"},
+            await asyncio.wait_for(self.layer2.receive(channel2), 1),
+        )
+
+    @async_test
+    async def test_remote_group_add(self):
+        channel2 = await self.layer2.new_channel()
+        await self.layer1.group_add("test-group", channel2)
+        await self.layer1.group_send("test-group", {"type": "test.message"})
+        self.assertEqual(
+            {"type": "test.message"},
+            await asyncio.wait_for(self.layer2.receive(channel2), 1),
+        )
+
+        await self.layer1.group_discard("test-group", channel2)
+        await self.layer1.group_send("test-group", {"type": "test.message"})
+        await asyncio.sleep(0.05)
+        self.assertNotIn("test-group", self.layer2.groups)
+        self.assertEqual(0, self.layer2.stats()["messages"])
+
+    @async_test
+    async def test_group_send_only_to_members(self):
+        await self.layer1.new_channel()
+        channel2 = await self.layer2.new_channel()
+        await self.layer2.group_add("test-group", channel2)
+        # Until the processes have heard from each other, group messages go everywhere.
+        await self.layer1.group_send("other-group", {"type": "test.message"})
+        await asyncio.sleep(0.05)
+        self.assertEqual({"test-group"}, self.layer1._peer_groups[self.layer2.process_id])
+
+        with mock.patch.object(
+            self.layer1, "_send_to_peer", wraps=self.layer1._send_to_peer
+        ) as send_to_peer:
+            await self.layer1.group_send("other-group", {"type": "test.message"})
+            send_to_peer.assert_not_called()
+            await self.layer1.group_send("test-group", {"type": "test.message"})
+            send_to_peer.assert_called_once()
+        self.assertEqual(
+            {"type": "test.message"},
+            await asyncio.wait_for(self.layer2.receive(channel2), 1),
+        )
+
+        # Processes tell each other when a group loses its last member.
+        await self.layer2.group_discard("test-group", channel2)
+        await asyncio.sleep(0.05)
+        self.assertEqual(set(), self.layer1._peer_groups[self.layer2.process_id])
+
+    @async_test
+    async def test_connections_shared_between_loops(self):
+        channel2 = await self.layer2.new_channel()
+        await self.layer2.group_add("test-group", channel2)
+
+        def send(n):
+            # Each call runs on a new event loop.
+            async_to_sync(self.layer1.group_send)("test-group", {"type": "test.message", "n": n})
+
+        for n in range(3):
+            await asyncio.get_running_loop().run_in_executor(None, send, n)
+        for n in range(3):
+            message = await asyncio.wait_for(self.layer2.receive(channel2), 1)
+            self.assertEqual(n, message["n"])
+        self.assertEqual([self.layer2.process_id], list(self.layer1._writers))
+
+    @async_test
+    async def test_stale_socket_removed(self):
+        await self.layer1.new_channel()
+        stale = os.path.join(self.path, "1-stale.sock")
+        sock = socket.socket(socket.AF_UNIX)
+        sock.bind(stale)
+        sock.close()
+
+        self.layer1.peer_refresh = 0
+        await self.layer1.group_send("test-group", {"type": "test.message"})
+        self.assertFalse(os.path.exists(stale))
+
+    @async_test
+    async def test_separate_process(self):
+        channel = await self.layer1.new_channel()
+        await self.layer1.group_add("test-group", channel)
+        script = (
+            "import asyncio\n"
+            "from rest_live.layers import UnixSocketChannelLayer\n"
+            f"layer = UnixSocketChannelLayer(path={self.path!r})\n"
+            "async def main():\n"
+            "    await layer.group_send('test-group', {'type': 'test.message'})\n"
+            "    await layer.close()\n"
+            "asyncio.run(main())\n"
+        )
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-c",
+            script,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.assertEqual(0, await process.wait())
+        self.assertEqual(
+            {"type": "test.message"},
+            await asyncio.wait_for(self.layer1.receive(channel), 1),
+        )
+
+
+@override_settings(
+    CHANNEL_LAYERS={
+        "default": {
+            "BACKEND": "rest_live.layers.UnixSocketChannelLayer",
+            "CONFIG": {"path": os.path.join(tempfile.gettempdir(), "rest-live-tests")},
+        }
+    }
+)
+class UnixSocketChannelLayerBroadcastTests(InMemoryChannelLayerBroadcastTests):
+    """
+    Broadcasts end-to-end with `rest_live.layers.UnixSocketChannelLayer` as the channel layer.
+    """
@@ -1,18 +1,26 @@
+import asyncio
 import os
+import threading
+from unittest import mock
 
 from channels.auth import AuthMiddlewareStack
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldError
+from django.test import override_settings
+from rest_framework import serializers
 from rest_framework.generics import GenericAPIView
 from rest_framework.views import APIView
 
 from rest_live.mixins import RealtimeMixin
-from rest_live.testing import APICommunicator
 from channels.db import database_sync_to_async as db
-from channels import __version__ as channels_version
 
-from rest_live import CREATED, UPDATED, DELETED
+from rest_live import CREATED, UPDATED, DELETED, get_group_name, signals
+from rest_live.consumers import SubscriptionConsumer
+from rest_live.hub import get_hub
+from rest_live.shared import SharedState, shared_states
 from rest_live.routers import RealtimeRouter
-from rest_live.testing import async_test, get_headers_for_user
+from rest_live.testing import BroadcastRecorder, async_test, get_headers_for_user
 
 from test_app.models import List, Todo
 from test_app.serializers import AuthedTodoSerializer, TodoSerializer
@@ -25,18 +33,11 @@ from test_app.views import (
     AnnotatedTodoViewSet,
     LookupTodoViewSet,
 )
-from tests.utils import RestLiveTestCase
+from tests.utils import RestLiveTestCase, make_client
 
 User = get_user_model()
 
 
-def make_client(consumer, path, middleware=lambda x: x, headers=None):
-    if channels_version.startswith("2"):
-        return APICommunicator(middleware(consumer), path, headers)
-    else:
-        return APICommunicator(middleware(consumer.as_asgi()), path, headers)
-
-
 class BasicResourceTests(RestLiveTestCase):
     """
     Basic subscription tests on single resources, retrieving by the lookup_field
@@ -680,3 +681,1102 @@ class APIErrorTests(RestLiveTestCase):
             {"type": "subscribe", "id": 1337, "model": "blah.Model", "value": 1}
         )
         await self.assertReceiveError(1337, 404)
+
+
+class BroadcastBudgetTests(RestLiveTestCase):
+    """
+    Query and serialization budgets for broadcasts from the views in `test_app`. If one of
+    these fails, a change has made broadcasts more expensive (for example, an N+1 query in a serializer).
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.user = await db(User.objects.create_user)("test")
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    async def connect(self, view, authenticated=False):
+        router = RealtimeRouter()
+        router.register(view)
+        headers = await get_headers_for_user(self.user) if authenticated else None
+        self.client = make_client(
+            router.as_consumer(), "/ws/subscribe/", AuthMiddlewareStack, headers
+        )
+        connected, _ = await self.client.connect()
+        self.assertTrue(connected)
+
+    @async_test
+    async def test_list_create_update_delete(self):
+        await self.connect(TodoViewSet)
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(
+            TodoViewSet, max_queries=1, max_serialization_time=0.05
+        ):
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+            todo.done = True
+            await db(todo.save)()
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        with self.assert_broadcast_queries(TodoViewSet, max_queries=0):
+            pk = todo.pk
+            await db(todo.delete)()
+            todo.id = pk
+            await self.assertReceivedBroadcastForTodo(todo, DELETED, req)
+
+    @async_test
+    async def test_retrieve(self):
+        await self.connect(TodoViewSet)
+        self.todo = await self.make_todo()
+        req = await self.subscribe_to_todo()
+        with self.assert_broadcast_queries(TodoViewSet, max_queries=1):
+            await db(self.todo.save)()
+            await self.assertReceivedBroadcastForTodo(self.todo, UPDATED, req)
+
+    @async_test
+    async def test_leaving_queryset(self):
+        await self.connect(FilteredViewSet)
+        todo = await self.make_todo("special")
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(FilteredViewSet, max_queries=2):
+            todo.text = "not special"
+            await db(todo.save)()
+            await self.assertReceivedBroadcastForTodo(todo, DELETED, req)
+
+    @async_test
+    async def test_annotated(self):
+        await self.connect(AnnotatedTodoViewSet)
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(AnnotatedTodoViewSet, max_queries=1):
+            await self.make_todo()
+            response = await self.client.receive_json_from()
+            self.assertEqual(req, response["id"])
+
+    @async_test
+    async def test_lookup_field(self):
+        await self.connect(LookupTodoViewSet)
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(LookupTodoViewSet, max_queries=1):
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(
+                todo, CREATED, req, lookup_field="text"
+            )
+
+    @async_test
+    async def test_kwargs(self):
+        await self.connect(KwargViewSet)
+        req = await self.subscribe_to_list(kwargs={"password": "opensesame"})
+        with self.assert_broadcast_queries(KwargViewSet, max_queries=1):
+            await self.make_todo()
+            response = await self.client.receive_json_from()
+            self.assertEqual(req, response["id"])
+
+    @async_test
+    async def test_authenticated(self):
+        await self.connect(AuthedTodoViewSet, authenticated=True)
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(AuthedTodoViewSet, max_queries=1):
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+    @async_test
+    async def test_conditional_serializer(self):
+        await self.connect(ConditionalTodoViewSet, authenticated=True)
+        req = await self.subscribe_to_list()
+        with self.assert_broadcast_queries(ConditionalTodoViewSet, max_queries=1):
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(
+                todo, CREATED, req, serializer=AuthedTodoSerializer
+            )
+
+    @async_test
+    async def test_budget_exceeded(self):
+        await self.connect(FilteredViewSet)
+        todo = await self.make_todo("special")
+        req = await self.subscribe_to_list()
+        with self.assertRaises(AssertionError):
+            with self.assert_broadcast_queries(FilteredViewSet, max_queries=1):
+                todo.text = "not special"
+                await db(todo.save)()
+                await self.assertReceivedBroadcastForTodo(todo, DELETED, req)
+
+
+class FanoutHubTests(RestLiveTestCase):
+    """
+    Tests for joining model groups once per process through the fan-out hub.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter(fanout_hub=True)
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.client2 = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+        self.assertTrue((await self.client2.connect())[0])
+        self.layer = get_channel_layer()
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+        await self.client2.disconnect()
+
+    def group_members(self):
+        return self.layer.groups.get(get_group_name("test_app.Todo"), {})
+
+    @async_test
+    async def test_one_group_member_per_process(self):
+        req1 = await self.subscribe_to_list(self.client)
+        req2 = await self.subscribe_to_list(self.client2)
+        await self.subscribe_to_list(self.client2)
+        self.assertEqual(1, len(self.group_members()))
+
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req1, self.client)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2, self.client2)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2 + 1, self.client2)
+        self.assertTrue(await self.client.receive_nothing())
+
+    @async_test
+    async def test_unsubscribe(self):
+        req1 = await self.subscribe_to_list(self.client)
+        req2 = await self.subscribe_to_list(self.client2)
+        await self.unsubscribe(req1, self.client)
+
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2, self.client2)
+        self.assertTrue(await self.client.receive_nothing())
+
+        await self.unsubscribe(req2, self.client2)
+        self.assertEqual({}, self.group_members())
+
+    @async_test
+    async def test_disconnect(self):
+        await self.subscribe_to_list(self.client)
+        req2 = await self.subscribe_to_list(self.client2)
+        await self.client.disconnect()
+
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2, self.client2)
+
+        await self.client2.disconnect()
+        self.assertEqual({}, self.group_members())
+
+    @async_test
+    async def test_direct_messages_still_received(self):
+        # Messages sent straight to a consumer's channel bypass the hub.
+        req = await self.subscribe_to_list(self.client)
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+        hub_channel = get_hub(self.layer).channel_name
+        for channel in [c for c in self.layer.channels if c != hub_channel]:
+            await self.layer.send(
+                channel,
+                {
+                    "type": "model.saved",
+                    "model": "test_app.Todo",
+                    "instance_pk": todo.pk,
+                    "channel_name": get_group_name("test_app.Todo"),
+                },
+            )
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        self.assertTrue(await self.client2.receive_nothing())
+
+
+@override_settings(REST_LIVE={"GROUP_SHARDS": 4})
+class GroupShardTests(RestLiveTestCase):
+    """
+    Tests for splitting model groups into several groups on the channel layer.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.layer = get_channel_layer()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.disconnect()
+
+    async def connect(self, count, fanout_hub=False):
+        router = RealtimeRouter(fanout_hub=fanout_hub)
+        router.register(TodoViewSet)
+        for i in range(count):
+            client = make_client(router.as_consumer(), "/ws/subscribe/")
+            self.assertTrue((await client.connect())[0])
+            self.clients.append(client)
+
+    def shard_members(self):
+        group_name = get_group_name("test_app.Todo")
+        return {
+            name: set(members)
+            for name, members in self.layer.groups.items()
+            if name.startswith(group_name)
+        }
+
+    @async_test
+    async def test_broadcast_reaches_all_shards(self):
+        await self.connect(8)
+        requests = [await self.subscribe_to_list(client) for client in self.clients]
+        shards = self.shard_members()
+        self.assertNotIn(get_group_name("test_app.Todo"), shards)
+        self.assertEqual(8, sum(len(members) for members in shards.values()))
+
+        todo = await self.make_todo()
+        for req, client in zip(requests, self.clients):
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req, client)
+            self.assertTrue(await client.receive_nothing())
+
+    @async_test
+    async def test_unsubscribe_leaves_shard(self):
+        await self.connect(2)
+        requests = [await self.subscribe_to_list(client) for client in self.clients]
+        for req, client in zip(requests, self.clients):
+            await self.unsubscribe(req, client)
+        self.assertEqual({}, self.shard_members())
+
+    @async_test
+    async def test_fanout_hub(self):
+        await self.connect(2, fanout_hub=True)
+        requests = [await self.subscribe_to_list(client) for client in self.clients]
+        self.assertEqual(1, sum(len(members) for members in self.shard_members().values()))
+
+        todo = await self.make_todo()
+        for req, client in zip(requests, self.clients):
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req, client)
+
+
+class BatchWindowTests(RestLiveTestCase):
+    """
+    Tests for evaluating model events that arrive close together as a batch.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    async def connect(self, fanout_hub=False):
+        router = RealtimeRouter(fanout_hub=fanout_hub, batch_window=0.2)
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    def make_todos(self, count):
+        return [Todo.objects.create(list=self.list, text=f"todo {i}") for i in range(count)]
+
+    async def check_batch(self):
+        req = await self.subscribe_to_list()
+        with BroadcastRecorder(TodoViewSet) as recorder:
+            todos = await db(self.make_todos)(3)
+            for todo in todos:
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+            self.assertTrue(await self.client.receive_nothing())
+
+        self.assertEqual(1, len(recorder.traces))
+        self.assertEqual("model.batch", recorder.traces[0].event_type)
+        self.assertEqual(1, recorder.traces[0].query_count)
+
+    @async_test
+    async def test_batch_uses_one_query(self):
+        await self.connect()
+        await self.check_batch()
+
+    @async_test
+    async def test_batch_with_fanout_hub(self):
+        await self.connect(fanout_hub=True)
+        await self.check_batch()
+
+    @async_test
+    async def test_deduplicates_by_latest_event(self):
+        await self.connect()
+        req = await self.subscribe_to_list()
+
+        def create_and_update():
+            todo = Todo.objects.create(list=self.list, text="first")
+            todo.text = "second"
+            todo.save()
+            return todo
+
+        todo = await db(create_and_update)()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        self.assertTrue(await self.client.receive_nothing())
+
+        def update_and_delete():
+            todo.text = "third"
+            todo.save()
+            todo.delete()
+
+        pk = todo.pk
+        await db(update_and_delete)()
+        todo.pk = pk
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req)
+        self.assertTrue(await self.client.receive_nothing())
+
+    @async_test
+    async def test_created_and_deleted_in_window(self):
+        await self.connect()
+        await self.subscribe_to_list()
+
+        def create_and_delete():
+            Todo.objects.create(list=self.list, text="short lived").delete()
+
+        await db(create_and_delete)()
+        self.assertTrue(await self.client.receive_nothing())
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "rest_live.layers.InMemoryChannelLayer"}}
+)
+class MinIntervalTests(RestLiveTestCase):
+    """
+    Tests for rate-limiting save events per instance with `live_min_interval`.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+        self.intervals = mock.patch.dict(
+            signals.min_intervals, {"test_app.Todo": 0.3}
+        )
+        self.intervals.start()
+
+    async def asyncTearDown(self):
+        self.intervals.stop()
+        await self.client.disconnect()
+
+    def save_todo(self, todo, *texts):
+        for text in texts:
+            todo.text = text
+            todo.save()
+
+    @async_test
+    async def test_trailing_event(self):
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+        await db(self.save_todo)(todo, "one", "two", "three")
+        self.assertTrue(await self.client.receive_nothing())
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        self.assertTrue(await self.client.receive_nothing(timeout=0.5))
+
+    @async_test
+    async def test_server_loop(self):
+        # Consumers register the loop that trailing events are sent on from the coalescer's thread.
+        self.assertIs(asyncio.get_running_loop(), await db(signals.server_loop)())
+
+    @async_test
+    async def test_delete_bypasses_limit(self):
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+        pk = todo.pk
+        await db(self.save_todo)(todo, "one")
+        await db(todo.delete)()
+        todo.pk = pk
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req)
+        self.assertTrue(await self.client.receive_nothing(timeout=0.5))
+
+    @async_test
+    async def test_one_thread_for_many_instances(self):
+        req = await self.subscribe_to_list()
+        todos = [await self.make_todo(str(i)) for i in range(5)]
+        for todo in todos:
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+        threads = threading.active_count()
+        for todo in todos:
+            await db(self.save_todo)(todo, "updated")
+        self.assertLessEqual(threading.active_count(), threads + 1)
+        for todo in todos:
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+
+    @async_test
+    async def test_flush(self):
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+        await db(self.save_todo)(todo, "one")
+        # Pending events are sent by flush rather than when they're due, and only once.
+        await db(signals.coalescer.flush)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        self.assertTrue(await self.client.receive_nothing(timeout=0.5))
+
+    @async_test
+    async def test_register_sets_interval(self):
+        class ThrottledTodoViewSet(TodoViewSet):
+            live_min_interval = 2
+
+        with mock.patch.dict(signals.min_intervals):
+            RealtimeRouter(uid="throttled").register(ThrottledTodoViewSet)
+            self.assertEqual(2, signals.min_intervals["test_app.Todo"])
+
+
+class IndexedTodoViewSet(TodoViewSet):
+    live_index_fields = ["list"]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if "list" in self.request.query_params:
+            queryset = queryset.filter(list=self.request.query_params["list"])
+        return queryset
+
+
+class DoneIndexedTodoViewSet(TodoViewSet):
+    live_index_fields = ["done"]
+
+
+class SubscriptionIndexTests(RestLiveTestCase):
+    """
+    Tests for only evaluating events for subscriptions whose filter values match, with `live_index_fields`.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.other_list = await db(List.objects.create)(name="other list")
+        self.index_fields = mock.patch.dict(signals.index_fields)
+        self.index_fields.start()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.disconnect()
+        self.index_fields.stop()
+
+    async def connect(self, fanout_hub):
+        router = RealtimeRouter(uid="indexed", fanout_hub=fanout_hub)
+        router.register(IndexedTodoViewSet)
+        for _ in range(3):
+            client = make_client(router.as_consumer(), "/ws/subscribe/")
+            self.assertTrue((await client.connect())[0])
+            self.clients.append(client)
+
+    async def check_index(self):
+        client1, client2, client3 = self.clients
+        req1 = await self.subscribe_to_list(client1, params={"list": self.list.pk})
+        req2 = await self.subscribe_to_list(client2, params={"list": self.other_list.pk})
+        req3 = await self.subscribe_to_list(client3)
+
+        with BroadcastRecorder(IndexedTodoViewSet) as recorder:
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req1, client1)
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req3, client3)
+            self.assertTrue(await client2.receive_nothing())
+        self.assertEqual(2, len(recorder.traces))
+
+        todo.list = self.other_list
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req1, client1)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2, client2)
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req3, client3)
+
+        pk = todo.pk
+        await db(todo.delete)()
+        todo.pk = pk
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req2, client2)
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req3, client3)
+        for client in self.clients:
+            self.assertTrue(await client.receive_nothing())
+
+    @async_test
+    async def test_index(self):
+        await self.connect(fanout_hub=False)
+        await self.check_index()
+
+    @async_test
+    async def test_index_with_fanout_hub(self):
+        await self.connect(fanout_hub=True)
+        await self.check_index()
+
+        hub = get_hub(get_channel_layer())
+        self.assertEqual({}, hub.watchers[get_group_name("test_app.Todo")])
+        for client in self.clients:
+            await client.disconnect()
+        self.clients = []
+        self.assertEqual({}, hub.watched)
+        self.assertEqual({}, hub.subscriptions)
+
+    @async_test
+    async def test_views_indexing_different_fields(self):
+        await self.connect(fanout_hub=False)
+        RealtimeRouter(uid="indexed-done").register(DoneIndexedTodoViewSet)
+        self.assertEqual(["list_id", "done"], signals.index_fields["test_app.Todo"])
+        await self.check_index()
+
+    @async_test
+    async def test_existing_instances_are_watched(self):
+        todo = await self.make_todo()
+        await self.connect(fanout_hub=True)
+        req1 = await self.subscribe_to_list(self.clients[0], params={"list": self.list.pk})
+
+        todo.list = self.other_list
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req1, self.clients[0])
+
+
+class AllVisibleTests(RestLiveTestCase):
+    """
+    Tests for skipping membership queries for subscriptions that can see every instance.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    async def connect(self, view):
+        router = RealtimeRouter(uid="all-visible")
+        router.register(view)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    @async_test
+    async def test_instance_fetched_once(self):
+        await self.connect(TodoViewSet)
+        requests = [await self.subscribe_to_list() for _ in range(3)]
+        search = await self.subscribe_to_list(params={"search": "test"})
+
+        with BroadcastRecorder(TodoViewSet) as recorder:
+            todo = await self.make_todo()
+            for req in requests + [search]:
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        self.assertEqual(2, sum(trace.query_count for trace in recorder.traces))
+
+        todo.text = "changed"
+        await db(todo.save)()
+        for req in requests:
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, search)
+        self.assertTrue(await self.client.receive_nothing())
+
+    @async_test
+    async def test_declared_not_all_visible(self):
+        class FilteredByUserTodoViewSet(TodoViewSet):
+            live_all_visible = False
+
+        await self.connect(FilteredByUserTodoViewSet)
+        requests = [await self.subscribe_to_list() for _ in range(2)]
+
+        with BroadcastRecorder(FilteredByUserTodoViewSet) as recorder:
+            todo = await self.make_todo()
+            for req in requests:
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        self.assertEqual(2, sum(trace.query_count for trace in recorder.traces))
+
+
+class ReadDatabaseTests(RestLiveTestCase):
+    """
+    Tests for evaluating broadcasts against a read replica, falling back to the primary when it lags.
+    """
+
+    databases = {"default", "replica", "stale_replica"}
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter(uid="replica")
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    async def broadcast_aliases(self, todo, action, req):
+        with BroadcastRecorder(TodoViewSet) as recorder:
+            await db(todo.save)()
+            await self.assertReceivedBroadcastForTodo(todo, action, req)
+        return {query.alias for trace in recorder.traces for query in trace.queries}
+
+    def replicate(self, todo):
+        # Without sending signals, like replication, so that no events are sent for the replica's rows.
+        for model, pk, values in [
+            (List, self.list.pk, {"name": self.list.name}),
+            (Todo, todo.pk, {"list_id": self.list.pk, "text": todo.text}),
+        ]:
+            queryset = model.objects.using("stale_replica")
+            if not queryset.filter(pk=pk).update(**values):
+                queryset.bulk_create([model(pk=pk, **values)])
+
+    @async_test
+    async def test_reads_from_replica(self):
+        req = await self.subscribe_to_list(params={"search": "test"})
+        with override_settings(REST_LIVE={"READ_DATABASE": "replica"}):
+            todo = Todo(list=self.list, text="test")
+            aliases = await self.broadcast_aliases(todo, CREATED, req)
+        self.assertEqual({"replica"}, aliases)
+
+    @async_test
+    async def test_missing_on_replica(self):
+        req = await self.subscribe_to_list(params={"search": "test"})
+        with override_settings(REST_LIVE={"READ_DATABASE": "stale_replica"}):
+            todo = Todo(list=self.list, text="test")
+            aliases = await self.broadcast_aliases(todo, CREATED, req)
+        self.assertEqual({"stale_replica", "default"}, aliases)
+
+    @async_test
+    async def test_update_without_version(self):
+        # Without a commit marker, there's no telling whether the replica has the update.
+        todo = await self.make_todo("test one")
+        req = await self.subscribe_to_list(params={"search": "test"})
+        with override_settings(REST_LIVE={"READ_DATABASE": "replica"}):
+            todo.text = "test two"
+            aliases = await self.broadcast_aliases(todo, UPDATED, req)
+        self.assertEqual({"default"}, aliases)
+
+    @async_test
+    async def test_old_version_on_replica(self):
+        todo = await self.make_todo("test one")
+        await db(self.replicate)(todo)
+        req = await self.subscribe_to_list(params={"search": "test"})
+
+        with mock.patch.dict(signals.version_fields, {"test_app.Todo": "text"}):
+            with override_settings(REST_LIVE={"READ_DATABASE": "stale_replica"}):
+                todo.text = "test two"
+                aliases = await self.broadcast_aliases(todo, UPDATED, req)
+                self.assertEqual({"stale_replica", "default"}, aliases)
+
+                await db(self.replicate)(todo)
+                aliases = await self.broadcast_aliases(todo, UPDATED, req)
+                self.assertEqual({"stale_replica"}, aliases)
+
+
+class AuthedIndexedTodoViewSet(IndexedTodoViewSet):
+    serializer_class = AuthedTodoSerializer
+
+
+class MergeBroadcastsTests(RestLiveTestCase):
+    """
+    Tests for serializing a change once for overlapping subscriptions, and sending it as one frame.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.other_list = await db(List.objects.create)(name="other list")
+        self.index_fields = mock.patch.dict(signals.index_fields)
+        self.index_fields.start()
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+        self.index_fields.stop()
+
+    async def connect(self, merge_broadcasts, view=IndexedTodoViewSet):
+        router = RealtimeRouter(uid="merged", merge_broadcasts=merge_broadcasts)
+        router.register(view)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    @async_test
+    async def test_serialized_once(self):
+        await self.connect(merge_broadcasts=False)
+        req1 = await self.subscribe_to_list(params={"list": self.list.pk})
+        req2 = await self.subscribe_to_list()
+        with mock.patch.object(
+            SubscriptionConsumer, "serialize", autospec=True, side_effect=SubscriptionConsumer.serialize
+        ) as serialize:
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req1)
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req2)
+        serialize.assert_called_once()
+
+    @async_test
+    async def test_serialized_once_across_filters(self):
+        # Without a plan, data is shared by the serializer context key, which filters don't affect.
+        await self.connect(merge_broadcasts=False, view=AuthedIndexedTodoViewSet)
+        req1 = await self.subscribe_to_list(params={"list": self.list.pk})
+        req2 = await self.subscribe_to_list(params={"search": "test"})
+        with mock.patch.object(
+            SubscriptionConsumer, "serialize", autospec=True, side_effect=SubscriptionConsumer.serialize
+        ) as serialize:
+            todo = await self.make_todo("test")
+            for req in [req1, req2]:
+                await self.assertReceivedBroadcastForTodo(
+                    todo, CREATED, req, serializer=AuthedTodoSerializer
+                )
+        serialize.assert_called_once()
+
+    @async_test
+    async def test_merged_frames(self):
+        await self.connect(merge_broadcasts=True)
+        req1 = await self.subscribe_to_list(params={"list": self.list.pk})
+        req2 = await self.subscribe_to_list()
+
+        todo = await self.make_todo()
+        response = self.make_todo_sub_response(todo, CREATED, req1)
+        del response["id"]
+        response["ids"] = [req1, req2]
+        await self.assertResponseEquals(response)
+        self.assertTrue(await self.client.receive_nothing())
+
+        # Different actions for each subscription can't be merged.
+        todo.list = self.other_list
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req1)
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req2)
+        self.assertTrue(await self.client.receive_nothing())
+
+        # A subscription on its own gets a plain broadcast.
+        await self.unsubscribe(req2)
+        todo.list = self.list
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req1)
+        self.assertTrue(await self.client.receive_nothing())
+
+
+class SubscribeManyTests(RestLiveTestCase):
+    """
+    Tests for subscribing and unsubscribing in batches.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    @async_test
+    async def test_subscribe_many(self):
+        todo = await self.make_todo()
+        with mock.patch.object(
+            TodoViewSet, "from_scope", wraps=TodoViewSet.from_scope
+        ) as from_scope:
+            await self.client.send_json_to(
+                {
+                    "type": "subscribe_many",
+                    "id": 100,
+                    "subscriptions": [
+                        {"id": 1, "model": "test_app.Todo", "action": "list"},
+                        {"id": 2, "model": "test_app.Todo", "action": "list"},
+                        {"id": 3, "model": "test_app.Todo", "action": "retrieve", "lookup_by": todo.pk},
+                        {"id": 4, "model": "test_app.Todo", "action": "retrieve", "lookup_by": 0},
+                        {"id": 5, "model": "test_app.Missing", "action": "list"},
+                    ],
+                }
+            )
+            errors = [await self.client.receive_json_from() for _ in range(2)]
+            self.assertEqual({(4, 404), (5, 404)}, {(error["id"], error["code"]) for error in errors})
+            self.assertTrue(await self.client.receive_nothing())
+        # One view for the lists, and one for the retrieves.
+        self.assertEqual(2, from_scope.call_count)
+
+        todo.text = "updated"
+        await db(todo.save)()
+        for request_id in (1, 2, 3):
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, request_id)
+        self.assertTrue(await self.client.receive_nothing())
+
+        await self.client.send_json_to({"type": "unsubscribe_many", "id": 101, "ids": [1, 3, 6]})
+        error = await self.client.receive_json_from()
+        self.assertEqual((6, 404), (error["id"], error["code"]))
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, 2)
+        self.assertTrue(await self.client.receive_nothing())
+
+    @async_test
+    async def test_invalid_batches(self):
+        await self.client.send_json_to({"type": "subscribe_many", "id": 1, "subscriptions": "nope"})
+        self.assertEqual(400, (await self.client.receive_json_from())["code"])
+        await self.client.send_json_to({"type": "unsubscribe_many", "id": 2})
+        self.assertEqual(400, (await self.client.receive_json_from())["code"])
+
+    @async_test
+    async def test_resubscribe_replaces(self):
+        await self.client.send_json_to(
+            {"type": "subscribe", "id": 1, "model": "test_app.Todo", "action": "list"}
+        )
+        await self.client.send_json_to(
+            {"type": "subscribe", "id": 1, "model": "test_app.Todo", "action": "list"}
+        )
+        self.assertTrue(await self.client.receive_nothing())
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, 1)
+        self.assertTrue(await self.client.receive_nothing())
+
+        await self.unsubscribe(1)
+        self.assertTrue(await self.client.receive_nothing())
+        await self.make_todo()
+        self.assertTrue(await self.client.receive_nothing())
+
+
+class SharedTodoViewSet(IndexedTodoViewSet):
+    live_index_fields = ()
+    live_shared_state = True
+
+
+class SharedStateTests(RestLiveTestCase):
+    """
+    Tests for sharing visibility state and evaluation between identical subscriptions.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.other_list = await db(List.objects.create)(name="other list")
+        router = RealtimeRouter(uid="shared")
+        router.register(SharedTodoViewSet)
+        self.clients = [make_client(router.as_consumer(), "/ws/subscribe/") for _ in range(2)]
+        for client in self.clients:
+            self.assertTrue((await client.connect())[0])
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.disconnect()
+        self.assertEqual(0, len(shared_states))
+
+    @async_test
+    async def test_shared_state(self):
+        with mock.patch.object(
+            SubscriptionConsumer, "snapshot", autospec=True, side_effect=SubscriptionConsumer.snapshot
+        ) as snapshot:
+            requests = [
+                await self.subscribe_to_list(client, params={"list": self.list.pk})
+                for client in self.clients
+            ]
+        snapshot.assert_called_once()
+        self.assertEqual(1, len(shared_states))
+
+        with BroadcastRecorder(SharedTodoViewSet) as recorder:
+            todo = await self.make_todo()
+            # Both subscriptions see the instance for the first time.
+            for request_id, client in zip(requests, self.clients):
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, request_id, client)
+
+            todo.list = self.other_list
+            await db(todo.save)()
+            for request_id, client in zip(requests, self.clients):
+                await self.assertReceivedBroadcastForTodo(todo, DELETED, request_id, client)
+                self.assertTrue(await client.receive_nothing())
+
+        # Each event was evaluated by one of the subscriptions, and reused by the other.
+        self.assertEqual([True, False] * 2, [trace.query_count > 0 for trace in recorder.traces])
+
+        await self.clients[0].disconnect()
+        self.assertEqual(1, len(shared_states))
+        await self.unsubscribe(requests[1], self.clients[1])
+        self.assertTrue(await self.clients[1].receive_nothing())
+        self.clients = self.clients[1:]
+
+    @async_test
+    async def test_different_subscriptions_not_shared(self):
+        await self.subscribe_to_list(self.clients[0], params={"list": self.list.pk})
+        await self.subscribe_to_list(self.clients[1], params={"list": self.other_list.pk})
+        self.assertEqual(2, len(shared_states))
+
+
+def gated(consumer_class, gate):
+    """
+    Subclass a consumer so that it only handles model events once `gate` is set.
+    """
+
+    class GatedConsumer(consumer_class):
+        async def dispatch(self, message):
+            if message["type"] in ("model.saved", "model.deleted", "model.batch"):
+                await gate.wait()
+            await super().dispatch(message)
+
+    return GatedConsumer
+
+
+class SharedStateDivergenceTests(RestLiveTestCase):
+    """
+    Tests for subscriptions sharing state on connections which evaluate different sets of changes.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.gate = asyncio.Event()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        self.gate.set()
+        for client in self.clients:
+            await client.disconnect()
+        self.assertEqual(0, len(shared_states))
+
+    async def connect(self, batch_window=0, gate=False):
+        router = RealtimeRouter(uid=f"shared-{len(self.clients)}", batch_window=batch_window)
+        router.register(SharedTodoViewSet)
+        consumer = router.as_consumer()
+        if gate:
+            consumer = gated(consumer, self.gate)
+        client = make_client(consumer, "/ws/subscribe/")
+        self.assertTrue((await client.connect())[0])
+        self.clients.append(client)
+        return client, await self.subscribe_to_list(client, params={"list": self.list.pk})
+
+    def create_and_update(self):
+        todo = Todo.objects.create(list=self.list, text="created")
+        todo.text = "updated"
+        todo.save()
+        return todo
+
+    async def check_batched_and_unbatched(self, gate_batched):
+        batched, batched_req = await self.connect(batch_window=0.1, gate=gate_batched)
+        unbatched, unbatched_req = await self.connect(gate=not gate_batched)
+        self.assertEqual(1, len(shared_states))
+
+        todo = await db(self.create_and_update)()
+        first, second = (unbatched, batched) if gate_batched else (batched, unbatched)
+        self.assertFalse(await first.receive_nothing(timeout=0.3))
+        self.gate.set()
+
+        # The batched connection only sees the latest event, and the unbatched one sees both.
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, batched_req, batched)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, unbatched_req, unbatched)
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, unbatched_req, unbatched)
+        for client in self.clients:
+            self.assertTrue(await client.receive_nothing())
+
+    @async_test
+    async def test_batched_first(self):
+        await self.check_batched_and_unbatched(gate_batched=False)
+
+    @async_test
+    async def test_unbatched_first(self):
+        await self.check_batched_and_unbatched(gate_batched=True)
+
+    @async_test
+    async def test_lagging(self):
+        ahead, ahead_req = await self.connect()
+        behind, behind_req = await self.connect(gate=True)
+
+        with mock.patch.object(SharedState, "max_steps", 1):
+            todo = await self.make_todo("created")
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, ahead_req, ahead)
+            todo.text = "updated"
+            await db(todo.save)()
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, ahead_req, ahead)
+
+            # The lagging subscription was detached, and catches up by itself.
+            self.gate.set()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, behind_req, behind)
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, behind_req, behind)
+        self.assertTrue(await behind.receive_nothing())
+
+
+class ListNameTodoSerializer(TodoSerializer):
+    list_name = serializers.CharField(source="list.name", read_only=True)
+
+    class Meta(TodoSerializer.Meta):
+        fields = TodoSerializer.Meta.fields + ["list_name"]
+
+
+class DependentTodoViewSet(IndexedTodoViewSet):
+    serializer_class = ListNameTodoSerializer
+    live_depends_on = {"test_app.List": "list"}
+
+
+class DependencyTests(RestLiveTestCase):
+    """
+    Tests for re-evaluating instances when related instances they depend on are saved, with `live_depends_on`.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        self.other_list = await db(List.objects.create)(name="other list")
+        self.patches = [
+            mock.patch.dict(signals.index_fields),
+            mock.patch.dict(signals.dependencies),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.disconnect()
+        for patch in self.patches:
+            patch.stop()
+
+    async def connect(self, fanout_hub):
+        router = RealtimeRouter(uid="dependent", fanout_hub=fanout_hub)
+        router.register(DependentTodoViewSet)
+        for _ in range(2):
+            client = make_client(router.as_consumer(), "/ws/subscribe/")
+            self.assertTrue((await client.connect())[0])
+            self.clients.append(client)
+
+    async def assertReceivedUpdates(self, todos, request_id, client):
+        for todo in todos:
+            todo = await db(Todo.objects.select_related("list").get)(pk=todo.pk)
+            await self.assertReceivedBroadcastForTodo(
+                todo, UPDATED, request_id, client, ListNameTodoSerializer
+            )
+
+    async def check_dependencies(self):
+        client1, client2 = self.clients
+        todos = [await self.make_todo("one"), await self.make_todo("two")]
+        other = await db(Todo.objects.create)(list=self.other_list, text="other")
+        req1 = await self.subscribe_to_list(client1, params={"list": self.list.pk})
+        req2 = await self.subscribe_to_list(client2)
+
+        with BroadcastRecorder(DependentTodoViewSet) as recorder:
+            self.list.name = "renamed"
+            await db(self.list.save)()
+            await self.assertReceivedUpdates(todos, req1, client1)
+            await self.assertReceivedUpdates(todos, req2, client2)
+        # The dependent instances are evaluated together, once per subscription.
+        self.assertEqual(2, len(recorder.traces))
+
+        self.other_list.name = "also renamed"
+        await db(self.other_list.save)()
+        await self.assertReceivedUpdates([other], req2, client2)
+        for client in self.clients:
+            self.assertTrue(await client.receive_nothing())
+
+    @async_test
+    async def test_dependencies(self):
+        await self.connect(fanout_hub=False)
+        await self.check_dependencies()
+
+    @async_test
+    async def test_dependencies_with_fanout_hub(self):
+        await self.connect(fanout_hub=True)
+        await self.check_dependencies()
+
+    @async_test
+    @override_settings(REST_LIVE={"DEPENDENCY_BATCH_SIZE": 1})
+    async def test_batch_size(self):
+        await self.connect(fanout_hub=False)
+        todos = [await self.make_todo("one"), await self.make_todo("two")]
+        request_id = await self.subscribe_to_list(self.clients[0])
+
+        with BroadcastRecorder(DependentTodoViewSet) as recorder:
+            self.list.name = "renamed"
+            await db(self.list.save)()
+            await self.assertReceivedUpdates(todos, request_id, self.clients[0])
+        self.assertEqual(2, len(recorder.traces))
+
+    @async_test
+    @override_settings(REST_LIVE={"SERIALIZER_CACHE_SIZE": 100})
+    async def test_serializer_cache(self):
+        await self.connect(fanout_hub=False)
+        todo = await self.make_todo()
+        request_id = await self.subscribe_to_list(self.clients[0])
+
+        # The text stands in for a version field: it doesn't change when the list is renamed.
+        with mock.patch.dict(signals.version_fields, {"test_app.Todo": "text"}):
+            todo.done = True
+            await db(todo.save)()
+            await self.assertReceivedUpdates([todo], request_id, self.clients[0])
+
+            self.list.name = "renamed"
+            await db(self.list.save)()
+            await self.assertReceivedUpdates([todo], request_id, self.clients[0])
+
+    def test_invalid_lookup(self):
+        class InvalidViewSet(TodoViewSet):
+            live_depends_on = {"test_app.List": "owner"}
+
+        with self.assertRaises(FieldError):
+            InvalidViewSet.register_signal_handler("invalid")
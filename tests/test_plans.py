@@ -0,0 +1,114 @@
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase
+from rest_framework import serializers
+
+from rest_live import CREATED, plans
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List, Todo
+from test_app.serializers import AuthedTodoSerializer, KwargsTodoSerializer, TodoSerializer
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+CONTEXT = {"request": None, "format": "json", "view": None}
+
+
+class ListTodoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Todo
+        fields = ["id", "list", "done"]
+
+
+class DynamicTodoSerializer(TodoSerializer):
+    def get_fields(self):
+        fields = super().get_fields()
+        fields.pop("text")
+        return fields
+
+
+class StaffTodoSerializer(TodoSerializer):
+    def get_field_names(self, declared_fields, info):
+        names = super().get_field_names(declared_fields, info)
+        request = self.context.get("request")
+        if request is None or not request.user.is_staff:
+            names = [name for name in names if name != "text"]
+        return names
+
+
+class SourceTodoSerializer(serializers.ModelSerializer):
+    list_name = serializers.CharField(source="list.name")
+
+    class Meta:
+        model = Todo
+        fields = ["id", "list_name"]
+
+
+class SerializerPlanTests(SimpleTestCase):
+    """
+    Tests for serializing instances with precompiled field plans.
+    """
+
+    def setUp(self):
+        plans.clear_plans()
+        self.todo = Todo(pk=1, text="Buy milk", done=False, list=List(pk=3, name="groceries"))
+
+    def assertSerializesLikeSerializer(self, serializer_class):
+        plan = plans.get_plan(serializer_class)
+        self.assertIsNotNone(plan)
+        self.assertEqual(serializer_class(self.todo, context=CONTEXT).data, plan.serialize(self.todo))
+
+    def test_simple_serializers(self):
+        self.assertSerializesLikeSerializer(TodoSerializer)
+        self.assertSerializesLikeSerializer(ListTodoSerializer)
+        self.assertSerializesLikeSerializer(SourceTodoSerializer)
+
+    def test_null_relation(self):
+        self.todo.list = None
+        self.assertEqual(
+            {"id": 1, "list": None, "done": False},
+            plans.get_plan(ListTodoSerializer).serialize(self.todo),
+        )
+
+    def test_unsupported(self):
+        self.assertIsNone(plans.get_plan(KwargsTodoSerializer))
+        self.assertIsNone(plans.get_plan(AuthedTodoSerializer))
+        self.assertIsNone(plans.get_plan(DynamicTodoSerializer))
+
+    def test_context_dependent_field_names(self):
+        # Overriding any of DRF's field-building hooks may make the fields depend on the request.
+        self.assertIsNone(plans.get_plan(StaffTodoSerializer))
+
+    def test_bound_without_context(self):
+        plan = plans.get_plan(TodoSerializer)
+        self.assertIs(plan, plans.get_plan(TodoSerializer))
+        # Plans are shared by every user, so they mustn't hold on to anyone's request.
+        self.assertEqual({}, plan.fields[0].context)
+
+
+class SerializerPlanBroadcastTests(RestLiveTestCase):
+    async def asyncSetUp(self):
+        plans.clear_plans()
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    @async_test
+    async def test_broadcast_uses_plan(self):
+        with mock.patch.object(
+            plans, "build_plan", wraps=plans.build_plan
+        ) as build_plan, mock.patch.object(
+            plans.SerializerPlan, "serialize", autospec=True, side_effect=plans.SerializerPlan.serialize
+        ) as serialize:
+            request_id = await self.subscribe_to_list()
+            build_plan.assert_called_once()
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, request_id)
+        build_plan.assert_called_once()
+        serialize.assert_called_once()
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED, instrumentation, pool
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class ThreadRecorder(instrumentation.Listener):
+    def __init__(self):
+        self.threads = set()
+
+    def trace_finished(self, trace):
+        self.threads.add(threading.current_thread().name)
+
+
+@override_settings(REST_LIVE={"DB_POOL_SIZE": 2})
+class ConnectionPoolBroadcastTests(RestLiveTestCase):
+    """
+    Tests for running consumer handlers on the connection pool.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    def tearDown(self):
+        super().tearDown()
+        pool.get_pool()  # Shuts the pool down now that the setting is gone.
+
+    @async_test
+    async def test_handlers_run_on_pool(self):
+        recorder = ThreadRecorder()
+        instrumentation.add_listener(recorder)
+        try:
+            req = await self.subscribe_to_list()
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        finally:
+            instrumentation.remove_listener(recorder)
+
+        self.assertEqual(1, len(recorder.threads))
+        self.assertTrue(recorder.threads.pop().startswith("rest-live-db"))
+        stats = pool.get_pool().stats()
+        self.assertEqual(2, stats.size)
+        self.assertGreaterEqual(stats.completed, 2)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """
+    Tests for pool saturation metrics and connection health checks.
+    """
+
+    def setUp(self):
+        self.pool = pool.ConnectionPool(1, health_check_interval=0)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    @async_test
+    async def test_saturation(self):
+        await asyncio.gather(*(self.pool.run(time.sleep, 0.05) for _ in range(3)))
+        stats = self.pool.stats()
+        self.assertEqual(3, stats.completed)
+        self.assertEqual(2, stats.saturated)
+        self.assertEqual(0, stats.waiting)
+        self.assertGreater(stats.max_wait_time, 0.04)
+
+    def test_unusable_connections_are_closed(self):
+        with mock.patch.object(connection, "connection", object()), mock.patch.object(
+            connection, "is_usable", return_value=False
+        ), mock.patch.object(connection, "close") as close:
+            self.pool.check_connections()
+        close.assert_called()
+
+
+class SlowFirstSubscription(ThreadRecorder):
+    def __init__(self, request_id):
+        super().__init__()
+        self.request_id = request_id
+
+    def trace_started(self, trace):
+        if trace.request_id == self.request_id:
+            time.sleep(0.2)
+
+
+@override_settings(REST_LIVE={"EVALUATION_WORKERS": 4})
+class ParallelEvaluationTests(RestLiveTestCase):
+    """
+    Tests for evaluating a connection's subscriptions to an event in parallel.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    def tearDown(self):
+        super().tearDown()
+        pool.get_evaluation_pool()
+
+    @async_test
+    async def test_broadcasts_in_subscription_order(self):
+        requests = [
+            await self.subscribe_to_list(params={"search": "test"}) for _ in range(3)
+        ]
+        recorder = SlowFirstSubscription(requests[0])
+        instrumentation.add_listener(recorder)
+        try:
+            todo = await self.make_todo()
+            for req in requests:
+                await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        finally:
+            instrumentation.remove_listener(recorder)
+
+        self.assertGreater(len(recorder.threads), 1)
+        self.assertTrue(all(name.startswith("rest-live-eval") for name in recorder.threads))
@@ -0,0 +1,266 @@
+import enum
+from types import SimpleNamespace
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.db import models
+from django.db.models import F, Q
+from django.db.models.functions import Length
+from django.test import SimpleTestCase
+from rest_framework import serializers
+
+from rest_live import CREATED, DELETED, UPDATED, index, predicates
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import BroadcastRecorder, async_test
+from test_app.models import List, Todo
+from test_app.serializers import TodoSerializer
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class Color(enum.Enum):
+    RED = "r"
+    BLUE = "b"
+
+
+class ColorField(models.CharField):
+    """
+    Holds a `Color` in Python and its value in the database.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Color(value)
+
+    def get_prep_value(self, value):
+        return value.value if isinstance(value, Color) else value
+
+
+class Paint(models.Model):
+    color = ColorField(max_length=1)
+
+    class Meta:
+        app_label = "test_app"
+        managed = False
+
+
+class CompileQuerysetTests(SimpleTestCase):
+    """
+    Tests for compiling querysets into in-memory predicates.
+    """
+
+    def setUp(self):
+        self.todo = Todo(pk=1, text="Buy milk", done=False, list_id=3)
+
+    def matches(self, queryset, instance=None):
+        predicate = predicates.compile_queryset(queryset)
+        self.assertIsNotNone(predicate)
+        return predicate(instance or self.todo)
+
+    def test_unfiltered(self):
+        self.assertTrue(self.matches(Todo.objects.all()))
+
+    def test_none(self):
+        self.assertFalse(self.matches(Todo.objects.none()))
+
+    def test_lookups(self):
+        self.assertTrue(self.matches(Todo.objects.filter(text="Buy milk")))
+        self.assertFalse(self.matches(Todo.objects.filter(text="buy milk")))
+        self.assertTrue(self.matches(Todo.objects.filter(text__iexact="buy MILK")))
+        self.assertTrue(self.matches(Todo.objects.filter(text__contains="milk")))
+        self.assertTrue(self.matches(Todo.objects.filter(text__icontains="MILK")))
+        self.assertTrue(self.matches(Todo.objects.filter(list_id__in=[1, 3])))
+        self.assertTrue(self.matches(Todo.objects.filter(list=3, done=False)))
+        self.assertFalse(self.matches(Todo.objects.filter(pk__gt=1)))
+        self.assertTrue(self.matches(Todo.objects.filter(pk__lte=1)))
+
+    def test_custom_field(self):
+        # Filter values are prep values, so the instance's value is prepared before being compared.
+        paint = Paint(pk=1, color=Color.RED)
+        self.assertTrue(self.matches(Paint.objects.filter(color=Color.RED), paint))
+        self.assertTrue(self.matches(Paint.objects.filter(color__in=[Color.RED]), paint))
+        self.assertFalse(self.matches(Paint.objects.filter(color=Color.BLUE), paint))
+
+    def test_string_semantics(self):
+        # SQLite's LIKE folds the case of ASCII letters only.
+        self.assertTrue(self.matches(Todo.objects.filter(text__contains="MILK")))
+        todo = Todo(pk=1, text="Straße", list_id=3)
+        self.assertFalse(self.matches(Todo.objects.filter(text__iexact="STRASSE"), todo))
+        self.assertFalse(self.matches(Todo.objects.filter(text__icontains="SSE"), todo))
+        self.assertTrue(self.matches(Todo.objects.filter(text__icontains="STRA"), todo))
+
+        with mock.patch.object(
+            predicates, "connections", {"default": SimpleNamespace(vendor="postgresql")}
+        ):
+            self.assertFalse(self.matches(Todo.objects.filter(text__contains="MILK")))
+            self.assertTrue(self.matches(Todo.objects.filter(text__icontains="MILK")))
+            self.assertIsNone(predicates.compile_queryset(Todo.objects.filter(text__gt="a")))
+            predicate = predicates.compile_queryset(Todo.objects.filter(text__iexact="x"))
+            with self.assertRaises(predicates.Unsupported):
+                predicate(todo)
+
+        with mock.patch.object(
+            predicates, "connections", {"default": SimpleNamespace(vendor="mysql")}
+        ):
+            self.assertTrue(self.matches(Todo.objects.filter(list=3)))
+            for queryset in [
+                Todo.objects.filter(text="Buy milk"),
+                Todo.objects.filter(text__in=["Buy milk"]),
+                Todo.objects.filter(text__icontains="milk"),
+            ]:
+                self.assertIsNone(predicates.compile_queryset(queryset), queryset.query)
+
+    def test_type_error_unsupported(self):
+        predicate = predicates.compile_queryset(Todo.objects.filter(list_id__in=[1, 3]))
+        with self.assertRaises(predicates.Unsupported):
+            predicate(Todo(pk=1, list_id=[1]))
+        predicate = predicates.compile_queryset(Todo.objects.filter(list_id__gt=1))
+        with self.assertRaises(predicates.Unsupported):
+            predicate(Todo(pk=1, list_id=[2]))
+
+    def test_connectors(self):
+        self.assertTrue(self.matches(Todo.objects.filter(Q(done=True) | Q(list=3))))
+        self.assertFalse(self.matches(Todo.objects.exclude(text__icontains="milk")))
+        self.assertTrue(self.matches(Todo.objects.exclude(done=True)))
+
+    def test_null_is_unknown(self):
+        todo = Todo(pk=1, text=None, list_id=3)
+        self.assertTrue(self.matches(Todo.objects.filter(text__isnull=True), todo))
+        self.assertFalse(self.matches(Todo.objects.filter(text="x"), todo))
+        self.assertFalse(self.matches(Todo.objects.exclude(text="x"), todo))
+
+    def test_is_unfiltered(self):
+        self.assertTrue(predicates.is_unfiltered(Todo.objects.all()))
+        self.assertTrue(predicates.is_unfiltered(Todo.objects.select_related("list")))
+        self.assertFalse(predicates.is_unfiltered(Todo.objects.filter(done=True)))
+        self.assertFalse(predicates.is_unfiltered(Todo.objects.none()))
+        self.assertFalse(predicates.is_unfiltered(Todo.objects.all()[:5]))
+        self.assertFalse(
+            predicates.is_unfiltered(Todo.objects.annotate(length=Length("text")))
+        )
+
+    def test_unsupported(self):
+        for queryset in [
+            Todo.objects.filter(list__name="groceries"),
+            Todo.objects.filter(text=F("list__name")),
+            Todo.objects.filter(text__startswith="Buy"),
+            Todo.objects.annotate(length=Length("text")),
+            Todo.objects.filter(list__in=List.objects.all()),
+            Todo.objects.all()[:10],
+            Todo.objects.values("text"),
+        ]:
+            self.assertIsNone(predicates.compile_queryset(queryset), queryset.query)
+
+
+class InMemoryTodoViewSet(TodoViewSet):
+    live_in_memory_filters = True
+
+
+class ListNameSerializer(TodoSerializer):
+    list_name = serializers.CharField(source="list.name", read_only=True)
+
+    class Meta(TodoSerializer.Meta):
+        fields = TodoSerializer.Meta.fields + ["list_name"]
+
+
+class SelectRelatedTodoViewSet(InMemoryTodoViewSet):
+    queryset = Todo.objects.select_related("list")
+    serializer_class = ListNameSerializer
+
+
+class InMemoryFilterTests(RestLiveTestCase):
+    """
+    Tests for broadcasting with `live_in_memory_filters`.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter(uid="in-memory")
+        router.register(InMemoryTodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    @async_test
+    async def test_instance_fetched_once_per_event(self):
+        req1 = await self.subscribe_to_list(params={"search": "milk"})
+        req2 = await self.subscribe_to_list(params={"search": "eggs"})
+        req3 = await self.subscribe_to_list()
+
+        with BroadcastRecorder(InMemoryTodoViewSet) as recorder:
+            todo = await self.make_todo("buy milk")
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req1)
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req3)
+            self.assertTrue(await self.client.receive_nothing())
+        self.assertEqual(1, sum(trace.query_count for trace in recorder.traces))
+
+        todo.text = "buy eggs"
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, DELETED, req1)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req2)
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req3)
+        self.assertTrue(await self.client.receive_nothing())
+
+    @async_test
+    async def test_related_lookups_kept(self):
+        router = RealtimeRouter(uid="in-memory-related")
+        router.register(SelectRelatedTodoViewSet)
+        client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await client.connect())[0])
+        request_id = await self.subscribe_to_list(client)
+
+        with BroadcastRecorder(SelectRelatedTodoViewSet) as recorder:
+            todo = await self.make_todo("buy milk")
+            await self.assertResponseEquals(
+                self.make_todo_sub_response(
+                    todo, CREATED, request_id, serializer=ListNameSerializer
+                ),
+                client,
+            )
+        # The list is fetched along with the instance rather than when serializing it.
+        self.assertEqual(1, sum(trace.query_count for trace in recorder.traces))
+        await client.disconnect()
+
+
+class IndexKeyTests(SimpleTestCase):
+    """
+    Tests for finding the filter value to index a subscription's queryset by.
+    """
+
+    def test_index_key(self):
+        fields = index.index_attnames(Todo, ["list", "done"])
+        self.assertEqual(["list_id", "done"], fields)
+        self.assertEqual(("list_id", 3), index.index_key(Todo.objects.filter(list=3), fields))
+        self.assertEqual(
+            ("done", True),
+            index.index_key(Todo.objects.filter(text__icontains="a", done=True), fields),
+        )
+        self.assertIsNone(index.index_key(Todo.objects.filter(text="a"), fields))
+        self.assertIsNone(index.index_key(Todo.objects.exclude(list=3), fields))
+        self.assertIsNone(
+            index.index_key(Todo.objects.filter(Q(list=3) | Q(list=4)), fields)
+        )
+
+    def test_index_values(self):
+        # Instance values are indexed in the same form as filter values.
+        key = index.index_key(Paint.objects.filter(color=Color.RED), ["color"])
+        self.assertEqual(("color", "r"), key)
+        self.assertEqual({"color": "r"}, index.index_values(Paint, {"color": Color.RED}))
+        self.assertIsNone(index.index_values(Todo, {"list_id": [3]}))
+
+    def test_subscription_index(self):
+        subscriptions = index.SubscriptionIndex()
+        subscriptions.add("a", ("list_id", 1))
+        subscriptions.add("a", ("list_id", 1))
+        subscriptions.add("b", ("list_id", 2))
+        subscriptions.add("c")
+        self.assertEqual({"a", "c"}, subscriptions.match({"list_id": 1}))
+        self.assertEqual({"b"}, subscriptions.match({"list_id": 2}, unindexed=False))
+
+        subscriptions.discard("a", ("list_id", 1))
+        self.assertEqual({"a", "c"}, subscriptions.match({"list_id": 1}))
+        subscriptions.discard("a", ("list_id", 1))
+        subscriptions.discard("c")
+        self.assertEqual(set(), subscriptions.match({"list_id": 1}))
+        self.assertEqual({"b"}, subscriptions.members())
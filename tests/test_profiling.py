@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from channels.db import database_sync_to_async as db
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+
+from rest_live import CREATED, UPDATED, instrumentation, profiling
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class ProfilerTests(RestLiveTestCase):
+    """
+    Tests for the per-view cost profiler and its dump command.
+    """
+
+    async def asyncSetUp(self):
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        connected, _ = await self.client.connect()
+        self.assertTrue(connected)
+        self.list = await db(List.objects.create)(name="test list")
+        self.dump_dir = tempfile.mkdtemp()
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+        profiling.uninstall()
+        shutil.rmtree(self.dump_dir)
+
+    def entry(self, profiler, stage, action="list"):
+        return profiler.entries[(profiling.view_label(TodoViewSet), action, stage)]
+
+    @async_test
+    async def test_stages_recorded(self):
+        with override_settings(REST_LIVE={"PROFILE": True}):
+            profiler = profiling.install()
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+
+        for stage in instrumentation.STAGES:
+            self.assertEqual(2, self.entry(profiler, stage).count)
+        self.assertGreater(self.entry(profiler, instrumentation.QUERYSET).query_time, 0)
+        self.assertEqual(0, self.entry(profiler, instrumentation.RENDER).query_time)
+
+    @async_test
+    async def test_table_is_bounded(self):
+        profiler = profiling.Profiler(max_entries=2)
+        profiler.record("View", "list", "view", 0.5, 0)
+        profiler.record("View", "list", "queryset", 0.1, 0)
+        profiler.record("View", "list", "serialize", 0.3, 0)
+        self.assertEqual(
+            {("View", "list", "view"), ("View", "list", "serialize")},
+            set(profiler.entries),
+        )
+
+    @async_test
+    async def test_sampling(self):
+        profiler = profiling.Profiler(sample_rate=0)
+        instrumentation.add_listener(profiler)
+        try:
+            req = await self.subscribe_to_list()
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        finally:
+            instrumentation.remove_listener(profiler)
+        self.assertEqual({}, profiler.entries)
+
+    @async_test
+    async def test_dump_command(self):
+        with override_settings(
+            REST_LIVE={"PROFILE": True, "PROFILE_DIR": self.dump_dir}
+        ):
+            profiler = profiling.install()
+            req = await self.subscribe_to_list()
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+
+            out = StringIO()
+            call_command("rest_live_profile", "--top", "2", "--sort", "count", stdout=out)
+            lines = out.getvalue().splitlines()
+            self.assertEqual(3, len(lines))
+            self.assertIn(profiling.view_label(TodoViewSet), lines[1])
+
+            # Dumps from other processes are merged into the live table.
+            profiler.flush()
+            os.rename(
+                os.path.join(self.dump_dir, f"{profiling.DUMP_PREFIX}{os.getpid()}.json"),
+                os.path.join(self.dump_dir, f"{profiling.DUMP_PREFIX}0.json"),
+            )
+            entries = profiling.load_entries(self.dump_dir)
+            self.assertTrue(all(entry.count == 2 for entry in entries))
+
+    @async_test
+    async def test_dump_command_without_data(self):
+        with self.assertRaises(CommandError):
+            call_command("rest_live_profile", "--dir", self.dump_dir, stdout=StringIO())
+
+    @async_test
+    async def test_cprofile_capture_over_budget(self):
+        profiler = profiling.Profiler(dump_dir=self.dump_dir, budget=0)
+        instrumentation.add_listener(profiler)
+        try:
+            req = await self.subscribe_to_list()
+            todo = await self.make_todo()
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+            self.assertIn(
+                (profiling.view_label(TodoViewSet), "list"), profiler.over_budget
+            )
+            await db(todo.save)()
+            await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        finally:
+            instrumentation.remove_listener(profiler)
+
+        captures = [name for name in os.listdir(self.dump_dir) if name.endswith(".prof")]
+        self.assertEqual(1, len(captures))
+
+
+class SlowQueryLogTests(RestLiveTestCase):
+    """
+    Tests for capturing slow membership queries along with their query plans.
+    """
+
+    async def asyncSetUp(self):
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        connected, _ = await self.client.connect()
+        self.assertTrue(connected)
+        self.list = await db(List.objects.create)(name="test list")
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+        instrumentation.uninstall_slow_query_log()
+
+    @async_test
+    async def test_captures_and_explains(self):
+        instrumentation.install_slow_query_log(0)
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+
+        findings = instrumentation.get_slow_queries()
+        self.assertEqual(1, len(findings))
+        finding = findings[0]
+        self.assertIs(TodoViewSet, finding.view_class)
+        self.assertEqual("default", finding.alias)
+        self.assertEqual(2, finding.count)
+        self.assertIn("test_app_todo", finding.sql)
+        self.assertTrue(finding.explain)
+        self.assertFalse(finding.explain.startswith("EXPLAIN failed"))
+
+    @async_test
+    async def test_explain_rate_limited(self):
+        log = instrumentation.install_slow_query_log(0, explains_per_minute=1)
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        explained_at = instrumentation.get_slow_queries()[0].explained_at
+
+        log.explain_interval = 0
+        await db(todo.save)()
+        await self.assertReceivedBroadcastForTodo(todo, UPDATED, req)
+        self.assertEqual(explained_at, instrumentation.get_slow_queries()[0].explained_at)
+
+    @async_test
+    async def test_fast_queries_ignored(self):
+        instrumentation.install_slow_query_log(60)
+        req = await self.subscribe_to_list()
+        todo = await self.make_todo()
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, req)
+        self.assertEqual([], instrumentation.get_slow_queries())
+
+    @async_test
+    async def test_query_shape(self):
+        self.assertEqual(
+            instrumentation.query_shape('SELECT "id" FROM "t" WHERE "id" IN (%s, %s)'),
+            instrumentation.query_shape('SELECT "id"\n FROM "t" WHERE "id" IN (%s)'),
+        )
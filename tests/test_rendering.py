@@ -0,0 +1,144 @@
+import datetime
+import decimal
+import uuid
+from unittest import mock
+
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from rest_live import CREATED, rendering, signals
+from rest_live.consumers import ChangeSet
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.serializers import TodoSerializer
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+PAYLOADS = [
+    {"id": 1, "text": "Buy milk", "done": False, "list": None},
+    {"text": "café     \"quoted\"", "nested": [1, 2.5, {"a": True}]},
+    {
+        "when": datetime.datetime(2021, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+        "date": datetime.date(2021, 1, 2),
+        "amount": decimal.Decimal("1.10"),
+        "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "tuple": (1, 2),
+        1: "int key",
+    },
+    {"large": 1e16, "small": [1e-7, 0.0001], "precise": 1.2345678901234568e17},
+    {"amount": decimal.Decimal("1E+20")},
+]
+
+
+class RenderingTests(SimpleTestCase):
+    """
+    Tests that fast-path broadcasts are identical to rendering the whole envelope.
+    """
+
+    def render(self, renderer, data):
+        prefix = rendering.envelope_prefix(
+            renderer,
+            {"type": "broadcast", "id": 7, "model": "test_app.Todo", "action": CREATED},
+        )
+        self.assertIsNotNone(prefix)
+        return prefix + rendering.encode(data, renderer) + "}"
+
+    def expected(self, renderer, data):
+        return renderer.render(
+            {
+                "type": "broadcast",
+                "id": 7,
+                "model": "test_app.Todo",
+                "action": CREATED,
+                "instance": data,
+            }
+        ).decode("utf-8")
+
+    def test_json_module(self):
+        with mock.patch.object(rendering, "orjson", None):
+            for data in PAYLOADS:
+                self.assertEqual(self.expected(JSONRenderer(), data), self.render(JSONRenderer(), data))
+
+    def test_orjson(self):
+        for data in PAYLOADS:
+            self.assertEqual(self.expected(JSONRenderer(), data), self.render(JSONRenderer(), data))
+
+    def test_non_finite_floats(self):
+        renderer = JSONRenderer()
+        for value in [float("nan"), float("inf")]:
+            data = {"value": [value]}
+            with self.assertRaises(ValueError):
+                renderer.render(data)
+            with self.assertRaises(ValueError):
+                rendering.encode(data, renderer)
+        renderer.strict = False
+        data = {"value": [float("nan"), float("-inf")]}
+        self.assertEqual(self.expected(renderer, data), self.render(renderer, data))
+
+    def test_renderer_options(self):
+        renderer = JSONRenderer()
+        renderer.compact = False
+        renderer.ensure_ascii = True
+        for data in PAYLOADS:
+            self.assertEqual(self.expected(renderer, data), self.render(renderer, data))
+
+    def test_overridden_render(self):
+        class CustomRenderer(JSONRenderer):
+            def render(self, data, accepted_media_type=None, renderer_context=None):
+                return super().render(data, accepted_media_type, renderer_context)
+
+        self.assertTrue(rendering.is_fast_renderer(JSONRenderer()))
+        self.assertFalse(rendering.is_fast_renderer(CustomRenderer()))
+
+    def test_payload_encoded_once(self):
+        changes = ChangeSet("test_app.Todo", "model.saved")
+        data = PAYLOADS[0]
+        with mock.patch.object(rendering, "encode", wraps=rendering.encode) as encode:
+            first = changes.payload(data, JSONRenderer())
+            self.assertEqual(first, changes.payload(data, JSONRenderer()))
+            changes.payload(dict(data), JSONRenderer())
+        self.assertEqual(2, encode.call_count)
+
+
+@override_settings(REST_LIVE={"SERIALIZER_CACHE_SIZE": 100})
+class SharedPayloadTests(RestLiveTestCase):
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+        # The test settings render camel-cased JSON, which doesn't take the fast path.
+        self.patches = [
+            mock.patch.dict(signals.version_fields, {"test_app.Todo": "text"}),
+            mock.patch.object(TodoViewSet, "renderer_classes", [JSONRenderer]),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    async def asyncTearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        await self.client.disconnect()
+
+    @async_test
+    async def test_shared_payload_encoded_once(self):
+        first = await self.subscribe_to_list()
+        second = await self.subscribe_to_list()
+        with mock.patch.object(rendering, "encode", wraps=rendering.encode) as encode:
+            todo = await self.make_todo()
+            for request_id in (first, second):
+                response = await self.client.receive_json_from()
+                self.assertEqual(
+                    {
+                        "type": "broadcast",
+                        "id": request_id,
+                        "model": "test_app.Todo",
+                        "action": CREATED,
+                        "instance": TodoSerializer(todo).data,
+                    },
+                    response,
+                )
+        encode.assert_called_once()
@@ -0,0 +1,81 @@
+import asyncio
+
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED
+from rest_live.routers import RealtimeRouter
+from rest_live.scheduler import FairScheduler, get_scheduler
+from rest_live.testing import async_test
+from test_app.models import List
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class FairSchedulerTests(SimpleTestCase):
+    """
+    Tests for round-robin turns between connections.
+    """
+
+    @async_test
+    async def test_round_robin(self):
+        scheduler = FairScheduler(slots=1)
+        order = []
+
+        async def connection(name, turns):
+            for i in range(turns):
+                async with scheduler.turn():
+                    order.append(f"{name}{i}")
+                    await asyncio.sleep(0.01)
+
+        heavy = asyncio.ensure_future(connection("heavy", 3))
+        await asyncio.sleep(0)
+        light = asyncio.ensure_future(connection("light", 2))
+        await asyncio.gather(heavy, light)
+
+        self.assertEqual(["heavy0", "light0", "heavy1", "light1", "heavy2"], order)
+        stats = scheduler.stats()
+        self.assertEqual((5, 0, 0), (stats.turns, stats.active, stats.waiting))
+
+    @async_test
+    async def test_cancelled_turn(self):
+        scheduler = FairScheduler(slots=1)
+        async with scheduler.turn():
+            waiting = asyncio.ensure_future(scheduler.turn().__aenter__())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+        self.assertEqual(0, scheduler.active)
+        self.assertEqual(0, len(scheduler.waiting))
+
+
+@override_settings(REST_LIVE={"FAIR_SCHEDULING_QUANTUM": 2})
+class FairSchedulingBroadcastTests(RestLiveTestCase):
+    """
+    Tests for evaluating broadcasts in turns from the fair scheduler.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.heavy = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.light = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.heavy.connect())[0])
+        self.assertTrue((await self.light.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.heavy.disconnect()
+        await self.light.disconnect()
+
+    @async_test
+    async def test_turns(self):
+        heavy_requests = [await self.subscribe_to_list(self.heavy) for _ in range(5)]
+        light_request = await self.subscribe_to_list(self.light)
+        turns = get_scheduler().turns
+
+        todo = await self.make_todo()
+        for req in heavy_requests:
+            await self.assertReceivedBroadcastForTodo(todo, CREATED, req, self.heavy)
+        await self.assertReceivedBroadcastForTodo(todo, CREATED, light_request, self.light)
+        self.assertEqual(4, get_scheduler().turns - turns)
@@ -0,0 +1,166 @@
+from channels.db import database_sync_to_async as db
+from django.test import SimpleTestCase, override_settings
+
+from rest_live import CREATED, DELETED, MOVED, UPDATED
+from rest_live.routers import RealtimeRouter
+from rest_live.testing import BroadcastRecorder, async_test
+from rest_live.windows import Window, parse_ordering
+from test_app.models import List, Todo
+from test_app.views import TodoViewSet
+from tests.utils import RestLiveTestCase, make_client
+
+
+class WindowTests(SimpleTestCase):
+    """
+    Tests for keeping track of the first instances of a queryset.
+    """
+
+    def make_window(self, limit=2, boundary_size=1, ordering="text"):
+        return Window(limit, parse_ordering(Todo, ordering), boundary_size)
+
+    def load(self, window, *rows):
+        window.load([(window.sort_key({"text": text, "id": pk}), pk) for text, pk in rows])
+
+    def test_parse_ordering(self):
+        self.assertEqual([("text", True), ("id", False)], parse_ordering(Todo, "-text"))
+        self.assertEqual(
+            [("list_id", False), ("id", True)], parse_ordering(Todo, ["list", "-pk", "text"])
+        )
+        for ordering in ["owner", "list__name", 3, ["text", None]]:
+            with self.assertRaises(ValueError):
+                parse_ordering(Todo, ordering)
+
+    def test_descending_nulls_last(self):
+        window = Window(2, parse_ordering(List, "-name"), 0)
+        keys = [window.sort_key({"name": name, "id": 1}) for name in ["a", None, "b"]]
+        self.assertEqual([keys[2], keys[0], keys[1]], sorted(keys))
+
+    def test_insert(self):
+        window = self.make_window()
+        self.load(window, ("b", 2), ("d", 4), ("f", 6), ("h", 8))
+        self.assertFalse(window.exhausted)
+        self.assertEqual([2, 4, 6], window.pks)
+
+        # Instances after the boundary aren't tracked.
+        window.insert(10, window.sort_key({"text": "j", "id": 10}))
+        self.assertEqual([2, 4, 6], window.pks)
+
+        window.insert(1, window.sort_key({"text": "a", "id": 1}))
+        self.assertEqual([1, 2], window.visible_pks())
+        self.assertEqual([1, 2, 4], window.pks)
+
+    def test_refill(self):
+        window = self.make_window()
+        self.load(window, ("b", 2), ("d", 4), ("f", 6), ("h", 8))
+        window.discard(2)
+        self.assertFalse(window.needs_refill())
+        window.discard(4)
+        self.assertTrue(window.needs_refill())
+
+    def test_exhausted(self):
+        window = self.make_window()
+        self.load(window, ("b", 2))
+        self.assertTrue(window.exhausted)
+        window.insert(10, window.sort_key({"text": "j", "id": 10}))
+        window.discard(2)
+        self.assertFalse(window.needs_refill())
+        self.assertEqual([10], window.visible_pks())
+
+
+@override_settings(REST_LIVE={"WINDOW_BOUNDARY_SIZE": 1})
+class WindowedSubscriptionTests(RestLiveTestCase):
+    """
+    Tests for list subscriptions limited to the first instances of the queryset.
+    """
+
+    async def asyncSetUp(self):
+        self.list = await db(List.objects.create)(name="test list")
+        router = RealtimeRouter()
+        router.register(TodoViewSet)
+        self.client = make_client(router.as_consumer(), "/ws/subscribe/")
+        self.assertTrue((await self.client.connect())[0])
+
+    async def asyncTearDown(self):
+        await self.client.disconnect()
+
+    async def subscribe_to_window(self, limit, ordering=None, action="list"):
+        self.counter += 1
+        request = {
+            "type": "subscribe",
+            "id": self.counter,
+            "model": "test_app.Todo",
+            "action": action,
+            "limit": limit,
+        }
+        if ordering is not None:
+            request["ordering"] = ordering
+        if action == "retrieve":
+            request["lookup_by"] = (await self.make_todo()).pk
+        await self.client.send_json_to(request)
+        return self.counter
+
+    async def assertReceivedWindowBroadcast(self, todo, action, request_id, index=None):
+        expected = self.make_todo_sub_response(todo, action, request_id)
+        if index is not None:
+            expected["index"] = index
+        await self.assertResponseEquals(expected)
+
+    async def save(self, todo, text):
+        todo.text = text
+        await db(todo.save)()
+
+    @async_test
+    async def test_window(self):
+        a, b, c, _ = [await self.make_todo(text) for text in "abcd"]
+        request_id = await self.subscribe_to_window(2, "text")
+        self.assertTrue(await self.client.receive_nothing())
+
+        # Entering the window pushes the last instance out of it.
+        first = await self.make_todo("0")
+        await self.assertReceivedWindowBroadcast(b, DELETED, request_id)
+        await self.assertReceivedWindowBroadcast(first, CREATED, request_id, 0)
+
+        # Leaving the window brings the first instance of the boundary in.
+        await self.save(a, "e")
+        await self.assertReceivedWindowBroadcast(a, DELETED, request_id)
+        await self.assertReceivedWindowBroadcast(b, CREATED, request_id, 1)
+
+        # Once the boundary has run out, the window is queried again.
+        pk = first.pk
+        await db(first.delete)()
+        first.pk = pk
+        await self.assertReceivedWindowBroadcast(first, DELETED, request_id)
+        await self.assertReceivedWindowBroadcast(c, CREATED, request_id, 1)
+
+        with BroadcastRecorder(TodoViewSet) as recorder:
+            await self.save(b, "bb")
+            await self.assertReceivedWindowBroadcast(b, UPDATED, request_id, 0)
+            await self.save(b, "cc")
+            await self.assertReceivedWindowBroadcast(b, MOVED, request_id, 1)
+            # Changes after the window aren't broadcast.
+            await self.save(a, "f")
+            self.assertTrue(await self.client.receive_nothing())
+        self.assertEqual([1, 1, 1], [trace.query_count for trace in recorder.traces])
+
+    @async_test
+    async def test_default_ordering(self):
+        todos = [await self.make_todo(text) for text in "ab"]
+        request_id = await self.subscribe_to_window(1)
+        self.assertTrue(await self.client.receive_nothing())
+        pk = todos[0].pk
+        await db(todos[0].delete)()
+        todos[0].pk = pk
+        await self.assertReceivedWindowBroadcast(todos[0], DELETED, request_id)
+        await self.assertReceivedWindowBroadcast(todos[1], CREATED, request_id, 0)
+
+    @async_test
+    async def test_invalid(self):
+        for limit, ordering, action in [
+            (0, None, "list"),
+            ("10", None, "list"),
+            (10, "list__name", "list"),
+            (10, None, "retrieve"),
+        ]:
+            request_id = await self.subscribe_to_window(limit, ordering, action)
+            response = await self.client.receive_json_from()
+            self.assertEqual((request_id, 400), (response["id"], response["code"]))
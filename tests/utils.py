@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+
+from channels import __version__ as channels_version
 from channels.db import database_sync_to_async
 from channels.testing import WebsocketCommunicator
 from django.contrib.auth import get_user_model
@@ -6,7 +9,7 @@ from django.test import TransactionTestCase
 from djangorestframework_camel_case.util import camelize
 
 from rest_live import DELETED
-from rest_live.testing import APICommunicator
+from rest_live.testing import APICommunicator, BroadcastRecorder
 from test_app.models import List, Todo
 from test_app.serializers import TodoSerializer
 
@@ -15,6 +18,13 @@ User = get_user_model()
 db = database_sync_to_async
 
 
+def make_client(consumer, path, middleware=lambda x: x, headers=None):
+    if channels_version.startswith("2"):
+        return APICommunicator(middleware(consumer), path, headers)
+    else:
+        return APICommunicator(middleware(consumer.as_asgi()), path, headers)
+
+
 class RestLiveTestCase(TransactionTestCase):
     client: APICommunicator
     list: List
@@ -123,6 +133,37 @@ class RestLiveTestCase(TransactionTestCase):
             self.assertTrue(error, msg["code"])
         return request_id
 
+    @contextmanager
+    def assert_broadcast_queries(
+        self, view, max_queries=None, max_serialization_time=None
+    ):
+        """
+        Fail if any subscription to `view` evaluated within the block runs more than `max_queries`
+        SQL queries, or spends more than `max_serialization_time` seconds serializing, for a single event.
+        """
+        with BroadcastRecorder(view) as recorder:
+            yield recorder
+
+        self.assertTrue(
+            recorder.traces, f"No broadcasts were evaluated for {view.__name__}."
+        )
+        for trace in recorder.traces:
+            if max_queries is not None and trace.query_count > max_queries:
+                queries = "\n".join(f"  {query.sql}" for query in trace.queries)
+                self.fail(
+                    f"{view.__name__} ran {trace.query_count} queries for {trace.event_type} "
+                    f"on subscription {trace.request_id} (budget {max_queries}):\n{queries}"
+                )
+            if (
+                max_serialization_time is not None
+                and trace.serialization_time > max_serialization_time
+            ):
+                self.fail(
+                    f"{view.__name__} spent {trace.serialization_time:.4f}s serializing for "
+                    f"{trace.event_type} on subscription {trace.request_id} "
+                    f"(budget {max_serialization_time}s)"
+                )
+
     async def make_todo(self, text="test"):
         return await db(Todo.objects.create)(list=self.list, text=text)
 